@@ -391,83 +391,16 @@ class _ClassSearchSheetState extends State<_ClassSearchSheet>
     }
 
     try {
-      // Try course_sessions first, fall back to courses_catalog if permission denied
-      try {
-        // Get all course sessions and group them by course
-        final snapshot = await FirebaseFirestore.instance
-            .collection('course_sessions')
-            .orderBy('course_code')
-            .get();
-
-
-        final searchLower = query.toLowerCase();
-        final allSessions = snapshot.docs
-            .map((doc) => {...doc.data(), 'id': doc.id})
-            .where((session) {
-          final code = (session['course_code'] ?? '').toLowerCase();
-          final title = (session['course_title'] ?? '').toLowerCase();
-          final dept = (session['department'] ?? '').toLowerCase();
-          
-          return code.contains(searchLower) ||
-                 title.contains(searchLower) ||
-                 dept.contains(searchLower);
-        }).toList();
-
-        debugPrint('Filtered to ${allSessions.length} matching sessions');
-
-        // Group sessions by course code and title to create unique courses
-        final courseMap = <String, Map<String, dynamic>>{};
-        for (final session in allSessions) {
-          final courseKey = '${session['course_code']}-${session['course_title']}';
-          if (!courseMap.containsKey(courseKey)) {
-            courseMap[courseKey] = {
-              'id': courseKey,
-              'code': session['course_code'],
-              'title': session['course_title'],
-              'dept': session['department'],
-              'sessions': <Map<String, dynamic>>[],
-            };
-          }
-          courseMap[courseKey]!['sessions'].add(session);
-        }
-
-        final results = courseMap.values.take(50).toList();
-
-        if (mounted) {
-          setState(() {
-            _searchResults = results;
-            _isSearching = false;
-          });
-        }
-      } catch (sessionError) {
-        debugPrint('Course sessions failed, trying courses_catalog: $sessionError');
-        
-        // Fall back to courses_catalog
-        final snapshot = await FirebaseFirestore.instance
-            .collection('courses_catalog')
-            .orderBy('code')
-            .get();
-
-        final searchLower = query.toLowerCase();
-        final results = snapshot.docs
-            .map((doc) => {...doc.data(), 'id': doc.id})
-            .where((course) {
-          final code = (course['code'] ?? '').toLowerCase();
-          final title = (course['title'] ?? '').toLowerCase();
-          final dept = (course['dept'] ?? '').toLowerCase();
-          
-          return code.contains(searchLower) ||
-                 title.contains(searchLower) ||
-                 dept.contains(searchLower);
-        }).take(50)
-            .toList();
+      final results = await _keywordSearch(
+        FirebaseFirestore.instance.collection('courses_catalog'),
+        query,
+      );
 
-        if (mounted) {
-          setState(() {
-            _searchResults = results;
-            _isSearching = false;
-          });
-        }
+      if (mounted) {
+        setState(() {
+          _searchResults = results;
+          _isSearching = false;
+        });
       }
     } catch (e) {
       if (mounted) {
@@ -479,29 +412,68 @@ class _ClassSearchSheetState extends State<_ClassSearchSheet>
     }
   }
 
-  Future<void> _searchInstructors(String query) async {
-    try {
-      // Search all teachers in teachers_dir collection
-      final snapshot = await FirebaseFirestore.instance
-          .collection('teachers_dir')
-          .orderBy('fullName')
-          .get();
+  /// Normalizes search text the same way the sync service builds
+  /// `searchKeywords` (infra/teacher_dir_sync_py/search_index.py).
+  String _normalizeSearch(String text) {
+    return text
+        .toLowerCase()
+        .replaceAll(RegExp(r'[^a-z0-9]+'), ' ')
+        .trim();
+  }
+
+  /// Looks up documents by their precomputed `searchKeywords` array.
+  ///
+  /// The whole query is tried as a phrase prefix first; if that finds
+  /// nothing, the longest token is looked up and the remaining tokens are
+  /// matched against each result's keywords.
+  Future<List<Map<String, dynamic>>> _keywordSearch(
+    CollectionReference<Map<String, dynamic>> collection,
+    String query,
+  ) async {
+    const maxResults = 50;
+    const maxPrefix = 20;
+
+    final phrase = _normalizeSearch(query);
+    if (phrase.isEmpty) return [];
 
-      final searchLower = query.toLowerCase();
-      final results = snapshot.docs
+    Future<List<Map<String, dynamic>>> lookup(String keyword) async {
+      final key = keyword.length > maxPrefix ? keyword.substring(0, maxPrefix) : keyword;
+      final snapshot = await collection
+          .where('searchKeywords', arrayContains: key)
+          .limit(maxResults)
+          .get();
+      return snapshot.docs
           .map((doc) => {...doc.data(), 'id': doc.id})
-          .where((teacher) {
-        if (query.isEmpty) return true; // Show all if no search query
-        
-        final fullName = (teacher['fullName'] ?? '').toLowerCase();
-        final email = (teacher['email'] ?? '').toLowerCase();
-        final department = (teacher['department'] ?? '').toLowerCase();
-        
-        return fullName.contains(searchLower) ||
-               email.contains(searchLower) ||
-               department.contains(searchLower);
-      }).take(50)
+          .where((doc) => doc['deleted'] != true)
           .toList();
+    }
+
+    if (phrase.length <= maxPrefix) {
+      final results = await lookup(phrase);
+      if (results.isNotEmpty) return results;
+    }
+
+    final tokens = phrase.split(' ')..sort((a, b) => b.length.compareTo(a.length));
+    if (tokens.length == 1 && phrase.length <= maxPrefix) return [];
+    final results = await lookup(tokens.first);
+    return results.where((doc) {
+      final keywords = List<String>.from(doc['searchKeywords'] ?? const []);
+      return tokens.skip(1).every((t) => keywords.contains(
+          t.length > maxPrefix ? t.substring(0, maxPrefix) : t));
+    }).toList();
+  }
+
+  Future<void> _searchInstructors(String query) async {
+    try {
+      final teachers = FirebaseFirestore.instance.collection('teachers_dir');
+      final List<Map<String, dynamic>> results;
+      if (_normalizeSearch(query).isEmpty) {
+        // Show the first page of the directory if no search query
+        final snapshot = await teachers.orderBy('fullName').limit(50).get();
+        results = snapshot.docs.map((doc) => {...doc.data(), 'id': doc.id}).toList();
+      } else {
+        results = await _keywordSearch(teachers, query);
+      }
 
       if (mounted) {
         setState(() {
@@ -491,6 +491,7 @@ class _CourseSearchSheetState extends State<_CourseSearchSheet> {
       final searchLower = query.toLowerCase();
       final results = snapshot.docs
           .map((doc) => {...doc.data(), 'id': doc.id})
+          .where((session) => session['deleted'] != true)
           .where((session) {
         final code = (session['course_code'] ?? '').toLowerCase();
         final title = (session['course_title'] ?? '').toLowerCase();
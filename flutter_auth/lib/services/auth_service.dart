@@ -47,7 +47,8 @@ class AuthService {
           .limit(1)
           .get();
 
-      if (teacherQuery.docs.isEmpty) {
+      // Teachers who left the directory may linger as tombstones until they expire
+      if (teacherQuery.docs.isEmpty || teacherQuery.docs.first.data()['deleted'] == true) {
         // Not a teacher - sign out and return null
         debugPrint('❌ Email $email not found in teachers_dir');
         await signOut();
@@ -106,7 +107,7 @@ class AuthService {
           .limit(1)
           .get();
 
-      if (teacherQuery.docs.isEmpty) {
+      if (teacherQuery.docs.isEmpty || teacherQuery.docs.first.data()['deleted'] == true) {
         debugPrint('❌ TEST: Email not found in teachers_dir');
         return null;
       }
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Time instructor name -> email resolution over a realistic name corpus
+
+Usage: bench_email_resolver.py [--faculty N] [--sections N] [--seed N]
+
+Builds a faculty directory of N names and a course listing where each
+section names one or two of them the way FOSE does ("J. Doe",
+"Doe, Jane", "Dr. Jane Doe (Primary)", ...), some of them instructors
+missing from the directory. Compares the old inline first.last guess with
+the resolver, uncached and memoized.
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+# Add the parent directory to the path so we can import the resolver module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from instructors import EmailResolver, faculty_email
+
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David",
+               "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah",
+               "Christopher", "Karen", "Daniel", "Lisa", "Matthew", "Nancy", "Anthony", "Betty", "Mark",
+               "Margaret", "Steven", "Sandra", "Alexander", "Katherine", "Wei", "Priya", "Jose", "Fatima"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore",
+              "Jackson", "Martin", "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark",
+              "Ramirez", "Lewis", "Robinson", "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres",
+              "Nguyen", "Hill", "Flores", "Green", "Adams", "Nelson", "Baker", "Hall", "Rivera", "Campbell",
+              "Mitchell", "Carter", "Roberts", "Chen", "Patel", "O'Brien", "Garcia-Lopez", "Van Dyke"]
+DEGREES = ["", "", ", Ph.D.", ", Ph.D.", ", J.D.", ", M.B.A."]
+
+
+def legacy_email(instructor_name):
+    """The per-session derivation this replaces, kept as the baseline"""
+    clean_name = re.sub(r'\s*\([^)]*\)', '', instructor_name).strip()
+    name_parts = clean_name.split()
+    if len(name_parts) >= 2:
+        first = name_parts[0].lower()
+        last = name_parts[-1].lower()
+        first = re.sub(r'^(dr|prof|professor)\.?', '', first)
+        first = re.sub(r'\.', '', first)
+        last = re.sub(r'\.', '', last)
+        if first and last:
+            return f"{first}.{last}@slu.edu"
+    return ""
+
+
+def build_corpus(faculty_count, section_count, rng):
+    people = set()
+    while len(people) < faculty_count:
+        middle = f" {rng.choice('ABCDEFGHJKLMNPRST')}." if rng.random() < 0.3 else ""
+        people.add((rng.choice(FIRST_NAMES), middle, rng.choice(LAST_NAMES)))
+    people = sorted(people)
+    directory = [(f"{first}{middle} {last}{rng.choice(DEGREES)}", faculty_email(f"{first}{middle} {last}"))
+                 for first, middle, last in people]
+    # Adjuncts teach sections but are not in the directory
+    outsiders = [(rng.choice(FIRST_NAMES), "", f"{rng.choice(LAST_NAMES)}son") for _ in range(faculty_count // 5)]
+
+    def listed(first, middle, last):
+        style = rng.random()
+        if style < 0.45:
+            return f"{first} {last}"
+        if style < 0.65:
+            return f"{first[0]}. {last}"
+        if style < 0.75:
+            return f"{last}, {first}"
+        if style < 0.85:
+            return f"Dr. {first}{middle} {last}"
+        return f"{first} {last} (Primary)"
+
+    # (listing, the directory email it should resolve to or "")
+    listings = []
+    for _ in range(section_count):
+        roll = rng.random()
+        if roll < 0.1:
+            continue  # Staff / TBA sections name no one
+        person = rng.choice(outsiders if roll < 0.2 else people)
+        listings.append((listed(*person), "" if roll < 0.2 else faculty_email(" ".join(person))))
+        if rng.random() < 0.1:
+            person = rng.choice(people)
+            listings.append((listed(*person), faculty_email(" ".join(person))))
+    return directory, listings
+
+
+def bench(label, resolve, names, truth):
+    started = time.perf_counter()
+    emails = [resolve(name) for name in names]
+    elapsed = time.perf_counter() - started
+    correct = sum(1 for email, want in zip(emails, truth) if want and email == want)
+    wanted = sum(1 for want in truth if want)
+    print(f"{label:<22} {elapsed * 1e9 / len(names):>8.0f} ns/name {elapsed * 1000:>8.1f} ms total "
+          f"{correct:>6}/{wanted} directory matches")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--faculty", type=int, default=300)
+    parser.add_argument("--sections", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    directory, listings = build_corpus(args.faculty, args.sections, random.Random(args.seed))
+    names = [name for name, _ in listings]
+    truth = [email for _, email in listings]
+    print(f"{len(directory)} faculty, {len(names)} instructor listings, {len(set(names))} distinct names")
+
+    started = time.perf_counter()
+    resolver = EmailResolver(directory)
+    print(f"index build            {(time.perf_counter() - started) * 1000:>8.2f} ms")
+
+    bench("legacy inline guess", legacy_email, names, truth)
+    bench("resolver, uncached", lambda name: resolver.match(name)[0], names, truth)
+    bench("resolver, memoized", EmailResolver(directory).resolve, names, truth)
+
+    memo = EmailResolver(directory)
+    for name in names:
+        memo.resolve(name)
+    print(f"match breakdown        {memo.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Compare parse time and memory of the faculty directory parser engines
+
+Usage: bench_faculty_parse.py [--fetch] [fixture.html ...]
+Defaults to fixtures/faculty_directory.html; --fetch saves a fresh copy of
+SLU_FACULTY_LIST_URL there first.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+# Add the parent directory to the path so we can import the parser module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from faculty_parser import ENGINES
+
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "faculty_directory.html")
+ROUNDS = 20
+
+
+def fetch_fixture(path):
+    import requests
+    url = os.environ.get("SLU_FACULTY_LIST_URL", "https://www.slu.edu/business/about/faculty/directory.php")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    html = requests.get(url, timeout=30).text
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    print(f"Saved {url} -> {path}")
+
+
+def bench_engine(name, parse, html):
+    try:
+        parse(html)  # warm up imports and compiled selectors
+    except ImportError as e:
+        print(f"{name:<6} unavailable ({e})")
+        return None
+
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        pairs = parse(html)
+    per_parse = (time.perf_counter() - started) / ROUNDS
+
+    tracemalloc.start()
+    parse(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<6} {per_parse * 1000:>8.2f} ms/parse {peak / 1024:>10.1f} KiB peak {len(pairs):>5} links")
+    return pairs
+
+
+def bench_fixture(path):
+    with open(path, encoding="utf-8", errors="replace") as f:
+        html = f.read()
+    print(f"\n=== {os.path.basename(path)} ({len(html) / 1024:.1f} KiB) ===")
+    results = {name: bench_engine(name, parse, html) for name, parse in ENGINES.items()}
+    found = {name: pairs for name, pairs in results.items() if pairs is not None}
+    if len(found) > 1 and len({tuple(p) for p in found.values()}) > 1:
+        print("WARNING: engines disagree on the extracted links")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if "--fetch" in args:
+        args.remove("--fetch")
+        fetch_fixture(args[0] if args else DEFAULT_FIXTURE)
+    paths = args or [DEFAULT_FIXTURE]
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"Missing fixture {path}; run with --fetch to save one")
+            continue
+        bench_fixture(path)
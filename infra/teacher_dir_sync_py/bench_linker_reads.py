@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Compare the linker's old full-collection reads with projected, paginated streaming
+"""
+
+import json
+import sys
+import os
+import time
+
+# Add the parent directory to the path so we can import the main module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from main import LINK_READ_PAGE, LINK_SESSION_FIELDS, LINK_TEACHER_FIELDS
+from storage import get_store
+
+
+def _payload_bytes(data):
+    # Firestore doesn't expose wire sizes; the JSON size of what was returned is a close proxy
+    return len(json.dumps(data, default=str).encode("utf-8"))
+
+
+def measure(label, docs_iter):
+    started = time.perf_counter()
+    docs = 0
+    total = 0
+    for _, data in docs_iter:
+        docs += 1
+        total += _payload_bytes(data)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {docs:>7} docs {total / 1024:>10.1f} KiB {elapsed:>8.2f}s")
+    return total, elapsed
+
+
+def bench_linker_reads():
+    """Read course_sessions and teachers_dir both ways and report bytes and wall time"""
+    print("=== Linker reads: full documents vs projected stream ===")
+    store = get_store()
+
+    before = [
+        measure("course_sessions full docs", store.scan("course_sessions", page_size=LINK_READ_PAGE)),
+        measure("teachers_dir full docs", store.scan("teachers_dir", page_size=LINK_READ_PAGE)),
+    ]
+    after = [
+        measure("course_sessions projected stream",
+                store.scan("course_sessions", fields=LINK_SESSION_FIELDS, page_size=LINK_READ_PAGE)),
+        measure("teachers_dir projected stream",
+                store.scan("teachers_dir", fields=LINK_TEACHER_FIELDS, page_size=LINK_READ_PAGE)),
+    ]
+
+    before_bytes, before_time = sum(b for b, _ in before), sum(t for _, t in before)
+    after_bytes, after_time = sum(b for b, _ in after), sum(t for _, t in after)
+    print(f"\nBytes read: {before_bytes / 1024:.1f} KiB -> {after_bytes / 1024:.1f} KiB "
+          f"({after_bytes / max(before_bytes, 1):.1%})")
+    print(f"Wall time:  {before_time:.2f}s -> {after_time:.2f}s")
+
+
+if __name__ == "__main__":
+    bench_linker_reads()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark the sync pipeline offline against replayed fixtures
+
+Usage: bench_sync.py [fixtures dir]
+
+Responses are served from recorded or generated fixtures (see
+gen_fixtures.py) and every write goes to the Firestore emulator, so no
+live SLU site or real project is touched. Start the emulator first:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+
+or run with SYNC_STORE=memory to keep every document in process instead.
+Reports wall time, documents written and peak memory for each stage, plus
+the store's document reads and writes when running in memory. Exits with
+an error as soon as a stage fails, so a broken fixture set can't pass for
+a fast one.
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+# Add the parent directory to the path so we can import the main module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+os.environ["SYNC_HTTP_MODE"] = "replay"
+os.environ["SYNC_FIXTURES_DIR"] = sys.argv[1] if len(sys.argv) > 1 else os.path.join(HERE, "fixtures", "synthetic_x1")
+os.environ.setdefault("FIRESTORE_EMULATOR_HOST", "localhost:8080")
+os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "centrx-bench")
+os.environ.setdefault("SLU_FACULTY_LIST_URL", "https://www.slu.edu/business/about/faculty/directory.php")
+
+from http_client import ResponseCache
+from storage import MemoryStore, get_store
+from metrics import RssPeak
+import main
+
+
+def _written(result):
+    """Documents written by a stage, from whatever stats it returns"""
+    if "diff" in result:
+        return sum(d["added"] + d["changed"] + d["removed"] for d in result["diff"].values())
+    for key in ("updated", "teachers_updated"):
+        if key in result:
+            return result[key]
+    return 0
+
+
+def _failure(result):
+    """Why a stage's result counts as a failure, or None"""
+    if result.get("ok") is False:
+        return result.get("message") or "not ok"
+    for key in ("failed", "failed_shards", "failed_sources"):
+        if result.get(key):
+            return f"{len(result[key])} {key.replace('_', ' ')}"
+    return None
+
+
+def _store_counts():
+    store = get_store()
+    if isinstance(store, MemoryStore):
+        return store.reads, store.writes
+    return None, None
+
+
+def stage(name, fn, rows):
+    reads_before, writes_before = _store_counts()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with RssPeak() as rss:
+        result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    failure = _failure(result)
+    if failure:
+        sys.exit(f"Stage {name} failed: {failure}")
+    reads, writes = _store_counts()
+    if reads is not None:
+        reads, writes = reads - reads_before, writes - writes_before
+    rows.append((name, elapsed, _written(result), peak, rss.peak_mb, reads, writes))
+    return result
+
+
+def scrape_faculty_only():
+    faculty = main.scrape_faculty(ResponseCache()) or []
+    return {"faculty": len(faculty), "ok": bool(faculty), "message": "no faculty scraped"}
+
+
+def scrape_courses_only():
+    # Terms and subjects are discovered from the fixtures' search page, as in a sync
+    stats = {}
+    count = sum(1 for _ in main.scrape_courses_from_api(stats, ResponseCache(), force=True))
+    return {"sessions": count, "ok": count > 0, "message": "no course sessions scraped",
+            "failed_shards": stats["failed_shards"]}
+
+
+def bench_sync():
+    print(f"Replaying fixtures from {os.environ['SYNC_FIXTURES_DIR']}")
+    if isinstance(get_store(), MemoryStore):
+        print("Writing to an in-memory store\n")
+    else:
+        print(f"Firestore emulator at {os.environ['FIRESTORE_EMULATOR_HOST']}\n")
+
+    rows = []
+    stage("scrape_faculty", scrape_faculty_only, rows)
+    stage("scrape_courses", scrape_courses_only, rows)
+    stage("seed (teachers)", lambda: main.run_seed(force=True), rows)
+    stage("seed_courses", lambda: main.run_seed_courses(force=True), rows)
+    stage("link (full)", lambda: main.link_teachers_with_courses(full=True), rows)
+    stage("seed_courses (no-op)", lambda: main.run_seed_courses(), rows)
+    stage("link (incremental)", lambda: main.link_teachers_with_courses(), rows)
+
+    print(f"\n{'stage':<24} {'wall s':>8} {'writes':>8} {'py peak MiB':>12} {'peak rss MiB':>13} "
+          f"{'doc reads':>10} {'doc writes':>10}")
+    for name, elapsed, written, peak, rss, reads, writes in rows:
+        print(f"{name:<24} {elapsed:>8.2f} {written:>8} {peak / 2**20:>12.1f} {rss:>13.1f} "
+              f"{'-' if reads is None else reads:>10} {'-' if writes is None else writes:>10}")
+
+
+if __name__ == "__main__":
+    bench_sync()
@@ -0,0 +1,227 @@
+"""Pooled, rate-limited Firestore batch commits"""
+import os, time, random, threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import metrics
+from metrics import log
+
+# Firestore rejects batches over 500 writes; stay comfortably below it.
+MAX_BATCH_WRITES = 400
+WRITE_MAX_IN_FLIGHT = int(os.environ.get("WRITE_MAX_IN_FLIGHT", "4"))
+WRITE_OPS_PER_SECOND = float(os.environ.get("WRITE_OPS_PER_SECOND", "500"))
+WRITE_MAX_ATTEMPTS = int(os.environ.get("WRITE_MAX_ATTEMPTS", "3"))
+
+# kind is "set", "update" or "delete"; ref is a storage.DocRef
+WriteOp = namedtuple("WriteOp", ["kind", "ref", "data", "merge"], defaults=[None, False])
+
+
+class TokenBucket:
+  """Token bucket that lets callers borrow ahead and then sleeps off the debt.
+
+  Borrowing keeps a whole batch acquirable even when it is larger than the
+  bucket, while the long-run rate still never exceeds `rate` per second.
+  """
+
+  def __init__(self, rate: float, capacity: float = None):
+    self.rate = rate
+    self.capacity = capacity if capacity is not None else rate
+    self._tokens = self.capacity
+    self._last = time.monotonic()
+    self._lock = threading.Lock()
+
+  def acquire(self, n: int = 1):
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+      self._last = now
+      self._tokens -= n
+      delay = -self._tokens / self.rate if self._tokens < 0 else 0
+    if delay:
+      time.sleep(delay)
+
+
+class Checkpoint:
+  """Resume marker for a commit_writes run, stored in one document.
+
+  It records the path of the last write in the contiguous run of committed
+  chunks. Resuming skips every op up to and including that path, so the ops
+  must be produced in ascending ref.path order. A marker saved under another
+  `scope` belongs to a different op set and is ignored.
+  """
+
+  def __init__(self, store, ref, scope: str = None):
+    self.store = store
+    self.ref = ref
+    self.scope = scope
+    self.after = None
+
+  def load(self):
+    data = self.store.get(self.ref) or {}
+    if data.get("after") and data.get("scope") != self.scope:
+      log("WRITE", f"Ignoring checkpoint {self.ref.path} left by a different op set", severity="WARNING")
+      data = {}
+    self.after = data.get("after")
+    return self.after
+
+  def save(self, after: str):
+    self.after = after
+    self.store.set(self.ref, {"after": after, "scope": self.scope, "updatedAt": time.time()})
+
+  def clear(self):
+    self.after = None
+    self.store.delete(self.ref)
+
+
+def _backoff(attempt: int) -> float:
+  return min(8.0, 0.25 * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def _apply(batch, op: WriteOp):
+  if op.kind == "set":
+    batch.set(op.ref, op.data, merge=op.merge)
+  elif op.kind == "update":
+    batch.update(op.ref, op.data)
+  elif op.kind == "delete":
+    batch.delete(op.ref)
+  else:
+    raise ValueError(f"Unknown write kind: {op.kind}")
+
+
+def _chunks(ops, size: int):
+  chunk = []
+  for op in ops:
+    chunk.append(op)
+    if len(chunk) >= size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def commit_writes(store, ops, chunk_size: int = MAX_BATCH_WRITES, max_in_flight: int = None,
+                  ops_per_second: float = None, max_attempts: int = None, checkpoint: Checkpoint = None,
+                  on_committed=None) -> dict:
+  """Commit an iterable of WriteOps as chunked batches, several in flight at once.
+
+  A chunk that keeps failing is replayed one document at a time, so a single
+  bad write is retried (and reported) without redoing its neighbours.
+
+  With a `checkpoint`, ops already covered by it are skipped, and the first
+  chunk left with failed writes stops the run: nothing new is submitted and
+  the checkpoint is left just before that chunk, so the next run resumes there.
+  A run that finishes cleanly clears the checkpoint.
+  
+  `on_committed(ops)` is called from the submitting thread with the ops of
+  each finished chunk that were committed.
+  """
+  max_in_flight = max_in_flight or WRITE_MAX_IN_FLIGHT
+  ops_per_second = WRITE_OPS_PER_SECOND if ops_per_second is None else ops_per_second
+  max_attempts = max_attempts or WRITE_MAX_ATTEMPTS
+  bucket = TokenBucket(ops_per_second, capacity=max(ops_per_second, chunk_size)) if ops_per_second > 0 else None
+
+  def commit(chunk):
+    """Commit `chunk` as one batch, retrying with backoff; returns retries used"""
+    for attempt in range(max_attempts):
+      if bucket:
+        bucket.acquire(len(chunk))
+      try:
+        b = store.batch()
+        for op in chunk:
+          _apply(b, op)
+        started = time.perf_counter()
+        b.commit()
+        metrics.observe("sync_batch_commit_seconds", time.perf_counter() - started)
+        metrics.inc("sync_write_batches_total")
+        return attempt
+      except Exception as e:
+        if attempt + 1 == max_attempts:
+          raise
+        metrics.inc("sync_write_retries_total")
+        log("WRITE", f"Batch of {len(chunk)} failed ({e}), retrying...", severity="WARNING")
+        time.sleep(_backoff(attempt))
+
+  def run_chunk(chunk):
+    try:
+      return chunk, commit(chunk), []
+    except Exception:
+      pass
+    written, retries, failed = [], max_attempts - 1, []
+    for op in chunk:
+      try:
+        retries += commit([op])
+        written.append(op)
+      except Exception as e:
+        metrics.inc("sync_write_failed_total")
+        log("WRITE", f"Giving up on {op.ref.path}: {e}", severity="ERROR", path=op.ref.path)
+        retries += max_attempts - 1
+        failed.append(op.ref.path)
+    return written, retries, failed
+
+  stats = {"written": 0, "batches": 0, "retries": 0, "failed": [], "skipped": 0, "stopped": False}
+  # Chunk sequence -> path of its last write, and whether it committed cleanly
+  last_paths, clean = {}, {}
+  watermark = 0
+  checkpoint_every = 10
+
+  def collect(futures):
+    nonlocal watermark
+    for fut in futures:
+      seq = futures_seq.pop(fut)
+      written, retries, failed = fut.result()
+      stats["written"] += len(written)
+      if on_committed and written:
+        on_committed(written)
+      stats["batches"] += 1
+      stats["retries"] += retries
+      stats["failed"].extend(failed)
+      clean[seq] = not failed
+      if failed and checkpoint:
+        stats["stopped"] = True
+    if checkpoint:
+      advanced = watermark
+      while clean.get(watermark):
+        watermark += 1
+      if watermark > advanced and (watermark // checkpoint_every != advanced // checkpoint_every):
+        checkpoint.save(last_paths[watermark - 1])
+
+  resume_after = checkpoint.load() if checkpoint else None
+  if resume_after:
+    log("WRITE", f"Resuming after {resume_after}", resume_after=resume_after)
+
+  def pending_ops():
+    for op in ops:
+      if resume_after and op.ref.path <= resume_after:
+        stats["skipped"] += 1
+        continue
+      yield op
+
+  futures_seq = {}
+  started = time.monotonic()
+  with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+    in_flight = set()
+    for seq, chunk in enumerate(_chunks(pending_ops(), chunk_size)):
+      if len(in_flight) >= max_in_flight:
+        done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        collect(done)
+      if stats["stopped"]:
+        break
+      last_paths[seq] = chunk[-1].ref.path
+      fut = pool.submit(run_chunk, chunk)
+      futures_seq[fut] = seq
+      in_flight.add(fut)
+    collect(wait(in_flight).done)
+
+  if checkpoint:
+    if stats["stopped"]:
+      if watermark:
+        checkpoint.save(last_paths[watermark - 1])
+      stats["resume_after"] = checkpoint.after
+      log("WRITE", f"Stopped at a failed chunk; next run resumes after {checkpoint.after}",
+          severity="WARNING", resume_after=checkpoint.after)
+    elif resume_after or watermark:
+      checkpoint.clear()
+
+  elapsed = time.monotonic() - started
+  stats["elapsed_s"] = round(elapsed, 3)
+  stats["writes_per_second"] = round(stats["written"] / elapsed, 1) if elapsed > 0 else 0.0
+  return stats
@@ -0,0 +1,104 @@
+"""Parser engines for the business faculty directory page.
+
+Each engine turns the directory HTML into (department, full_name) pairs in
+document order. `department` is None for links found by the generic
+fallback, which only runs when no accordion sections yield any faculty.
+Which links are faculty profiles is up to the source (see faculty_sources).
+"""
+import os
+from startup import timed
+from metrics import log
+from faculty_sources import DEFAULT_SOURCE
+
+# "lxml" (default) or "bs4"; lxml falls back to bs4 if it isn't installed.
+FACULTY_PARSER = os.environ.get("FACULTY_PARSER", "lxml")
+
+
+def _keep(href: str, source) -> bool:
+  if not href or (source.exclude and source.exclude in href):
+    return False
+  return source.link_pattern.search(href) is not None
+
+
+_BeautifulSoup = None
+
+def parse_bs4(html: str, source=DEFAULT_SOURCE):
+  global _BeautifulSoup
+  if _BeautifulSoup is None:
+    with timed("import", "bs4"):
+      from bs4 import BeautifulSoup
+    _BeautifulSoup = BeautifulSoup
+  soup = _BeautifulSoup(html, "html.parser")
+  pairs = []
+  for toggle in soup.find_all('a', class_='accordion__toggle'):
+    dept_span = toggle.find('span', class_='accordion__toggle__text')
+    accordion_item = toggle.find_parent('div')
+    if not dept_span or not accordion_item:
+      continue
+    dept_name = dept_span.get_text(strip=True)
+    for a in accordion_item.find_all('a', href=source.link_pattern):
+      if _keep(a.get("href", ""), source):
+        pairs.append((dept_name, a.get_text(strip=True)))
+  if not pairs:
+    for a in soup.find_all('a', href=source.link_pattern):
+      if _keep(a.get("href", ""), source):
+        pairs.append((None, a.get_text(strip=True)))
+  return pairs
+
+
+_lxml = None
+
+def _lxml_selectors():
+  """Compile the XPath selectors once per process"""
+  global _lxml
+  if _lxml is None:
+    with timed("import", "lxml"):
+      from lxml import etree, html as lxml_html
+    _lxml = {
+      "fromstring": lxml_html.fromstring,
+      "toggles": etree.XPath('//a[contains(concat(" ", normalize-space(@class), " "), " accordion__toggle ")]'),
+      "dept": etree.XPath('.//span[contains(concat(" ", normalize-space(@class), " "), " accordion__toggle__text ")][1]'),
+      "section": etree.XPath('ancestor::div[1]'),
+      "links": etree.XPath('.//a[contains(@href, $prefix)]'),
+      "all_links": etree.XPath('//a[contains(@href, $prefix)]'),
+    }
+  return _lxml
+
+
+def _text(el) -> str:
+  return " ".join(el.text_content().split())
+
+
+def parse_lxml(html: str, source=DEFAULT_SOURCE):
+  sel = _lxml_selectors()
+  doc = sel["fromstring"](html)
+  pairs = []
+  for toggle in sel["toggles"](doc):
+    dept = sel["dept"](toggle)
+    section = sel["section"](toggle)
+    if not dept or not section:
+      continue
+    dept_name = _text(dept[0])
+    for a in sel["links"](section[0], prefix=source.link_prefix):
+      if _keep(a.get("href", ""), source):
+        pairs.append((dept_name, _text(a)))
+  if not pairs:
+    for a in sel["all_links"](doc, prefix=source.link_prefix):
+      if _keep(a.get("href", ""), source):
+        pairs.append((None, _text(a)))
+  return pairs
+
+
+ENGINES = {"lxml": parse_lxml, "bs4": parse_bs4}
+
+
+def parse_faculty_links(html: str, engine: str = None, source=DEFAULT_SOURCE):
+  """(department, full_name) pairs for every faculty link of `source`'s directory page"""
+  engine = engine or FACULTY_PARSER
+  if engine == "lxml":
+    try:
+      _lxml_selectors()
+    except ImportError:
+      log("SCRAPER", "lxml not installed, using the bs4 parser", severity="WARNING")
+      engine = "bs4"
+  return ENGINES[engine](html, source)
@@ -0,0 +1,59 @@
+"""Faculty directory sources, one per school.
+
+FACULTY_SOURCES is a JSON list such as
+
+  [{"school": "SLU Business", "url": "https://www.slu.edu/business/about/faculty/directory.php"},
+   {"url": "https://www.slu.edu/law/faculty/index.php", "link_prefix": "/law/faculty/"}]
+
+Only `url` is required. `link_prefix` is the path faculty profile links
+live under (the directory page's folder by default), `link_pattern` a
+regex their href must match (any .php page under the prefix by default),
+`school` the school recorded on its teachers ("SLU" plus the first path
+segment, e.g. "SLU Business"), and `department` the department of links
+found outside an accordion section (the school by default). Without
+FACULTY_SOURCES, SLU_FACULTY_LIST_URL is the only source.
+"""
+import os, re, json
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+DEFAULT_FACULTY_URL = "https://www.slu.edu/business/about/faculty/directory.php"
+
+FacultySource = namedtuple("FacultySource", ["school", "url", "link_prefix", "link_pattern", "department", "exclude"])
+
+
+def make_source(url: str, school: str = None, link_prefix: str = None, link_pattern: str = None,
+                department: str = None) -> FacultySource:
+  path = urlsplit(url).path
+  folder, page = path.rsplit("/", 1) if "/" in path else ("", path)
+  prefix = link_prefix or f"{folder}/"
+  if not school:
+    segment = next((s for s in path.split("/") if s), "")
+    school = f"SLU {segment.replace('-', ' ').title()}".strip()
+  return FacultySource(
+    school=school,
+    url=url,
+    link_prefix=prefix,
+    link_pattern=re.compile(link_pattern or re.escape(prefix) + r'.*\.php$'),
+    department=department or school,
+    # The directory page links to itself
+    exclude=page or None,
+  )
+
+
+def load_sources() -> list:
+  """The configured sources, in priority order for teachers listed by several schools"""
+  raw = os.environ.get("FACULTY_SOURCES", "").strip()
+  if raw:
+    try:
+      specs = json.loads(raw)
+      return [make_source(**spec) for spec in specs]
+    except (ValueError, TypeError) as e:
+      raise RuntimeError(f"Invalid FACULTY_SOURCES: {e}")
+  url = os.environ.get("SLU_FACULTY_LIST_URL", "")
+  if not url:
+    raise RuntimeError("Missing SLU_FACULTY_LIST_URL")
+  return [make_source(url)]
+
+
+DEFAULT_SOURCE = make_source(DEFAULT_FACULTY_URL)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic course catalog and faculty directory as replay fixtures
+
+Usage: gen_fixtures.py [--scale N] [--sections N] [--faculty N] [--terms T,...] [--subjects S,...]
+                       [--source DIR] [--out DIR]
+
+Recorded FOSE shards in --source (see SYNC_HTTP_MODE=record) are replicated
+--scale times with fresh CRNs. Shards with no recording get --sections
+generated sections instead. The output directory can then be replayed with
+SYNC_HTTP_MODE=replay SYNC_FIXTURES_DIR=<out>. With --terms or --subjects,
+the course search page is written too, offering them for discovery, and
+each term gets one shard per subject.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+# Add the parent directory to the path so we can import the main module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("SLU_FACULTY_LIST_URL", "https://www.slu.edu/business/about/faculty/directory.php")
+
+import http_client
+from http_client import ResponseCache
+from main import COURSES_API_URL, COURSES_BASE_URL, FACULTY_LIST_URL, course_shards, course_shard_payload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEPARTMENTS = ["ACCT", "FIN", "ECON", "MKT", "MGT", "IB", "OPM", "BTM", "BIZ"]
+FIRST_NAMES = ["Alex", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie", "Avery", "Quinn", "Drew"]
+LAST_NAMES = ["Smith", "Nguyen", "Garcia", "Patel", "Kim", "Brown", "Lopez", "Clark", "Wright", "Hill",
+              "Young", "King", "Scott", "Green", "Baker", "Adams", "Nelson", "Carter", "Mitchell", "Roberts"]
+TITLES = ["Principles of", "Intermediate", "Advanced", "Topics in", "Seminar in", "Introduction to"]
+SUBJECTS = ["Accounting", "Finance", "Economics", "Marketing", "Management", "Analytics", "Strategy"]
+
+
+def synthetic_faculty(count, rng):
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{'' if len(names) < 200 else len(names)}")
+    return [(DEPARTMENTS[i % len(DEPARTMENTS)], name) for i, name in enumerate(sorted(names))]
+
+
+def faculty_html(faculty):
+    by_dept = {}
+    for dept, name in faculty:
+        by_dept.setdefault(dept, []).append(name)
+    sections = []
+    for dept, names in by_dept.items():
+        links = "".join(
+            f'<li><a href="/business/about/faculty/{n.lower().replace(" ", "-")}.php">{n}, Ph.D.</a></li>'
+            for n in names)
+        sections.append(
+            f'<div class="accordion__item"><a class="accordion__toggle" href="#">'
+            f'<span class="accordion__toggle__text">{dept}</span></a>'
+            f'<div class="accordion__content"><ul>{links}</ul></div></div>')
+    return f'<html><body><div class="accordion">{"".join(sections)}</div></body></html>'
+
+
+def search_page_html(terms, subjects):
+    term_options = "".join(f'<option value="{t}">Term {t}</option>' for t in terms)
+    subject_options = "".join(f'<option value="{s}">{s} subject</option>' for s in subjects)
+    return (f'<html><body><select id="crit-srcdb"><option value="">Select a term</option>{term_options}</select>'
+            f'<select id="crit-subject"><option value="">Any subject</option>{subject_options}</select>'
+            f'</body></html>')
+
+
+def synthetic_sections(count, term, faculty, rng, crn_start):
+    entries = []
+    for i in range(count):
+        dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+        number = 1000 + (i // len(DEPARTMENTS)) % 4000
+        day = rng.randrange(5)
+        start = rng.choice([800, 930, 1100, 1230, 1400, 1530, 1800])
+        room = rng.choice(["DS 110", "DS 210", "DS 310", "CH 101", "CH 204"]).split()
+        entries.append({
+            "code": f"{dept} {number}",
+            "title": f"{rng.choice(TITLES)} {rng.choice(SUBJECTS)}",
+            "crn": str(crn_start + i),
+            "no": f"{i % 5 + 1:02d}",
+            "section": f"{i % 5 + 1:02d}",
+            "instr": rng.choice(faculty)[1] if rng.random() > 0.1 else "Staff",
+            "meetingTimes": json.dumps([
+                {"meet_day": str(d), "start_time": str(start), "end_time": str(start + 115),
+                 "bldg": room[0], "room": room[1]}
+                for d in (day, (day + 2) % 5)]),
+            "total": str(rng.choice([20, 30, 45, 60])),
+            "stat": "A" if rng.random() > 0.15 else "F",
+            "schd": "LEC",
+            "campus_code": "MAIN",
+            "srcdb": term,
+        })
+    return entries
+
+
+def scale_entries(entries, scale):
+    scaled = []
+    for k in range(scale):
+        for entry in entries:
+            copy = dict(entry)
+            if k:
+                copy["crn"] = f"{entry.get('crn', '')}{k:03d}"
+                copy["section"] = copy["no"] = f"{entry.get('section', entry.get('no', '01'))}-{k}"
+            scaled.append(copy)
+    return scaled
+
+
+def recorded_results(source, method, url, payload):
+    path = os.path.join(source, f"{ResponseCache.key(method, url, payload)}.body")
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get("results", [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--sections", type=int, default=1500, help="sections per shard without a recording")
+    parser.add_argument("--faculty", type=int, default=150)
+    parser.add_argument("--terms", default="", help="comma-separated term codes offered by the search page")
+    parser.add_argument("--subjects", default="", help="comma-separated subject codes offered by the search page")
+    parser.add_argument("--source", default=os.path.join(HERE, "fixtures"))
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    out = args.out or os.path.join(HERE, "fixtures", f"synthetic_x{args.scale}")
+    http_client.FIXTURES_DIR = out
+
+    faculty = synthetic_faculty(args.faculty, rng)
+    http_client.write_fixture("GET", FACULTY_LIST_URL, None, faculty_html(faculty).encode("utf-8"))
+
+    terms = [t for t in args.terms.split(",") if t]
+    subjects = [s for s in args.subjects.split(",") if s]
+    if terms or subjects:
+        http_client.write_fixture("GET", COURSES_BASE_URL, None, search_page_html(terms, subjects).encode("utf-8"))
+
+    total = 0
+    crn_start = 10000
+    for term, subject in course_shards(terms or None, subjects or None):
+        payload = course_shard_payload(term, subject)
+        entries = recorded_results(args.source, "POST", COURSES_API_URL, payload)
+        if entries is None:
+            entries = synthetic_sections(args.sections, term, faculty, rng, crn_start)
+            crn_start += args.sections
+        entries = scale_entries(entries, args.scale)
+        body = json.dumps({"count": len(entries), "results": entries}).encode("utf-8")
+        http_client.write_fixture("POST", COURSES_API_URL, payload, body)
+        total += len(entries)
+        print(f"{term or 'default'}/{subject or '*'}: {len(entries)} sections ({len(body) / 1024:.0f} KiB)")
+
+    print(f"Wrote {total} sections and {len(faculty)} faculty to {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+"""Shared HTTP session, per-host flow control and conditional-request cache for the scrapers.
+
+Every live request goes through its host's slot: at most the host's
+current concurrency limit in flight, started at least HTTP_HOST_INTERVAL_S
+apart. The limit adapts (AIMD): it grows by one after a full limit's worth
+of successes and halves on a 429 or 5xx. Requests failing with those
+statuses or with connection errors and timeouts are retried with jittered
+exponential backoff, honouring Retry-After. After HTTP_BREAKER_FAILURES
+consecutive failures the host's circuit opens: requests fail fast with
+CircuitOpen for HTTP_BREAKER_COOLDOWN_S, then a single probe decides
+whether it closes again.
+"""
+import os, json, time, random, shutil, hashlib, tempfile, threading
+from collections import namedtuple
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from startup import timed
+import metrics
+
+DEFAULT_HEADERS = {
+  'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session(pool_size: int = 16):
+  """Process-wide keep-alive `requests.Session`, sized for the scrapers' worker pools"""
+  global _session
+  with _session_lock:
+    if _session is None:
+      with timed("import", "requests"):
+        import requests
+        from requests.adapters import HTTPAdapter
+      s = requests.Session()
+      adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+      s.mount("https://", adapter)
+      s.mount("http://", adapter)
+      s.headers.update(DEFAULT_HEADERS)
+      _session = s
+    return _session
+
+# Response bodies are kept on local disk so an unchanged (304) source can be
+# re-parsed without downloading it again.
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "sync_http_cache"))
+
+# "live" talks to the network; "record" also copies every response body into
+# SYNC_FIXTURES_DIR, and "replay" serves bodies from there without any network.
+HTTP_MODE = os.environ.get("SYNC_HTTP_MODE", "live")
+FIXTURES_DIR = os.environ.get("SYNC_FIXTURES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures"))
+
+# Politeness towards each host: the most requests in flight (the adaptive
+# limit starts here and never exceeds it) and the spacing of their starts.
+HTTP_HOST_CONCURRENCY = int(os.environ.get("HTTP_HOST_CONCURRENCY", "6"))
+HTTP_HOST_INTERVAL_S = float(os.environ.get("HTTP_HOST_INTERVAL_S", "0.1"))
+# Used when a caller gives no timeout of its own: (connect, read) seconds.
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", "30"))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", "4"))
+HTTP_BACKOFF_BASE_S = float(os.environ.get("HTTP_BACKOFF_BASE_S", "0.5"))
+HTTP_BACKOFF_MAX_S = float(os.environ.get("HTTP_BACKOFF_MAX_S", "20"))
+HTTP_BREAKER_FAILURES = int(os.environ.get("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_COOLDOWN_S = float(os.environ.get("HTTP_BREAKER_COOLDOWN_S", "30"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpen(RuntimeError):
+  pass
+
+
+class RetryableStatus(RuntimeError):
+  def __init__(self, status: int, url: str, retry_after: float = None):
+    super().__init__(f"HTTP {status} from {url}")
+    self.status = status
+    self.retry_after = retry_after
+
+
+class _Host:
+  """Adaptive concurrency limit, start spacing and circuit breaker for one host"""
+
+  def __init__(self, name: str):
+    self.name = name
+    self.cond = threading.Condition()
+    self.limit = float(HTTP_HOST_CONCURRENCY)
+    self.in_flight = 0
+    self.next_start = 0.0
+    self.successes = 0
+    self.failures = 0      # consecutive
+    self.open_until = 0.0  # circuit open until then; nonzero while open or half-open
+    self.probing = False
+
+  def acquire(self):
+    with self.cond:
+      while True:
+        now = time.monotonic()
+        if self.open_until:
+          if now < self.open_until or self.probing:
+            raise CircuitOpen(f"Circuit open for {self.name} after {self.failures} consecutive failures")
+          if self.in_flight == 0:
+            self.probing = True  # half-open: this request decides
+            break
+        elif self.in_flight < int(self.limit):
+          break
+        self.cond.wait(timeout=1.0)
+      self.in_flight += 1
+      wait = self.next_start - now
+      self.next_start = max(now, self.next_start) + HTTP_HOST_INTERVAL_S
+    if wait > 0:
+      time.sleep(wait)
+
+  def release(self, outcome: str):
+    """`outcome` is "ok", "overload" (429 / 5xx) or "error" (connection failure or timeout)"""
+    with self.cond:
+      self.in_flight -= 1
+      if outcome == "ok":
+        if self.open_until:
+          metrics.log("HTTP", f"Circuit for {self.name} closed", host=self.name)
+        self.failures, self.open_until, self.probing = 0, 0.0, False
+        self.successes += 1
+        if self.successes >= int(self.limit) and self.limit < HTTP_HOST_CONCURRENCY:
+          self.limit, self.successes = self.limit + 1, 0
+      else:
+        self.failures += 1
+        self.successes = 0
+        if outcome == "overload":
+          self.limit = max(1.0, self.limit / 2)
+          metrics.inc("sync_http_backoffs_total", host=self.name)
+        if self.probing or self.failures >= HTTP_BREAKER_FAILURES:
+          self.open_until = time.monotonic() + HTTP_BREAKER_COOLDOWN_S
+          self.probing = False
+          metrics.inc("sync_http_circuit_opened_total", host=self.name)
+          metrics.log("HTTP", f"Circuit for {self.name} open for {HTTP_BREAKER_COOLDOWN_S:g}s after "
+                      f"{self.failures} consecutive failures", severity="WARNING", host=self.name)
+      self.cond.notify_all()
+
+  def state(self) -> dict:
+    with self.cond:
+      return {"limit": int(self.limit), "in_flight": self.in_flight, "consecutive_failures": self.failures,
+              "circuit": "closed" if not self.open_until else "half-open" if self.probing else "open"}
+
+
+_hosts = {}
+_hosts_lock = threading.Lock()
+
+def _host(url: str) -> _Host:
+  name = urlsplit(url).netloc.lower()
+  with _hosts_lock:
+    host = _hosts.get(name)
+    if host is None:
+      host = _hosts[name] = _Host(name)
+    return host
+
+def host_states() -> dict:
+  with _hosts_lock:
+    hosts = dict(_hosts)
+  return {name: host.state() for name, host in hosts.items()}
+
+def _outcome(error: Exception) -> str:
+  if error is None:
+    return "ok"
+  if isinstance(error, RetryableStatus):
+    return "overload"
+  import requests
+  if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)):
+    return "error"
+  return "ok"  # the host answered; a 404 says nothing about its health
+
+@contextmanager
+def host_slot(url: str):
+  """Hold one of `url`'s host's request slots for one request"""
+  if HTTP_MODE == "replay":
+    yield
+    return
+  host = _host(url)
+  host.acquire()
+  error = None
+  try:
+    yield
+  except Exception as e:
+    error = e
+    raise
+  finally:
+    host.release(_outcome(error))
+
+def _backoff(attempt: int, error: Exception) -> float:
+  """Full-jitter exponential backoff, but never sooner than the server's Retry-After"""
+  delay = random.uniform(0, min(HTTP_BACKOFF_MAX_S, HTTP_BACKOFF_BASE_S * 2 ** attempt))
+  retry_after = getattr(error, "retry_after", None)
+  return max(delay, min(retry_after, HTTP_BACKOFF_MAX_S)) if retry_after else delay
+
+def _retry_after(value) -> float:
+  try:
+    return max(float(value), 0.0)
+  except (TypeError, ValueError):
+    return None
+
+
+CachedBody = namedtuple("CachedBody", ["path", "changed"])
+
+
+class ResponseCache:
+  """Conditional requests keyed by method, URL and payload.
+
+  `entries` maps a request key to the ETag, Last-Modified and body hash of
+  the last response that was committed. Sources without validators still
+  report `changed=False` when their body hashes the same as last time.
+  New entries only take effect after `commit()`, so a failed sync leaves
+  the next run comparing against the last good one.
+  """
+
+  def __init__(self, entries: dict = None, cache_dir: str = None, journal=None):
+    self.entries = dict(entries or {})
+    # Durable record of the bodies fetched by the current run (runs.SyncRun)
+    self.journal = journal
+    self.cache_dir = cache_dir or HTTP_CACHE_DIR
+    self._pending = {}
+    self._lock = threading.Lock()
+    os.makedirs(self.cache_dir, exist_ok=True)
+
+  @staticmethod
+  def key(method: str, url: str, payload=None) -> str:
+    blob = json.dumps([method.upper(), url, payload], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:24]
+
+  def _replay(self, key: str, path: str, method: str, url: str, force: bool) -> CachedBody:
+    fixture = fixture_path(key)
+    if not os.path.exists(fixture):
+      raise FileNotFoundError(f"No recorded fixture for {method} {url} ({fixture})")
+    digest = hashlib.sha1()
+    size = 0
+    with open(fixture, "rb") as src, open(path, "wb") as dst:
+      for block in iter(lambda: src.read(64 * 1024), b""):
+        digest.update(block)
+        dst.write(block)
+        size += len(block)
+    metrics.inc("sync_http_requests_total", status="replay")
+    metrics.inc("sync_http_bytes_total", size)
+    return self._store(key, {"etag": None, "last_modified": None, "hash": digest.hexdigest()[:20]}, force)
+
+  def _store(self, key: str, new_entry: dict, force: bool = False) -> CachedBody:
+    entry = self.entries.get(key) or {}
+    with self._lock:
+      self._pending[key] = new_entry
+    return CachedBody(os.path.join(self.cache_dir, key), force or entry.get("hash") != new_entry["hash"])
+
+  def fetch(self, session, method: str, url: str, payload=None, force: bool = False, **kwargs) -> CachedBody:
+    """Fetch `url` into the cache directory; the body is streamed to disk, never held in memory.
+    
+    Transient failures are retried up to HTTP_RETRIES times; CircuitOpen
+    and other errors are raised as they are. With a `journal`, a body the
+    current run already fetched is restored from it instead, and new ones
+    are recorded in it.
+    """
+    key = self.key(method, url, payload)
+    path = os.path.join(self.cache_dir, key)
+    if self.journal is not None:
+      entry = self.journal.restore(key, path)
+      if entry is not None:
+        metrics.inc("sync_http_requests_total", status="resumed")
+        return self._store(key, entry, force)
+    body = self._fetch(session, key, path, method, url, payload, force, **kwargs)
+    if self.journal is not None and body.changed:
+      with self._lock:
+        entry = self._pending[key]
+      self.journal.record(key, body.path, entry)
+    return body
+
+  def _fetch(self, session, key: str, path: str, method: str, url: str, payload, force: bool,
+             **kwargs) -> CachedBody:
+    if HTTP_MODE == "replay":
+      return self._replay(key, path, method, url, force)
+    kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    attempt = 0
+    while True:
+      try:
+        with host_slot(url):
+          return self._fetch_once(session, key, path, method, url, payload, force, **kwargs)
+      except Exception as e:
+        if attempt >= HTTP_RETRIES or _outcome(e) == "ok":
+          raise
+        delay = _backoff(attempt, e)
+        attempt += 1
+        metrics.inc("sync_http_retries_total", reason=_outcome(e))
+        metrics.log_sampled("HTTP", "retry", f"Retrying {method} {url} in {delay:.1f}s "
+                            f"(attempt {attempt} of {HTTP_RETRIES}): {e}", url=url, attempt=attempt)
+        time.sleep(delay)
+
+  def _fetch_once(self, session, key: str, path: str, method: str, url: str, payload, force: bool,
+                  **kwargs) -> CachedBody:
+    entry = self.entries.get(key) or {}
+    headers = dict(kwargs.pop("headers", None) or {})
+    if not force and os.path.exists(path):
+      if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+      if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    if payload is not None:
+      kwargs["json"] = payload
+    
+    with session.request(method, url, headers=headers, stream=True, **kwargs) as response:
+      metrics.inc("sync_http_requests_total", status=response.status_code)
+      if response.status_code == 304:
+        if HTTP_MODE == "record":
+          record_fixture(key, path, method, url, payload)
+        return CachedBody(path, False)
+      if response.status_code in RETRY_STATUSES:
+        raise RetryableStatus(response.status_code, url, _retry_after(response.headers.get("Retry-After")))
+      response.raise_for_status()
+      digest = hashlib.sha1()
+      size = 0
+      tmp = f"{path}.{threading.get_ident()}.part"
+      with open(tmp, "wb") as f:
+        for block in response.iter_content(chunk_size=64 * 1024):
+          digest.update(block)
+          f.write(block)
+          size += len(block)
+      os.replace(tmp, path)
+      metrics.inc("sync_http_bytes_total", size)
+      new_entry = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "hash": digest.hexdigest()[:20],
+      }
+    if HTTP_MODE == "record":
+      record_fixture(key, path, method, url, payload)
+    return self._store(key, new_entry, force)
+
+  def entry(self, key: str) -> dict:
+    """The entry of `key`'s latest fetch, or of its last committed one"""
+    with self._lock:
+      return self._pending.get(key) or self.entries.get(key)
+
+  def commit(self, keys=None) -> dict:
+    """Adopt the pending entries (only those of `keys`, if given) and return all entries"""
+    with self._lock:
+      for key in list(self._pending) if keys is None else keys:
+        if key in self._pending:
+          self.entries[key] = self._pending.pop(key)
+    return self.entries
+
+
+def fixture_path(key: str) -> str:
+  return os.path.join(FIXTURES_DIR, f"{key}.body")
+
+def write_fixture(method: str, url: str, payload, body: bytes):
+  """Save `body` as the recorded response for a request"""
+  key = ResponseCache.key(method, url, payload)
+  os.makedirs(FIXTURES_DIR, exist_ok=True)
+  with open(fixture_path(key), "wb") as f:
+    f.write(body)
+  _write_fixture_meta(key, method, url, payload)
+  return key
+
+def record_fixture(key: str, body_path: str, method: str, url: str, payload=None):
+  os.makedirs(FIXTURES_DIR, exist_ok=True)
+  shutil.copyfile(body_path, fixture_path(key))
+  _write_fixture_meta(key, method, url, payload)
+
+def _write_fixture_meta(key: str, method: str, url: str, payload):
+  with open(os.path.join(FIXTURES_DIR, f"{key}.json"), "w", encoding="utf-8") as f:
+    json.dump({"method": method.upper(), "url": url, "payload": payload}, f, indent=2, sort_keys=True)
@@ -0,0 +1,108 @@
+"""Instructor name -> SLU email resolution.
+
+Faculty directory names ("Jane Q. Doe, Ph.D.") become `first.last@slu.edu`
+addresses, which are also the teachers' document ids. Course sections
+list instructors more loosely ("Dr. Jane Doe", "J. Doe (Primary)",
+"Doe, Jane", "Alex Doe" for "Alexander Doe"); `EmailResolver`
+matches those against the known faculty by full name, then by initial or
+shortened first name and last name, then by a bare last name, and only
+guesses an address when none of those is unambiguous. The same few
+hundred names repeat across thousands of sections, so results are
+memoized per raw name.
+"""
+import os, re
+from functools import lru_cache
+
+EMAIL_DOMAIN = "slu.edu"
+INSTRUCTOR_CACHE_SIZE = int(os.environ.get("INSTRUCTOR_CACHE_SIZE", "4096"))
+
+_DEGREES = re.compile(r'Ph\.D\.|J\.D\.|Dr\.|M\.A\.|M\.B\.A\.|M\.Sc\.|,')
+_PARENS = re.compile(r'\s*\([^)]*\)')
+_TITLE = re.compile(r'^(dr|prof|professor)\.?')
+_DOTS = re.compile(r'\.')
+_NON_NAME = re.compile(r"[^a-z' -]+")
+_HONORIFICS = {"dr", "prof", "professor", "mr", "mrs", "ms", "phd", "jd", "ma", "mba", "msc", "jr", "sr",
+               "ii", "iii"}
+
+
+def faculty_email(full_name: str) -> str:
+  """The address of a faculty directory entry, '' when the name has no first and last part"""
+  parts = _DEGREES.sub("", full_name).split()
+  if len(parts) < 2:
+    return ""
+  return f"{parts[0].lower()}.{parts[-1].lower()}@{EMAIL_DOMAIN}"
+
+
+def guess_email(instructor_name: str) -> str:
+  """`first.last@` from a course listing's instructor name, '' when there is no first and last part"""
+  parts = _PARENS.sub("", instructor_name).strip().split()
+  if len(parts) < 2:
+    return ""
+  first = _DOTS.sub("", _TITLE.sub("", parts[0].lower()))
+  last = _DOTS.sub("", parts[-1].lower())
+  return f"{first}.{last}@{EMAIL_DOMAIN}" if first and last else ""
+
+
+def name_tokens(name: str) -> list:
+  """Lowercase name parts without degrees, titles, notes or punctuation; "Last, First" is reordered"""
+  name = _PARENS.sub("", name or "")
+  last_first = name.split(",", 1)
+  if len(last_first) == 2 and _DEGREES.sub("", last_first[1]).strip() and len(last_first[0].split()) == 1:
+    name = f"{last_first[1]} {last_first[0]}"
+  tokens = _NON_NAME.sub(" ", _DEGREES.sub(" ", name).lower().replace(".", " ")).split()
+  return [t for t in tokens if t not in _HONORIFICS]
+
+
+class EmailResolver:
+  """Memoized instructor name -> email over an index of the known faculty"""
+
+  def __init__(self, faculty=()):
+    """`faculty` is (full_name, email) pairs, e.g. from teachers_dir"""
+    self._exact, self._initial, self._last = {}, {}, {}
+    for full_name, email in faculty:
+      tokens = name_tokens(full_name)
+      if not email or len(tokens) < 2:
+        continue
+      first, last = tokens[0], tokens[-1]
+      self._exact.setdefault(f"{first} {last}", set()).add(email)
+      self._initial.setdefault(f"{first[0]} {last}", set()).add((email, first))
+      self._last.setdefault(last, set()).add(email)
+    self.matched = {}  # how -> distinct names resolved that way
+    self.resolve = lru_cache(maxsize=INSTRUCTOR_CACHE_SIZE)(self._resolve)
+
+  def __len__(self):
+    return sum(len(emails) for emails in self._last.values())
+
+  @staticmethod
+  def _unique(index: dict, key: str) -> str:
+    emails = index.get(key)
+    return next(iter(emails)) if emails and len(emails) == 1 else ""
+
+  def match(self, name: str):
+    """(email, how) where how is exact, initial, last, guess or None"""
+    tokens = name_tokens(name)
+    if len(tokens) >= 2:
+      first, last = tokens[0], tokens[-1]
+      email = self._unique(self._exact, f"{first} {last}")
+      if email:
+        return email, "exact"
+      # "J. Doe" or "Alex Doe" for Alexander Doe, but never Jane for Joan
+      candidates = {e for e, known in self._initial.get(f"{first[0]} {last}", ())
+                    if len(first) == 1 or known.startswith(first) or first.startswith(known)}
+      if len(candidates) == 1:
+        return next(iter(candidates)), "initial"
+    elif tokens:
+      email = self._unique(self._last, tokens[0])
+      if email:
+        return email, "last"
+    email = guess_email(name)
+    return (email, "guess") if email else ("", None)
+
+  def _resolve(self, name: str) -> str:
+    email, how = self.match(name)
+    self.matched[how or "none"] = self.matched.get(how or "none", 0) + 1
+    return email
+
+  def stats(self) -> dict:
+    info = self.resolve.cache_info()
+    return {"faculty": len(self), "names": info.misses, "lookups": info.hits + info.misses, **self.matched}
@@ -0,0 +1,200 @@
+"""In-process background jobs for the sync endpoints"""
+import os, time, uuid, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import log
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Finished jobs kept around for /jobs/{id}; the oldest are dropped first.
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "50"))
+
+_current = threading.local()
+
+
+class Job:
+  def __init__(self, kind: str, key: tuple):
+    self.id = uuid.uuid4().hex[:12]
+    self.kind = kind
+    self.key = key
+    self.status = "queued"
+    self.phase = None
+    self.progress = {}
+    self.phases = []
+    self.timings = {}
+    self.result = None
+    self.error = None
+    self.created_at = time.time()
+    self.started_at = None
+    self.finished_at = None
+    self._lock = threading.Lock()
+
+  def set_phase(self, name: str):
+    """Start a phase, ending the one this thread was in; other threads' phases keep running"""
+    now = time.time()
+    thread = threading.get_ident()
+    with self._lock:
+      for phase in reversed(self.phases):
+        if phase["thread"] == thread and phase["ended_at"] is None:
+          phase["ended_at"] = now
+          break
+      self.phases.append({"name": name, "started_at": now, "ended_at": None, "thread": thread})
+      self.phase = name
+
+  def finish(self, status: str):
+    now = time.time()
+    with self._lock:
+      for phase in self.phases:
+        if phase["ended_at"] is None:
+          phase["ended_at"] = now
+      self.status = status
+      self.finished_at = now
+
+  def update(self, **counts):
+    with self._lock:
+      self.progress.update(counts)
+
+  def add_timing(self, stage: str, seconds: float):
+    with self._lock:
+      self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+  def to_dict(self) -> dict:
+    with self._lock:
+      end = self.finished_at or time.time()
+      return {
+        "id": self.id,
+        "kind": self.kind,
+        "status": self.status,
+        "phase": self.phase,
+        "progress": dict(self.progress),
+        "phases": [
+          {"name": p["name"], "duration_s": round((p["ended_at"] or end) - p["started_at"], 3)}
+          for p in self.phases
+        ],
+        "created_at": self.created_at,
+        "started_at": self.started_at,
+        "finished_at": self.finished_at,
+        "duration_s": round(end - self.started_at, 3) if self.started_at else None,
+        "stage_seconds": {stage: round(s, 3) for stage, s in self.timings.items()},
+        "result": self.result,
+        "error": self.error,
+      }
+
+
+class JobManager:
+  """Runs sync jobs on a small thread pool, one live job per kind and arguments.
+
+  Submitting a job while an identical one is queued or running returns the
+  existing job instead of starting a second run; one with other arguments
+  (a forced or full run) is queued behind it. `exclusive` maps a kind to
+  the names of the state it writes (its manifests); jobs sharing any of it
+  wait for each other instead of overlapping.
+  """
+
+  def __init__(self, workers: int = None, history: int = None, exclusive: dict = None):
+    self._pool = ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix="job")
+    self._history = history or JOB_HISTORY
+    self._exclusive = exclusive or {}
+    self._resources = {}  # state name -> lock held by the job writing it
+    self._jobs = OrderedDict()
+    self._active = {}
+    self._lock = threading.Lock()
+
+  def submit(self, kind: str, fn, *args, **kwargs):
+    """Queue fn(*args, **kwargs); returns (job, coalesced)"""
+    key = (kind, args, tuple(sorted(kwargs.items())))
+    with self._lock:
+      existing = self._active.get(key)
+      if existing is not None:
+        return existing, True
+      job = Job(kind, key)
+      self._active[key] = job
+      self._jobs[job.id] = job
+      self._trim()
+    self._pool.submit(self._run, job, fn, args, kwargs)
+    return job, False
+
+  def get(self, job_id: str):
+    with self._lock:
+      return self._jobs.get(job_id)
+
+  def list(self):
+    with self._lock:
+      return list(self._jobs.values())
+
+  def _hold(self, job: Job):
+    """Acquire the locks of the state `job` writes, in a fixed order so jobs can't deadlock"""
+    with self._lock:
+      locks = [self._resources.setdefault(name, threading.Lock()) for name in sorted(self._exclusive.get(job.kind, ()))]
+    for lock in locks:
+      if not lock.acquire(blocking=False):
+        log("JOBS", f"{job.kind} {job.id} waiting for a job writing the same state", job_id=job.id, kind=job.kind)
+        lock.acquire()
+    return locks
+
+  def _run(self, job: Job, fn, args, kwargs):
+    locks = self._hold(job)
+    try:
+      self._execute(job, fn, args, kwargs)
+    finally:
+      for lock in locks:
+        lock.release()
+
+  def _execute(self, job: Job, fn, args, kwargs):
+    _current.job = job
+    job.started_at = time.time()
+    job.status = "running"
+    log("JOBS", f"{job.kind} {job.id} started", job_id=job.id, kind=job.kind)
+    status = "failed"
+    try:
+      job.result = fn(*args, **kwargs)
+      status = "succeeded"
+    except Exception as e:
+      log("JOBS", f"{job.kind} {job.id} failed: {e}", severity="ERROR", job_id=job.id, kind=job.kind)
+      job.error = str(e)
+    finally:
+      job.finish(status)
+      _current.job = None
+      with self._lock:
+        if self._active.get(job.key) is job:
+          del self._active[job.key]
+      log("JOBS", f"{job.kind} {job.id} {job.status} in {job.finished_at - job.started_at:.1f}s",
+          job_id=job.id, kind=job.kind, status=job.status, duration_s=round(job.finished_at - job.started_at, 3),
+          stage_seconds={stage: round(s, 3) for stage, s in job.timings.items()})
+
+  def _trim(self):
+    finished = [j for j in self._jobs.values() if j.finished_at is not None]
+    for job in finished[:max(0, len(self._jobs) - self._history)]:
+      del self._jobs[job.id]
+
+
+def current_job():
+  return getattr(_current, "job", None)
+
+def set_phase(name: str):
+  """Mark the running job's phase; a no-op outside a job"""
+  job = current_job()
+  if job is not None:
+    job.set_phase(name)
+
+def report(**counts):
+  """Merge progress counts into the running job; a no-op outside a job"""
+  job = current_job()
+  if job is not None:
+    job.update(**counts)
+
+def add_timing(stage: str, seconds: float):
+  """Add to the running job's time spent in `stage`; a no-op outside a job"""
+  job = current_job()
+  if job is not None:
+    job.add_timing(stage, seconds)
+
+def bind_job(fn):
+  """Wrap `fn` to run with the calling thread's job, for work handed to other threads"""
+  job = current_job()
+  def run(*args, **kwargs):
+    _current.job = job
+    try:
+      return fn(*args, **kwargs)
+    finally:
+      _current.job = None
+  return run
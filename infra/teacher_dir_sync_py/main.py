@@ -1,233 +1,648 @@
-import os, re, time, requests, json
-from bs4 import BeautifulSoup
-from google.cloud import firestore
-from fastapi import FastAPI, Response
+import startup
+from startup import timed
+import os, re, json, hashlib, zlib, itertools
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+with timed("import", "fastapi"):
+  from fastapi import FastAPI, Response
+  from fastapi.responses import JSONResponse
+# Firestore, requests, ijson and the HTML parsers are imported on first use,
+# so a cold container can answer /healthz before any of them load.
+with timed("import", "sync modules"):
+  from bulk_write import WriteOp, Checkpoint
+  from storage import get_store, DocRef, SERVER_TIMESTAMP, DELETE_FIELD, ArrayUnion, ArrayRemove
+  from http_client import get_session, host_states, ResponseCache, CachedBody
+  from jobs import JobManager, set_phase, report
+  from pipeline import Pipeline
+  from runs import SyncRun
+  from work_queue import handler, run_units
+  import metrics
+  from metrics import log, log_sampled, span, timed_iter, RssPeak
+  from faculty_parser import parse_faculty_links
+  from faculty_sources import FacultySource, load_sources
+  from search_index import course_keywords, teacher_keywords
+  from terms import parse_terms, parse_subjects, plan_terms, term_key, term_code
+  from instructors import EmailResolver, faculty_email
+  from meetings import DAY_LETTERS, OCCUPANCY_SLOT_MINUTES, meeting_fields, occupancy, encode_occupancy
 
 FACULTY_LIST_URL = os.environ.get("SLU_FACULTY_LIST_URL", "")
+# Directories fetched at once; see faculty_sources for FACULTY_SOURCES.
+FACULTY_FETCH_WORKERS = int(os.environ.get("FACULTY_FETCH_WORKERS", "8"))
 # New SLU courses API URL
 COURSES_API_URL = "https://courses.slu.edu/api/?page=fose&route=search"
 COURSES_BASE_URL = "https://courses.slu.edu/"
+COURSES_API_HEADERS = {
+  'Content-Type': 'application/json',
+  'Referer': COURSES_BASE_URL,
+}
+
+# The catalog search is split into one keyword query per subject and term.
+# When unset, the subjects are discovered from the course search page (or
+# the last ones discovered); only with neither is an unfiltered query sent.
+COURSE_SUBJECTS = [s.strip() for s in os.environ.get("COURSE_SUBJECTS", "").split(",") if s.strip()]
+# Explicit terms, newest first; when unset they are discovered from the course
+# search page, falling back to the API's default term ("").
+COURSE_TERMS = [t.strip() for t in os.environ.get("COURSE_TERMS", "").split(",") if t.strip()]
+COURSE_FETCH_WORKERS = int(os.environ.get("COURSE_FETCH_WORKERS", "6"))
+COURSE_SHARD_CONNECT_TIMEOUT = float(os.environ.get("COURSE_SHARD_CONNECT_TIMEOUT", "5"))
+COURSE_SHARD_READ_TIMEOUT = float(os.environ.get("COURSE_SHARD_READ_TIMEOUT", "60"))
+# "standalone" does all of a sync in this process. "coordinator" hands the
+# course shard fetches and the linker's teacher ranges out as work units to
+# the workers (worker.py) sharing its queue, and works on them itself too.
+SYNC_ROLE = os.environ.get("SYNC_ROLE", "standalone")
+
+# Content hashes of everything the sync has written, sharded so each manifest
+# document stays well under Firestore's 1 MiB limit.
+MANIFEST_COLLECTION = "sync_manifest"
+MANIFEST_SHARDS = 16
+# ETags, Last-Modified dates and body hashes of each source as last synced
+# are kept in http_cache__<source> documents alongside the manifest.
+
+# Session ids and teacher emails changed since the last link, kept in the manifest collection.
+LINK_STATE_DOC = "link_pending"
+# Catalog courses whose term summaries changed but whose course-level fields are not yet rebuilt.
+CATALOG_STATE_DOC = "catalog_pending"
+# Past this many queued changes the linker just rebuilds every teacher.
+LINK_INCREMENTAL_MAX = int(os.environ.get("LINK_INCREMENTAL_MAX", "2000"))
+# Firestore's cap on values in an `in` / `array-contains-any` filter.
+ARRAY_QUERY_LIMIT = 30
+# teachingSessions arrays make teacher updates heavy, so link batches stay small.
+LINK_WRITE_CHUNK = int(os.environ.get("LINK_WRITE_CHUNK", "100"))
+LINK_CHECKPOINT_DOC = "checkpoint__link"
+LINK_READ_PAGE = int(os.environ.get("LINK_READ_PAGE", "500"))
+# Teachers relinked per work unit in coordinator mode
+LINK_UNIT_TEACHERS = int(os.environ.get("LINK_UNIT_TEACHERS", "200"))
+# The only fields the linker reads; everything else stays on the server.
+LINK_SESSION_FIELDS = ['instructor_email', 'course_code', 'course_title', 'section_number', 'crn',
+                       'term', 'meeting_times', 'meetings', 'credits', 'capacity', 'enrolled', 'deleted']
+LINK_TEACHER_FIELDS = ['email', 'fullName', 'teachingSessionsHash', 'deleted']
+
+# diff_sync saves its manifest after about this many committed writes.
+DIFF_CHECKPOINT_WRITES = int(os.environ.get("DIFF_CHECKPOINT_WRITES", "2000"))
+# Sections embedded in each courses_catalog document; the rest are only counted.
+COURSE_SECTION_SUMMARY_MAX = int(os.environ.get("COURSE_SECTION_SUMMARY_MAX", "40"))
+
+# Smaller teacher batches keep several commits in flight for a few hundred faculty.
+TEACHER_WRITE_CHUNK = int(os.environ.get("TEACHER_WRITE_CHUNK", "50"))
+# A directory scrape that would drop more than this share of the known teachers
+# is more likely a broken page than a mass departure; nobody is removed then.
+TEACHER_MAX_REMOVED_FRACTION = float(os.environ.get("TEACHER_MAX_REMOVED_FRACTION", "0.2"))
+
+# How documents that vanish from their source leave the hot collections: "delete"
+# removes them, "tombstone" marks them deleted with an expireAt for a Firestore
+# TTL policy on that field to remove later.
+SYNC_DELETE_MODE = os.environ.get("SYNC_DELETE_MODE", "delete")
+TOMBSTONE_TTL_DAYS = int(os.environ.get("TOMBSTONE_TTL_DAYS", "30"))
+# Vanished sessions of terms no longer in the catalog are moved here instead.
+SESSION_ARCHIVE_COLLECTION = "course_sessions_archive"
+# Weekly occupancy bitmaps per room and per instructor, one document per term.
+SCHEDULE_COLLECTION = "schedule_occupancy"
+# Terms with documents in the hot collections, and which frozen ones are final.
+TERM_STATE_DOC = "course_terms"
 
 app = FastAPI()
-db = firestore.Client()  # uses Cloud Run service account
+# Jobs writing the same manifests never run at once
+job_manager = JobManager(exclusive={
+  "seed": ["teachers"],
+  "seed_courses": ["courses"],
+  "link_teachers_courses": ["link"],
+  "seed_all": ["teachers", "courses", "link"],
+})
+startup.mark("app_ready")
+
+# Guesses addresses from names alone, for when no faculty index is at hand
+_GUESS_RESOLVER = EmailResolver()
 
 def _sanitize_id(email: str) -> str:
   return re.sub(r'[@.]', '_', email.lower())
 
-def scrape_faculty():
-  if not FACULTY_LIST_URL:
-    raise RuntimeError("Missing SLU_FACULTY_LIST_URL")
+def _session_doc_id(session: dict, partition: str = '') -> str:
+  session_id = f"{session['course_code'].replace(' ', '_')}_{session['section_number']}_{session.get('crn', 'unknown')}"
+  if partition:
+    session_id = f"{partition}__{session_id}"
+  return re.sub(r'[^a-zA-Z0-9_\-]', '_', session_id)[:500]
+
+def _course_doc_id(course: dict) -> str:
+  return re.sub(r'[^a-zA-Z0-9_\-]', '_', f"{course['code'].replace(' ', '_')}__{course['title']}")[:500]
+
+def _content_hash(data: dict) -> str:
+  """Stable hash of a document body, independent of key order"""
+  blob = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+  return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:20]
+
+def _http_cache_ref(source: str):
+  return DocRef(MANIFEST_COLLECTION, f"http_cache__{source}")
+
+def load_http_cache(source: str, run: SyncRun = None) -> ResponseCache:
+  """Response cache seeded with the validators of `source`'s last successful sync.
   
-  print(f"[SCRAPER] Fetching faculty directory from {FACULTY_LIST_URL}")
-  html = requests.get(FACULTY_LIST_URL, timeout=30).text
-  soup = BeautifulSoup(html, "html.parser")
+  With a `run`, bodies it already fetched are served from its record.
+  """
+  data = get_store().get(_http_cache_ref(source))
+  return ResponseCache((data or {}).get("entries", {}), journal=run)
+
+def save_http_cache(source: str, cache: ResponseCache, keys=None):
+  """Persist the validators of this run's responses (only those of `keys`, if given)"""
+  get_store().set(_http_cache_ref(source), {"entries": cache.commit(keys), "updatedAt": SERVER_TIMESTAMP})
+
+def _manifest_refs(collection: str):
+  return [DocRef(MANIFEST_COLLECTION, f"{collection}__{i}") for i in range(MANIFEST_SHARDS)]
+
+def load_manifest(collection: str) -> dict:
+  """Return {doc_id: content_hash} for everything the last sync wrote to `collection`"""
+  hashes = {}
+  for _, data in get_store().get_many(_manifest_refs(collection)):
+    hashes.update(data.get("hashes", {}))
+  return hashes
+
+def save_manifest(collection: str, hashes: dict, previous: dict):
+  """Persist the manifest, rewriting only the shards whose contents moved"""
+  new_shards = [{} for _ in range(MANIFEST_SHARDS)]
+  old_shards = [{} for _ in range(MANIFEST_SHARDS)]
+  for doc_id, h in hashes.items():
+    new_shards[zlib.crc32(doc_id.encode("utf-8")) % MANIFEST_SHARDS][doc_id] = h
+  for doc_id, h in previous.items():
+    old_shards[zlib.crc32(doc_id.encode("utf-8")) % MANIFEST_SHARDS][doc_id] = h
   
-  # Find accordion sections and faculty within each department
-  people = {}
+  b = get_store().batch()
+  dirty = 0
+  for ref, new, old in zip(_manifest_refs(collection), new_shards, old_shards):
+    if new != old:
+      b.set(ref, {"collection": collection, "hashes": new, "updatedAt": SERVER_TIMESTAMP})
+      dirty += 1
+  if dirty:
+    b.commit()
+
+def retire_ops(collection: str, doc_ids):
+  """Delete or tombstone documents that vanished from their source, per SYNC_DELETE_MODE"""
+  if SYNC_DELETE_MODE != "tombstone":
+    for doc_id in doc_ids:
+      yield WriteOp("delete", DocRef(collection, doc_id))
+    return
+  expire_at = datetime.now(timezone.utc) + timedelta(days=TOMBSTONE_TTL_DAYS)
+  for doc_id in doc_ids:
+    yield WriteOp("set", DocRef(collection, doc_id), {
+      "deleted": True,
+      "deletedAt": SERVER_TIMESTAMP,
+      "expireAt": expire_at,
+    }, True)
+
+def _archive_past_terms(live_terms: set, counts: dict):
+  """Retirement for course_sessions: sessions of terms outside `live_terms` move to the archive"""
+  def retire(collection: str, doc_ids):
+    store = get_store()
+    found, archive = set(), {}
+    for ref, data in store.get_many([DocRef(collection, i) for i in doc_ids]):
+      found.add(ref.id)
+      if data.get("term") not in live_terms and not data.get("deleted"):
+        archive[ref.id] = data
+    # Archived copies are committed before their hot documents go, so a failed
+    # copy leaves the session where it was for the next run to retry
+    stats = store.write(WriteOp("set", DocRef(SESSION_ARCHIVE_COLLECTION, doc_id),
+                                {**data, "archivedAt": SERVER_TIMESTAMP}, False)
+                        for doc_id, data in sorted(archive.items()))
+    failed = {path.rsplit("/", 1)[-1] for path in stats["failed"]}
+    counts["archived"] = counts.get("archived", 0) + len(archive) - len(failed)
+    for doc_id in archive:
+      if doc_id not in failed:
+        yield WriteOp("delete", DocRef(collection, doc_id))
+    yield from retire_ops(collection, [i for i in doc_ids if i in found and i not in archive])
+    for doc_id in doc_ids:
+      if doc_id not in found:
+        yield WriteOp("delete", DocRef(collection, doc_id))
+  return retire
+
+class Manifest:
+  """The content hashes last synced to a collection, or to one partition (a term) of it"""
+
+  def __init__(self, collection: str, partition: str = '', untracked=(), journal=None):
+    self.collection = collection
+    self.partition = partition
+    # Called with the ids written since the last save, before the manifest shows them synced
+    self.journal = journal
+    self._unjournaled = set()
+    self.name = f"{collection}@{partition}" if partition else collection
+    self._saved = load_manifest(self.name)
+    self.previous = dict(self._saved)
+    # Documents written before there was a manifest count as synced, so they can be retired
+    for doc_id in untracked:
+      self.previous.setdefault(doc_id, None)
+    self.current = {}
+    self._committed, self._since_saved = dict(self.previous), 0
+
+  def removed(self) -> list:
+    return [doc_id for doc_id in self.previous if doc_id not in self.current]
+
+  def keep(self, doc_ids):
+    """Carry the previous hashes of `doc_ids` over, so they are still tracked next run"""
+    for doc_id in doc_ids:
+      self.current[doc_id] = self.previous[doc_id]
+
+  def committed(self, ops):
+    """Checkpoint committed writes, so a run cut short resumes with them counted as unchanged"""
+    for op in ops:
+      if op.ref.collection != self.collection:
+        continue
+      self._unjournaled.add(op.ref.id)
+      if op.kind == "set" and "contentHash" in op.data:
+        self._committed[op.ref.id] = op.data["contentHash"]
+        self._since_saved += 1
+    if self._since_saved >= DIFF_CHECKPOINT_WRITES:
+      self._journal()
+      save_manifest(self.name, self._committed, self._saved)
+      self._saved, self._since_saved = dict(self._committed), 0
+
+  def _journal(self):
+    if self.journal and self._unjournaled:
+      self.journal(sorted(self._unjournaled))
+    self._unjournaled = set()
+
+  def failed(self, paths):
+    """Forget failed writes so the next run retries them"""
+    for path in paths:
+      doc_id = path.rsplit("/", 1)[-1]
+      if doc_id in self.previous:
+        self.current[doc_id] = self.previous[doc_id]
+      else:
+        self.current.pop(doc_id, None)
+
+  def release(self, doc_ids):
+    """Stop tracking `doc_ids` without retiring them, for documents another partition took over"""
+    for doc_id in doc_ids:
+      self.previous.pop(doc_id, None)
+      self._committed.pop(doc_id, None)
+
+  def save(self):
+    self._journal()
+    save_manifest(self.name, self.current, self._saved)
+
+class Retirement:
+  """How documents gone from their source leave, and whether they may go this run"""
+
+  def __init__(self, ops=retire_ops, allowed=lambda: True):
+    # `allowed` is only asked once the records are drained, for sources that
+    # only know at the end whether they were complete
+    self.ops = ops
+    self.allowed = allowed
+
+def _changed_ops(manifest: Manifest, items, force: bool, counts: dict):
+  """Writes for the records whose content hash differs from the manifest's"""
+  for doc_id, body in items:
+    h = _content_hash(body)
+    if doc_id in manifest.current:
+      # Repeated id within this run: the last body wins, as with sequential merges
+      if manifest.current[doc_id] == h:
+        continue
+    else:
+      old = manifest.previous.get(doc_id)
+      if old == h and not force:
+        manifest.current[doc_id] = h
+        counts["unchanged"] += 1
+        continue
+      counts["added" if old is None else "changed"] += 1
+    manifest.current[doc_id] = h
+    data = {**body, "contentHash": h, "updatedAt": SERVER_TIMESTAMP}
+    if SYNC_DELETE_MODE == "tombstone":
+      # A document back in the source is revived rather than left to expire
+      data.update({"deleted": False, "expireAt": None})
+    yield WriteOp("set", DocRef(manifest.collection, doc_id), data, True)
+
+def _removed_ops(manifest: Manifest, retire: Retirement, counts: dict):
+  """Retirement writes for the tracked documents the records left out"""
+  removed = manifest.removed()
+  if not retire.allowed():
+    manifest.keep(removed)
+    return
+  retired = set()
+  for op in retire.ops(manifest.collection, removed):
+    if op.ref.collection == manifest.collection:
+      retired.add(op.ref.id)
+    yield op
+  manifest.keep(doc_id for doc_id in removed if doc_id not in retired)
+  counts["removed"] += len(retired & set(removed))
+
+def diff_sync(manifest: Manifest, records, retire: Retirement = None, force: bool = False,
+              chunk_size: int = None) -> dict:
+  """Write the (doc_id, body) `records` whose content changed and retire the tracked ones they left out"""
+  retire = retire or Retirement()
+  counts = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+  items = records.items() if isinstance(records, dict) else records
+  ops = itertools.chain(_changed_ops(manifest, items, force, counts), _removed_ops(manifest, retire, counts))
+  with span("write"):
+    write_stats = get_store().write(ops, on_committed=manifest.committed,
+                                    **({"chunk_size": chunk_size} if chunk_size else {}))
+  for k in ("written", "batches", "retries", "writes_per_second", "failed"):
+    counts[k] = write_stats[k]
+  manifest.failed(write_stats["failed"])
+  manifest.save()
+  log("DIFF", f"{manifest.name}: {counts}", collection=manifest.collection, partition=manifest.partition,
+      **{k: len(v) if k == "failed" else v for k, v in counts.items()})
+  return counts
+
+def _fetch_faculty_source(session, cache: ResponseCache, source: FacultySource, force: bool = False) -> CachedBody:
+  return cache.fetch(session, "GET", source.url, force=force)
+
+def _parse_faculty_source(source: FacultySource, body: CachedBody):
+  with open(body.path, encoding="utf-8", errors="replace") as f:
+    html = f.read()
+  with span("parse"):
+    return parse_faculty_links(html, source=source)
+
+def scrape_faculty(cache: ResponseCache = None, force: bool = False, stats: dict = None):
+  """Crawl every school's faculty directory; returns None if `cache` shows them all unchanged.
   
-  # Look for accordion toggles that contain department names
-  accordion_toggles = soup.find_all('a', class_='accordion__toggle')
+  Directories are fetched concurrently, within http_client's per-host
+  limits, and parsed as they arrive. Teachers listed by several schools
+  are kept once, under the first source that lists them. A source that
+  fails is recorded in stats["failed_sources"] and contributes no teachers.
+  """
+  sources = load_sources()
+  stats = stats if stats is not None else {}
+  stats.update(sources=len(sources), failed_sources=[], duplicates=0)
+  fetch_cache = cache or ResponseCache()
+  session = get_session(pool_size=FACULTY_FETCH_WORKERS)
+  log("SCRAPER", f"Fetching {len(sources)} faculty directories", sources=[s.url for s in sources])
   
-  print(f"[SCRAPER] Found {len(accordion_toggles)} accordion sections")
+  links, changed = {}, False
+  with ThreadPoolExecutor(max_workers=min(FACULTY_FETCH_WORKERS, len(sources))) as pool:
+    with span("fetch"):
+      futures = {pool.submit(_fetch_faculty_source, session, fetch_cache, source, force): i
+                 for i, source in enumerate(sources)}
+      for fut in as_completed(futures):
+        source = sources[futures[fut]]
+        try:
+          body = fut.result()
+        except Exception as e:
+          log("SCRAPER", f"{source.school} directory failed: {e}", severity="ERROR", url=source.url)
+          stats["failed_sources"].append({"school": source.school, "url": source.url, "error": str(e)})
+          continue
+        changed = changed or body.changed
+        # Department -> faculty links, in document order
+        links[futures[fut]] = _parse_faculty_source(source, body)
+  if not links:
+    raise RuntimeError(f"All {len(sources)} faculty directories failed to load")
+  if cache is not None and not changed:
+    log("SCRAPER", "Faculty directories unchanged since last sync")
+    return None
   
-  for toggle in accordion_toggles:
-    # Extract department name from the accordion toggle text
-    dept_span = toggle.find('span', class_='accordion__toggle__text')
-    if not dept_span:
-      continue
-    
-    dept_name = dept_span.get_text(strip=True)
-    print(f"[SCRAPER] Processing department: {dept_name}")
-    
-    # Find the accordion content section that follows this toggle
-    # Look for the parent accordion item and then find the content section
-    accordion_item = toggle.find_parent('div')
-    if not accordion_item:
-      continue
-    
-    # Find faculty links in the accordion content section
-    faculty_links = accordion_item.find_all('a', href=re.compile(r'/business/about/faculty/.*\.php$'))
-    faculty_count = 0
-    
-    for a in faculty_links:
-      href = a.get("href", "")
-      if href and "directory.php" not in href:
-        full_name = a.get_text(strip=True)
-        
-        # Clean up the name and generate email
-        clean_name = full_name.replace(",", "").replace("Ph.D.", "").replace("J.D.", "").replace("Dr.", "").replace("M.A.", "").replace("M.B.A.", "").replace("M.Sc.", "").strip()
-        name_parts = clean_name.split()
-        
-        if len(name_parts) >= 2:
-          first = name_parts[0].lower()
-          last = name_parts[-1].lower()
-          email = f"{first}.{last}@slu.edu"
-          
-          if email not in people:
-            people[email] = {"fullName": full_name, "department": dept_name}
-            faculty_count += 1
-            print(f"[SCRAPER] {full_name} -> {email} ({dept_name})")
-    
-    print(f"[SCRAPER] Found {faculty_count} faculty in {dept_name}")
+  people = {}
+  for i, source in enumerate(sources):
+    for dept_name, full_name in timed_iter("normalize", links.get(i, ())):
+      email = faculty_email(full_name)
+      if not email:
+        continue
+      if email in people:
+        stats["duplicates"] += people[email]["school"] != source.school
+        continue
+      # Links from the generic fallback carry no department
+      department = dept_name or source.department
+      people[email] = {"email": email, "fullName": full_name, "department": department, "school": source.school}
+      log_sampled("SCRAPER", "faculty", f"{full_name} -> {email} ({department}, {source.school})", email=email)
   
-  # Fallback: if accordion parsing didn't work, use generic approach
-  if not people:
-    print("[SCRAPER] Accordion parsing failed, falling back to generic approach...")
-    faculty_links = soup.select('a[href*="/business/about/faculty/"][href$=".php"]')
-    
-    for a in faculty_links:
-      href = a.get("href", "")
-      if href and "directory.php" not in href:
-        full_name = a.get_text(strip=True)
-        
-        # Clean up the name and generate email
-        clean_name = full_name.replace(",", "").replace("Ph.D.", "").replace("J.D.", "").replace("Dr.", "").replace("M.A.", "").replace("M.B.A.", "").replace("M.Sc.", "").strip()
-        name_parts = clean_name.split()
-        
-        if len(name_parts) >= 2:
-          first = name_parts[0].lower()
-          last = name_parts[-1].lower()
-          email = f"{first}.{last}@slu.edu"
-          
-          if email not in people:
-            people[email] = {"fullName": full_name, "department": "SLU Business"}
-            print(f"[SCRAPER] {full_name} -> {email} (SLU Business)")
-  
-  print(f"[SCRAPER] Final count: {len(people)} faculty with emails")
-  return [{"email": e, "fullName": data["fullName"], "department": data["department"]} for e, data in people.items()]
-
-def scrape_courses_from_api():
-  """Scrape courses and class sessions from the new courses.slu.edu API"""
-  print(f"[COURSES] Scraping courses from {COURSES_API_URL}")
+  log("SCRAPER", f"Final count: {len(people)} faculty with emails from {len(links)} of {len(sources)} directories "
+      f"({stats['duplicates']} listed by more than one school)",
+      faculty=len(people), failed_sources=len(stats["failed_sources"]), duplicates=stats["duplicates"])
+  return list(people.values())
+
+def course_shards(terms=None, subjects=None):
+  """(term, subject) pairs to query; subject None means an unfiltered search"""
+  subjects = COURSE_SUBJECTS or subjects or [None]
+  return [(term, subject) for term in (terms or COURSE_TERMS or [""]) for subject in subjects]
+
+def course_shard_payload(term: str, subject: str) -> dict:
+  criteria = [{"field": "keyword", "value": subject}] if subject else []
+  return {"other": {"srcdb": term}, "criteria": criteria}
+
+def course_shard_key(term: str, subject: str) -> str:
+  return ResponseCache.key("POST", COURSES_API_URL, course_shard_payload(term, subject))
+
+def _fetch_course_shard(session, cache: ResponseCache, term: str, subject: str, force: bool = False) -> CachedBody:
+  """Download one shard's response to the local cache"""
+  return cache.fetch(
+    session, "POST", COURSES_API_URL,
+    payload=course_shard_payload(term, subject),
+    force=force,
+    headers=COURSES_API_HEADERS,
+    timeout=(COURSE_SHARD_CONNECT_TIMEOUT, COURSE_SHARD_READ_TIMEOUT),
+  )
+
+@handler("course_shard")
+def _course_shard_unit(payload: dict) -> dict:
+  """Fetch one shard for a coordinator's run and record the body in it"""
+  term, subject = payload["term"], payload["subject"]
+  key = course_shard_key(term, subject)
+  cache = ResponseCache({key: payload["entry"]} if payload.get("entry") else {})
+  body = _fetch_course_shard(get_session(), cache, term, subject, payload.get("force", False))
+  run = SyncRun.attach(get_store(), payload["run"], payload["runId"])
+  return {"key": key, "saved": run.record(key, body.path, cache.entry(key))}
+
+def _course_shards_on_workers(shards, cache: ResponseCache, force: bool):
+  """Have the workers fetch `shards`; returns a fetch function serving their bodies from the run"""
+  run = cache.journal
+  todo = [(term, subject) for term, subject in shards if course_shard_key(term, subject) not in run.payloads]
+  payloads = [{"run": run.kind, "runId": run.id, "term": term, "subject": subject, "force": force,
+               "entry": cache.entries.get(course_shard_key(term, subject))} for term, subject in todo]
+  errors = {}
+  for (term, subject), (result, error) in zip(todo, run_units("course_shard", payloads)):
+    if error:
+      errors[(term, subject)] = error
+    else:
+      run.adopt(result["key"], result["saved"])
   
+  def fetch(session, cache, term, subject, force=False):
+    if (term, subject) in errors:
+      raise RuntimeError(errors[(term, subject)])
+    return _fetch_course_shard(session, cache, term, subject, force)
+  return fetch
+
+def course_search_page(cache: ResponseCache = None):
+  """HTML of the course search page, or None if it can't be fetched"""
   try:
-    headers = {
-      'Content-Type': 'application/json',
-      'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
-      'Referer': COURSES_BASE_URL
-    }
-    
-    # Get all courses - empty search returns all results
-    search_payload = {
-      "other": {"srcdb": ""},
-      "criteria": []
+    body = (cache or ResponseCache()).fetch(get_session(), "GET", COURSES_BASE_URL)
+    with open(body.path, encoding="utf-8", errors="replace") as f:
+      return f.read()
+  except Exception as e:
+    log("COURSES", f"Course search page unavailable: {e}", severity="WARNING")
+    return None
+
+def discover_terms(page: str = None):
+  """(code, label) pairs of the terms to sync, newest first; empty if the page lists none"""
+  if COURSE_TERMS:
+    return [(t, t) for t in COURSE_TERMS]
+  return parse_terms(page or "")
+
+def discover_subjects(page: str = None, known=()):
+  """Subject codes to shard each term's search by, falling back to the `known` ones"""
+  if COURSE_SUBJECTS:
+    return COURSE_SUBJECTS
+  subjects = parse_subjects(page or "")
+  if not subjects and known:
+    log("COURSES", f"No subjects found on the course search page, reusing the last {len(known)}",
+        severity="WARNING")
+  return subjects or list(known)
+
+def fetch_course_shards(terms, stats: dict, cache: ResponseCache, force: bool = False, subjects=None) -> dict:
+  """Download every shard of `terms` concurrently; returns {term: [(label, CachedBody)]}.
+  
+  A shard that fails or times out is recorded in stats["failed_shards"]
+  and costs only its own term. A coordinator with a run has the workers
+  fetch the shards, then reads the bodies back from the run.
+  """
+  shards = course_shards(terms, subjects)
+  session = get_session(pool_size=COURSE_FETCH_WORKERS)
+  stats.setdefault("shards", 0)
+  stats.setdefault("failed_shards", [])
+  stats["shards"] += len(shards)
+  bodies = {term: [] for term in terms}
+  with span("fetch"), ThreadPoolExecutor(max_workers=COURSE_FETCH_WORKERS) as pool:
+    fetch = _fetch_course_shard
+    if SYNC_ROLE == "coordinator" and cache.journal is not None:
+      fetch = _course_shards_on_workers(shards, cache, force)
+    futures = [(term, subject, pool.submit(fetch, session, cache, term, subject, force))
+               for term, subject in shards]
+    for term, subject, fut in futures:
+      label = f"{term or 'default'}/{subject or '*'}"
+      try:
+        bodies[term].append((label, fut.result()))
+      except Exception as e:
+        log("COURSES", f"Shard {label} failed: {e}", severity="ERROR", term=term, subject=subject)
+        stats["failed_shards"].append({"term": term, "subject": subject, "error": str(e)})
+  return bodies
+
+def iter_term_results(term: str, bodies, stats: dict):
+  """Stream one term's raw FOSE results off disk, de-duplicated by CRN, as (term, entry) pairs"""
+  import ijson
+  stats.setdefault("duplicates", 0)
+  stats.setdefault("results", 0)
+  stats.setdefault("terms", set())
+  seen = set()
+  for label, body in bodies:
+    count = 0
+    with open(body.path, "rb") as f:
+      for entry in timed_iter("parse", ijson.items(f, 'results.item', use_float=True)):
+        count += 1
+        entry_term = entry.get('srcdb') or term
+        key = entry.get('crn') or f"{entry.get('code', '')}|{entry.get('section', entry.get('no', ''))}"
+        if key in seen:
+          stats["duplicates"] += 1
+          continue
+        seen.add(key)
+        stats["results"] += 1
+        stats["terms"].add(entry_term)
+        yield entry_term, entry
+    log("COURSES", f"Shard {label}: {count} results{'' if body.changed else ' (unchanged)'}")
+
+def iter_course_results(stats: dict = None, cache: ResponseCache = None, force: bool = False, terms=None):
+  """Stream raw FOSE results of every term (the discovered ones by default).
+  
+  Shards are downloaded concurrently to the local response cache, then
+  their `results` arrays are parsed item by item off disk. If every shard
+  comes back unchanged (a 304, or the same body hash as the last committed
+  run) nothing is parsed and stats["unchanged"] is set.
+  """
+  stats = stats if stats is not None else {}
+  cache = cache if cache is not None else ResponseCache()
+  page = None if COURSE_TERMS and COURSE_SUBJECTS else course_search_page(cache)
+  terms = terms or [code for code, _ in discover_terms(page)] or [""]
+  stats.update({"shards": 0, "failed_shards": [], "duplicates": 0, "results": 0, "unchanged": False,
+                "terms": set()})
+  bodies = fetch_course_shards(terms, stats, cache, force, discover_subjects(page))
+  fetched = [body for term in terms for _, body in bodies[term]]
+  if fetched and not stats["failed_shards"] and not any(body.changed for body in fetched):
+    log("COURSES", f"All {len(fetched)} shards unchanged since the last sync")
+    stats["unchanged"] = True
+    return
+  for term in terms:
+    yield from iter_term_results(term, bodies[term], stats)
+
+def _normalize_course_entry(course_entry: dict, term: str = '', resolver: EmailResolver = None):
+  """Turn one FOSE result into session records, one per listed instructor"""
+  resolver = resolver or _GUESS_RESOLVER
+  sessions = []
+  
+  # Extract basic course information
+  course_code = course_entry.get('code', '')
+  course_title = course_entry.get('title', '')
+  
+  # Extract department from course code (e.g., ACCT from ACCT 1220)
+  dept_match = re.match(r'^([A-Z]+)', course_code)
+  dept = dept_match.group(1) if dept_match else 'UNKNOWN'
+  
+  # Extract instructor information from the 'instr' field
+  instructor_names = []
+  if course_entry.get('instr'):
+    # Handle multiple instructors separated by '/' 
+    raw_instructors = course_entry['instr'].split('/')
+    for instr in raw_instructors:
+      instr = instr.strip()
+      if instr and instr not in ['Staff', 'TBA']:
+        instructor_names.append(instr)
+  
+  # Parsed once per section; every instructor's session shares it
+  meeting_times = course_entry.get('meetingTimes', '[]')
+  meetings = meeting_fields(meeting_times)
+  
+  # Process this course session
+  for instructor_name in instructor_names if instructor_names else ['Staff']:
+    session_info = {
+      'course_code': course_code,
+      'course_title': course_title,
+      'department': dept,
+      'school': 'SLU',
+      'section_number': course_entry.get('section', course_entry.get('no', '')),
+      'crn': course_entry.get('crn', ''),
+      'instructor_name': instructor_name,
+      'instructor_email': '',
+      'meeting_times': meeting_times,
+      **meetings,
+      'credits': '',  # Not directly available in this format
+      'capacity': course_entry.get('total', ''),
+      'enrolled': '',  # Not directly available
+      'waitlist': '',  # Not directly available
+      'term': term,
+      'status': course_entry.get('stat', 'A'),
+      'start_date': course_entry.get('start_date', ''),
+      'end_date': course_entry.get('end_date', ''),
+      'schedule_type': course_entry.get('schd', ''),
+      'campus': course_entry.get('campus_code', '')
     }
     
-    print("[COURSES] Making API request to get course data...")
-    
-    # Make the API request
-    response = requests.post(COURSES_API_URL, json=search_payload, headers=headers, timeout=60)
-    
-    if response.status_code != 200:
-      print(f"[COURSES] API request failed with status {response.status_code}")
-      print(f"[COURSES] Response: {response.text}")
-      return []
+    # Match the instructor against the faculty directory
+    if instructor_name and instructor_name not in ['Staff', 'TBA']:
+      session_info['instructor_email'] = resolver.resolve(instructor_name)
     
-    data = response.json()
-    print(f"[COURSES] API response received, parsing...")
-    
-    courses_with_sessions = []
-    
-    # Parse the API response to extract course and session information
-    if 'results' in data:
-      results = data['results']
-      print(f"[COURSES] Found {len(results)} course sessions")
-      
-      for course_entry in results:
-        # Extract basic course information
-        course_code = course_entry.get('code', '')
-        course_title = course_entry.get('title', '')
-        
-        # Extract department from course code (e.g., ACCT from ACCT 1220)
-        dept_match = re.match(r'^([A-Z]+)', course_code)
-        dept = dept_match.group(1) if dept_match else 'UNKNOWN'
-        
-        # Extract instructor information from the 'instr' field
-        instructor_names = []
-        if course_entry.get('instr'):
-          # Handle multiple instructors separated by '/' 
-          raw_instructors = course_entry['instr'].split('/')
-          for instr in raw_instructors:
-            instr = instr.strip()
-            if instr and instr not in ['Staff', 'TBA']:
-              instructor_names.append(instr)
-        
-        # Process this course session
-        for instructor_name in instructor_names if instructor_names else ['Staff']:
-          session_info = {
-            'course_code': course_code,
-            'course_title': course_title,
-            'department': dept,
-            'school': 'SLU',
-            'section_number': course_entry.get('section', course_entry.get('no', '')),
-            'crn': course_entry.get('crn', ''),
-            'instructor_name': instructor_name,
-            'instructor_email': '',  # We'll try to match this with faculty data
-            'meeting_times': course_entry.get('meetingTimes', '[]'),
-            'credits': '',  # Not directly available in this format
-            'capacity': course_entry.get('total', ''),
-            'enrolled': '',  # Not directly available
-            'waitlist': '',  # Not directly available
-            'term': '',  # We could extract this from term selection
-            'status': course_entry.get('stat', 'A'),
-            'start_date': course_entry.get('start_date', ''),
-            'end_date': course_entry.get('end_date', ''),
-            'schedule_type': course_entry.get('schd', ''),
-            'campus': course_entry.get('campus_code', '')
-          }
-          
-          # Try to extract instructor email if instructor name is available
-          if instructor_name and instructor_name not in ['Staff', 'TBA']:
-            # Clean up instructor name and generate potential email
-            clean_name = re.sub(r'\s*\([^)]*\)', '', instructor_name).strip()
-            name_parts = clean_name.split()
-            
-            if len(name_parts) >= 2:
-              first = name_parts[0].lower()
-              last = name_parts[-1].lower()
-              # Remove any title prefixes and handle initials
-              first = re.sub(r'^(dr|prof|professor)\.?', '', first)
-              first = re.sub(r'\.', '', first)  # Remove dots from initials like "A."
-              last = re.sub(r'\.', '', last)
-              if first and last:  # Make sure both parts exist after cleaning
-                session_info['instructor_email'] = f"{first}.{last}@slu.edu"
-          
-          courses_with_sessions.append(session_info)
-    
-    print(f"[COURSES] Extracted {len(courses_with_sessions)} course sessions")
-    return courses_with_sessions
-    
-  except Exception as e:
-    print(f"[COURSES] Error scraping from API: {str(e)}")
-    # Fallback to a broader search
-    try:
-      print("[COURSES] Trying fallback search...")
-      
-      # Try a broader search without specific term
-      fallback_payload = {
-        "other": {"srcdb": ""},
-        "criteria": []
-      }
-      
-      response = requests.post(COURSES_API_URL, json=fallback_payload, headers=headers, timeout=60)
-      
-      if response.status_code == 200:
-        data = response.json()
-        print(f"[COURSES] Fallback search returned data, processing...")
-        # Process similar to above
-        return []  # For now, return empty on fallback
-      else:
-        print(f"[COURSES] Fallback search also failed: {response.status_code}")
-        
-    except Exception as fallback_error:
-      print(f"[COURSES] Fallback search error: {str(fallback_error)}")
-    
-    return []
+    sessions.append(session_info)
+  return sessions
+
+def scrape_courses_from_api(stats: dict = None, cache: ResponseCache = None, force: bool = False):
+  """Stream course sessions from the courses.slu.edu API as they are parsed"""
+  log("COURSES", f"Scraping courses from {COURSES_API_URL}")
+  stats = stats if stats is not None else {}
+  stats["sessions"] = 0
+  
+  def normalized():
+    for term, course_entry in iter_course_results(stats, cache, force):
+      yield from _normalize_course_entry(course_entry, term)
+  
+  for session in timed_iter("normalize", normalized()):
+    stats["sessions"] += 1
+    yield session
+    if stats["sessions"] % 250 == 0:
+      report(course_results=stats["results"], sessions=stats["sessions"])
+  report(course_results=stats["results"], sessions=stats["sessions"],
+         failed_shards=len(stats["failed_shards"]))
+  
+  log("COURSES", f"Found {stats['results']} course sections across {stats['shards']} shards "
+      f"({len(stats['failed_shards'])} failed, {stats['duplicates']} duplicates)",
+      results=stats['results'], shards=stats['shards'], failed_shards=len(stats['failed_shards']),
+      duplicates=stats['duplicates'])
+  log("COURSES", f"Extracted {stats['sessions']} course sessions")
 
 
-def scrape_courses_catalog():
+def scrape_courses_catalog(stats: dict = None, cache: ResponseCache = None, force: bool = False):
   """Updated function to use the new API-based scraper"""
-  return scrape_courses_from_api()
+  return scrape_courses_from_api(stats, cache, force)
 
 
 def _infer_dept_from_url(url: str) -> str:
@@ -237,278 +652,896 @@ def _infer_dept_from_url(url: str) -> str:
 # Remove the old scraping function and replace with a placeholder
 def scrape_courses_catalog_old():
   """Legacy course catalog scraper - kept for reference"""
-  print(f"[COURSES] Legacy catalog scraping is deprecated, use scrape_courses_from_api instead")
+  log("COURSES", "Legacy catalog scraping is deprecated, use scrape_courses_from_api instead")
   return []
 
-def upsert_teachers_dir():
-  print("[SEED] Starting teacher directory update...")
-  faculty = scrape_faculty()
-  count = 0
-  for f in faculty:
-    email = f["email"].lower()
-    full_name = f.get("fullName") or email
-    department = f.get("department", "SLU Business")
-    doc_id = _sanitize_id(email)
-    print(f"[SEED] Writing {full_name} ({email}) - {department} to Firestore...")
-    db.collection("teachers_dir").document(doc_id).set({
-      "email": email,
-      "fullName": full_name,
-      "department": department,
-      "school": "SLU Business",
-      # Courses are managed via a global catalog; teachers can select from it in-app.
-      "courses": [],
-      "source": "scrape",
-      "updatedAt": firestore.SERVER_TIMESTAMP,
-    }, merge=True)
-    count += 1
-    time.sleep(0.2)  # be gentle
-  print(f"[SEED] Completed! Updated {count} teacher records.")
-  return count
+def upsert_teachers_dir(force: bool = False, run: SyncRun = None):
+  log("SEED", "Starting teacher directory update...")
+  set_phase("scrape_faculty")
+  cache = load_http_cache("faculty", run)
+  scrape_stats = {}
+  faculty = scrape_faculty(cache, force, scrape_stats)
+  if faculty is None:
+    return {"written": 0, "batches": 0, "retries": 0, "failed": [], "writes_per_second": 0.0,
+            "new_teachers": 0, "unchanged": True}
+  report(faculty=len(faculty))
+  set_phase("write_teachers")
+  store = get_store()
+  # Teachers new to the directory may already have sessions waiting to be linked
+  existing = set(store.ids("teachers_dir"))
+  new_emails = [f["email"].lower() for f in faculty if _sanitize_id(f["email"]) not in existing]
+  
+  tracked = set(load_manifest("teachers_dir"))
+  # Scraped teachers from before teachers_dir had a manifest
+  untracked = () if tracked else [doc_id for doc_id, _ in store.scan(
+    "teachers_dir", fields=["source"], where=[("source", "==", "scrape")])]
+  known = tracked | set(untracked)
+  leaving = known - {_sanitize_id(f["email"]) for f in faculty}
+  failed_sources = scrape_stats["failed_sources"]
+  allow_deletes = bool(faculty) and len(leaving) <= TEACHER_MAX_REMOVED_FRACTION * len(known)
+  if leaving and failed_sources:
+    # The teachers of a directory that failed to load are not gone
+    log("SEED", f"Keeping {len(leaving)} teachers missing from the directories; "
+        f"{len(failed_sources)} directories failed to load", severity="WARNING")
+    allow_deletes = False
+  elif leaving and not allow_deletes:
+    log("SEED", f"Keeping {len(leaving)} of {len(known)} teachers missing from the directory; "
+        f"more than {TEACHER_MAX_REMOVED_FRACTION:.0%} gone looks like a bad scrape", severity="WARNING")
+  
+  def records():
+    for f in faculty:
+      email = f["email"].lower()
+      full_name = f.get("fullName") or email
+      department = f.get("department", "SLU Business")
+      log_sampled("SEED", "teacher", f"Queueing {full_name} ({email}) - {department}", email=email)
+      yield _sanitize_id(email), {
+        "email": email,
+        "fullName": full_name,
+        "department": department,
+        "school": f.get("school", "SLU Business"),
+        # Courses are managed via a global catalog; teachers can select from it in-app.
+        "courses": [],
+        "searchKeywords": teacher_keywords(full_name, department, email),
+        "source": "scrape",
+      }
+  
+  # New teachers are queued for linking as they commit, so a run cut short still links them
+  new_ids = {_sanitize_id(email): email for email in new_emails}
+  journal = lambda ids: record_link_changes(emails=[new_ids[i] for i in ids if i in new_ids])
+  stats = diff_sync(Manifest("teachers_dir", untracked=untracked, journal=journal), records(),
+                    Retirement(allowed=lambda: allow_deletes), force=force, chunk_size=TEACHER_WRITE_CHUNK)
+  if not stats["failed"]:
+    failed_urls = {f["url"] for f in failed_sources}
+    save_http_cache("faculty", cache, [ResponseCache.key("GET", source.url) for source in load_sources()
+                                       if source.url not in failed_urls])
+  stats["new_teachers"] = len(new_emails)
+  stats["failed_sources"] = failed_sources
+  stats["unchanged"] = False
+  log("SEED", f"Completed! Updated {stats['written']} teacher records "
+      f"({stats['writes_per_second']} writes/s, {stats['removed']} removed, {len(stats['failed'])} failed).",
+      written=stats['written'], removed=stats['removed'], writes_per_second=stats['writes_per_second'],
+      failed=len(stats['failed']))
+  return stats
 
-@app.get("/seed")
-def seed():
-  try:
-    print("[SEED] Starting teacher directory seeding...")
-    n = upsert_teachers_dir()
-    print(f"[SEED] Successfully completed with {n} updates.")
-    return {"ok": True, "updated": n}
-  except Exception as e:
-    print(f"[SEED] Error: {str(e)}")
-    return Response(str(e), status_code=500)
+def run_seed(force: bool = False, run: SyncRun = None):
+  log("SEED", "Starting teacher directory seeding...")
+  own_run = run is None
+  with SyncRun.begin(get_store(), "seed") if own_run else nullcontext(run) as run:
+    report(run_id=run.id, resumed=run.resumed)
+    stats = upsert_teachers_dir(force, run)
+    log("SEED", f"Successfully completed with {stats['written']} updates.")
+    if own_run and not stats["failed"]:
+      run.finish()
+  return {
+    "ok": True,
+    "run_id": run.id,
+    "resumed": run.resumed,
+    "unchanged": stats["unchanged"],
+    "updated": stats["written"],
+    "new_teachers": stats["new_teachers"],
+    "removed": stats.get("removed", 0),
+    "batches": stats["batches"],
+    "retries": stats["retries"],
+    "failed": stats["failed"],
+    "failed_sources": stats.get("failed_sources", []),
+    "http_hosts": host_states(),
+    "writes_per_second": stats["writes_per_second"],
+  }
 
-@app.get("/seed_courses")
-def seed_courses():
-  try:
-    print("[COURSES] Starting course catalog scraping from courses.slu.edu API...")
-    
-    data = scrape_courses_catalog()
-    print(f"[COURSES] Scraped {len(data)} course sessions, writing to Firestore...")
-    
-    if not data:
-      print("[COURSES] No course data retrieved")
-      return {"ok": False, "message": "No course data retrieved", "count": 0}
-    
-    # Write course sessions to Firestore
-    batch = db.batch()
-    coll = db.collection("course_sessions")
-    
-    # Also maintain a courses catalog for unique courses
-    courses_coll = db.collection("courses_catalog")
-    unique_courses = {}
-    
-    written = 0
-    def flush_batch(b):
-      nonlocal written
-      b.commit()
-      written += 1
-    
-    i = 0
-    b = db.batch()
-    
-    for session in data:
-      # Create document ID for the session
-      session_id = f"{session['course_code'].replace(' ', '_')}_{session['section_number']}_{session.get('crn', 'unknown')}"
-      session_id = re.sub(r'[^a-zA-Z0-9_\-]', '_', session_id)[:500]
-      
-      # Write session data
-      session_ref = coll.document(session_id)
-      b.set(session_ref, {
-        **session,
-        "source": "courses_api",
-        "updatedAt": firestore.SERVER_TIMESTAMP,
-      }, merge=True)
-      
-      # Track unique courses
+def _meeting_summary(blocks) -> str:
+  """Compact 'MW 9:00-10:15' text for a session's meeting blocks"""
+  slots = {}
+  for b in blocks:
+    time_range = f"{b['start'] // 60}:{b['start'] % 60:02d}-{b['end'] // 60}:{b['end'] % 60:02d}"
+    slots[time_range] = slots.get(time_range, 0) | b["days"]
+  return ', '.join(''.join(DAY_LETTERS[d] for d in range(7) if days >> d & 1) + ' ' + time_range
+                   for time_range, days in slots.items())
+
+def _add_section(sections: dict, session_id: str, session: dict):
+  """Fold one session row into its course's per-section summaries"""
+  section = sections.get(session_id)
+  if section is None:
+    section = sections[session_id] = {
+      "crn": session.get('crn', ''),
+      "section": session.get('section_number', ''),
+      "term": session.get('term', ''),
+      "status": session.get('status', ''),
+      "meets": _meeting_summary(session.get('meetings') or []),
+      "capacity": session.get('capacity', ''),
+      "instructors": [],
+    }
+  name = session.get('instructor_name', '')
+  if name and name not in ('Staff', 'TBA') and name not in section["instructors"]:
+    section["instructors"].append(name)
+
+def _section_summary(sections: dict) -> dict:
+  """Denormalized, size-bounded section fields for a courses_catalog document"""
+  ordered = sorted(sections.values(), key=lambda s: (s["term"], str(s["section"]), str(s["crn"])))
+  capacity = 0
+  for s in ordered:
+    try:
+      capacity += int(s["capacity"] or 0)
+    except (TypeError, ValueError):
+      pass
+  instructors = sorted({name for s in ordered for name in s["instructors"]})
+  return {
+    "sections": ordered[:COURSE_SECTION_SUMMARY_MAX],
+    "sectionCount": len(ordered),
+    "openSections": sum(1 for s in ordered if s["status"] == 'A'),
+    "crns": [s["crn"] for s in ordered if s["crn"]][:COURSE_SECTION_SUMMARY_MAX],
+    "instructors": instructors[:COURSE_SECTION_SUMMARY_MAX],
+    "totalCapacity": capacity,
+    "terms": sorted({s["term"] for s in ordered if s["term"]}),
+  }
+
+def _combine_term_summaries(by_term: dict) -> dict:
+  """Course-level section fields over every hot term's summary"""
+  sections, crns, instructors, terms = [], [], set(), set()
+  totals = {"sectionCount": 0, "openSections": 0, "totalCapacity": 0}
+  for term in sorted(by_term):
+    summary = by_term[term]
+    sections.extend(summary.get("sections", []))
+    crns.extend(summary.get("crns", []))
+    instructors.update(summary.get("instructors", []))
+    terms.update(summary.get("terms", []))
+    for field in totals:
+      totals[field] += summary.get(field, 0)
+  return {
+    "sections": sections[:COURSE_SECTION_SUMMARY_MAX],
+    **totals,
+    "crns": crns[:COURSE_SECTION_SUMMARY_MAX],
+    "instructors": sorted(instructors)[:COURSE_SECTION_SUMMARY_MAX],
+    "terms": sorted(terms),
+  }
+
+def _drop_term(term: str):
+  """Retirement for a catalog partition: the course loses that term's summary, not its document"""
+  def retire(collection: str, doc_ids):
+    for doc_id in doc_ids:
+      yield WriteOp("set", DocRef(collection, doc_id), {"byTerm": {term_key(term): DELETE_FIELD}}, True)
+  return retire
+
+def _session_manifest(term: str, untracked=()) -> Manifest:
+  """A term's course_sessions manifest; sessions queue for linking as they commit"""
+  return Manifest("course_sessions", term, untracked, journal=lambda ids: record_link_changes(session_ids=ids))
+
+def _catalog_manifest(term: str, untracked=()) -> Manifest:
+  """A term's courses_catalog manifest; courses queue for a catalog refresh as they commit"""
+  return Manifest("courses_catalog", term, untracked, journal=record_catalog_changes)
+
+def _catalog_state_ref():
+  return DocRef(MANIFEST_COLLECTION, CATALOG_STATE_DOC)
+
+def record_catalog_changes(course_ids):
+  """Queue catalog courses for _refresh_pending_catalog"""
+  get_store().set(_catalog_state_ref(), {"courseIds": ArrayUnion(list(course_ids)), "updatedAt": SERVER_TIMESTAMP},
+                  merge=True)
+
+def _refresh_pending_catalog() -> dict:
+  """Refresh every queued course, including those a run cut short left behind"""
+  store = get_store()
+  pending = (store.get(_catalog_state_ref()) or {}).get("courseIds", [])
+  if not pending:
+    return {"failed": [], "batches": 0}
+  refreshed = _refresh_catalog(pending)
+  if not refreshed["failed"]:
+    store.set(_catalog_state_ref(), {"courseIds": ArrayRemove(pending), "updatedAt": SERVER_TIMESTAMP}, merge=True)
+  return refreshed
+
+def _refresh_catalog(course_ids) -> dict:
+  """Rebuild the course-level fields of `course_ids` from their per-term summaries"""
+  store = get_store()
+  ops, gone = [], []
+  refs = [DocRef("courses_catalog", i) for i in sorted(course_ids)]
+  for ref, data in store.get_many(refs, fields=["code", "title", "dept", "byTerm"]):
+    by_term = data.get("byTerm") or {}
+    if not by_term:
+      gone.append(ref.id)
+      continue
+    summary = _combine_term_summaries(by_term)
+    summary["searchKeywords"] = course_keywords(data.get("code", ""), data.get("title", ""), data.get("dept", ""),
+                                                summary["instructors"])
+    summary["updatedAt"] = SERVER_TIMESTAMP
+    ops.append(WriteOp("set", ref, summary, True))
+  # Courses left with no term in the hot window leave the catalog
+  with span("write"):
+    return store.write(itertools.chain(ops, retire_ops("courses_catalog", gone)))
+
+def _merge_counts(diffs) -> dict:
+  """Sum diff_sync counts across partitions"""
+  merged = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0, "archived": 0, "written": 0,
+            "batches": 0, "retries": 0, "failed": []}
+  for diff in diffs:
+    for k in merged:
+      merged[k] += diff.get(k, [] if k == "failed" else 0)
+  return merged
+
+def _term_state() -> dict:
+  """The stored term state: {"partitions": {term: state} for each hot term, "subjects": last discovered}"""
+  data = get_store().get(DocRef(MANIFEST_COLLECTION, TERM_STATE_DOC))
+  if data is not None:
+    return {"partitions": {term_code(k): v for k, v in data.get("partitions", {}).items()},
+            "subjects": data.get("subjects", []),
+            "terms": [(t["code"], t["label"]) for t in data.get("terms", [])],
+            "baselineAdopted": data.get("baselineAdopted", False)}
+  # Before terms were partitioned, every session lived in the default term's partition
+  return {"partitions": {"": {}} if load_manifest("course_sessions") else {}, "subjects": [], "terms": [],
+          "baselineAdopted": False}
+
+def _save_term_state(partitions: dict, subjects, terms, baseline_adopted: bool):
+  get_store().set(DocRef(MANIFEST_COLLECTION, TERM_STATE_DOC), {
+    "partitions": {term_key(term): entry for term, entry in partitions.items()},
+    "subjects": subjects,
+    # Firestore arrays can't hold arrays, so each (code, label) pair is a map
+    "terms": [{"code": code, "label": label} for code, label in terms],
+    "baselineAdopted": baseline_adopted,
+    "updatedAt": SERVER_TIMESTAMP,
+  })
+
+def _untracked_course_docs(collection: str, terms) -> list:
+  """Ids of courses API documents in `collection` that no manifest of `terms` tracks"""
+  tracked = set()
+  for term in terms:
+    tracked.update(Manifest(collection, term).previous)
+  return [doc_id for doc_id, _ in get_store().scan(collection, fields=["source"], page_size=LINK_READ_PAGE,
+                                                   where=[("source", "==", "courses_api")])
+          if doc_id not in tracked]
+
+def _faculty_fingerprint() -> str:
+  """Changes whenever a teacher the instructor resolver could match is added, edited or removed"""
+  return _content_hash(load_manifest("teachers_dir"))
+
+def _faculty_resolver() -> EmailResolver:
+  """Instructor name resolution over the teachers already in teachers_dir"""
+  teachers = get_store().scan("teachers_dir", fields=["email", "fullName", "deleted"], page_size=LINK_READ_PAGE)
+  resolver = EmailResolver((data.get("fullName", ""), data.get("email", ""))
+                           for _, data in teachers if not data.get("deleted"))
+  log("COURSES", f"Matching instructors against {len(resolver)} known teachers", teachers=len(resolver))
+  return resolver
+
+def _add_occupancy(schedule: dict, session: dict):
+  """Fold one session's meetings into its room's and its instructor's weekly occupancy"""
+  blocks = session.get('meetings')
+  if not blocks:
+    return
+  crn = session.get('crn', '')
+  email = session.get('instructor_email', '')
+  for kind, key, bits in [("room", b["room"], occupancy([b])) for b in blocks if b["room"]] + \
+                         ([("instructor", email, occupancy(blocks))] if email else []):
+    entry = schedule.setdefault((kind, key), [0, set()])
+    entry[0] |= bits
+    entry[1].add(crn)
+
+def _occupancy_records(term: str, schedule: dict) -> dict:
+  records = {}
+  for (kind, key), (bits, crns) in schedule.items():
+    doc_id = re.sub(r'[^a-zA-Z0-9_\-]', '_', f"{term_key(term)}__{kind}__{key.lower()}")[:500]
+    records[doc_id] = {
+      "kind": kind,
+      "key": key,
+      "term": term,
+      "slotMinutes": OCCUPANCY_SLOT_MINUTES,
+      "occupancy": encode_occupancy(bits),
+      "sections": len(crns),
+    }
+  return records
+
+def _sync_term_sessions(term: str, bodies, force: bool, fetched_ok: bool, courses: dict,
+                        resolver: EmailResolver, schedule: dict, legacy: set):
+  """Diff one term's sessions into its course_sessions partition.
+  
+  Sections are folded into `courses` and weekly occupancy into `schedule`
+  as the sessions stream past. A session whose unprefixed id is in `legacy`
+  (written before terms were partitioned) claims that document instead of
+  a new one, and the id leaves `legacy`.
+  """
+  term_stats = {"terms": {term}, "sessions": 0}
+  archived = {}
+  manifest = _session_manifest(term)
+  
+  def records():
+    entries = iter_term_results(term, bodies, term_stats)
+    normalized = (s for entry_term, entry in entries for s in _normalize_course_entry(entry, entry_term, resolver))
+    for session in timed_iter("normalize", normalized):
+      term_stats["sessions"] += 1
+      if term_stats["sessions"] % 250 == 0:
+        report(term=term, term_sessions=term_stats["sessions"])
+      # Track unique courses; far fewer than sessions, so these stay in memory
       course_key = f"{session['course_code']}|{session['course_title']}"
-      if course_key not in unique_courses:
-        unique_courses[course_key] = {
+      if course_key not in courses:
+        courses[course_key] = {
           "code": session['course_code'],
           "title": session['course_title'],
           "dept": session['department'],
           "school": session['school'],
+          "source": "courses_api",
+          "sections": {},
         }
-      
-      i += 1
-      if i % 400 == 0:
-        flush_batch(b)
-        b = db.batch()
-    
-    # Write remaining sessions
-    if i % 400 != 0:
-      flush_batch(b)
-    
-    # Write unique courses to courses_catalog
-    print(f"[COURSES] Writing {len(unique_courses)} unique courses to catalog...")
-    b = db.batch()
-    
-    for course_data in unique_courses.values():
-      course_id = re.sub(r'[^a-zA-Z0-9_\-]', '_', f"{course_data['code'].replace(' ', '_')}__{course_data['title']}")[:500]
-      course_ref = courses_coll.document(course_id)
-      b.set(course_ref, {
-        **course_data,
-        "source": "courses_api",
-        "updatedAt": firestore.SERVER_TIMESTAMP,
-      }, merge=True)
-    
-    flush_batch(b)
-    
-    print(f"[COURSES] Completed! Wrote {len(data)} sessions and {len(unique_courses)} courses.")
-    return {
-      "ok": True, 
-      "sessions_count": len(data), 
-      "courses_count": len(unique_courses),
-      "batches": written + 1
-    }
-    
-  except Exception as e:
-    print(f"[COURSES] Error: {str(e)}")
-    return Response(str(e), status_code=500)
+      session_id = _session_doc_id(session)
+      if session_id in legacy:
+        legacy.discard(session_id)
+      elif session_id not in manifest.previous:
+        session_id = _session_doc_id(session, term)
+      _add_section(courses[course_key]["sections"], session_id, session)
+      _add_occupancy(schedule, session)
+      yield session_id, {**session, "source": "courses_api"}
+  
+  # A failed shard looks exactly like sections vanishing; never delete on a partial
+  # or empty fetch. Both are only known once the stream has been drained.
+  def complete():
+    return fetched_ok and term_stats["sessions"] > 0
+  
+  # Sessions gone from the term are retired; in the default term's partition,
+  # sessions of terms the API no longer returns are archived to a cold collection
+  retire = Retirement(_archive_past_terms(term_stats["terms"], archived), allowed=complete)
+  diff = diff_sync(manifest, records(), retire, force=force)
+  diff["archived"] = archived.get("archived", 0)
+  return diff, term_stats["sessions"], complete()
+
+def run_seed_courses(force: bool = False, sessions_synced=None, run: SyncRun = None, faculty_written=None):
+  """Sync course_sessions and the courses_catalog summaries derived from them, term by term.
+  
+  Each term is its own partition: new session ids are prefixed with the term
+  (sessions written before keep theirs, since clients store them), and both
+  collections track it with its own manifest, so the usual refresh
+  only fetches, diffs and writes the live terms. Frozen terms are synced
+  once more after they stop being live, then left alone; terms that fall
+  out of the hot window are archived. `sessions_synced` is called once the
+  sessions are written and their link changes queued, before the catalog
+  sync, so linking can start early. `faculty_written` is called once the
+  shards are fetched, before instructors are matched against teachers_dir,
+  and returns when the directory is fully written.
+  
+  Runs as part of `run` when given, otherwise as its own seed_courses run,
+  resuming the last one if it never finished.
+  """
+  own_run = run is None
+  with SyncRun.begin(get_store(), "seed_courses") if own_run else nullcontext(run) as run, RssPeak() as rss:
+    report(run_id=run.id, resumed=run.resumed)
+    result = _seed_courses(force, sessions_synced, run, faculty_written)
+    if own_run and result["ok"]:
+      run.finish()
+  return {**result, "run_id": run.id, "resumed": run.resumed, "peak_rss_mb": rss.peak_mb}
+
+def _seed_courses(force: bool, sessions_synced, run: SyncRun, faculty_written=None):
+  log("COURSES", "Starting course catalog scraping from courses.slu.edu API...")
+  store = get_store()
+  cache = load_http_cache("courses", run)
+  
+  set_phase("plan_terms")
+  state = _term_state()
+  partitions = state["partitions"]
+  page = None if COURSE_TERMS and COURSE_SUBJECTS else course_search_page(cache)
+  subjects = discover_subjects(page, state["subjects"])
+  available = discover_terms(page)
+  discovered = bool(available)
+  if not discovered:
+    # Without a term list, no term can be known to have left the hot window
+    available = state["terms"] or [("", "default")]
+    if state["terms"]:
+      log("COURSES", f"No terms found on the course search page, reusing the last {len(available)} "
+          "and archiving none", severity="WARNING")
+    else:
+      log("COURSES", "No terms found on the course search page, using the default term", severity="WARNING")
+  # Documents written before there were manifests are tracked by none; the default
+  # term's partition takes them in, so they are archived like any past term
+  baseline = {}
+  if discovered and not state["baselineAdopted"] and "" not in dict(available):
+    terms = set(partitions) | {code for code, _ in available} | {""}
+    baseline = {c: _untracked_course_docs(c, terms) for c in ("course_sessions", "courses_catalog")}
+    if any(baseline.values()):
+      log("COURSES", f"Adopting {len(baseline['course_sessions'])} sessions and "
+          f"{len(baseline['courses_catalog'])} courses written before manifests", severity="WARNING")
+      partitions = {"": {}, **partitions}
+  plan = plan_terms(available, partitions, force)
+  if not discovered:
+    plan["archive"] = []
+  refresh = plan["live"] + plan["frozen_due"]
+  # Clients keep session ids (teachingSessions, partnership courses), so sessions from
+  # before terms were partitioned keep their unprefixed ids in whichever term claims them
+  legacy = set()
+  if "" in partitions and "" not in refresh:
+    legacy = set(Manifest("course_sessions", "", baseline.get("course_sessions", ())).previous)
+    for term in partitions:
+      if term:
+        legacy.difference_update(Manifest("course_sessions", term).previous)
+  log("COURSES", f"Terms: live {plan['live']}, frozen to sync {plan['frozen_due']}, "
+      f"frozen and final {plan['frozen_done']}, archiving {plan['archive']}; {len(subjects) or 'no'} subjects",
+      subjects=len(subjects), **{k: v for k, v in plan.items() if k != "labels"})
+  
+  set_phase("fetch_courses")
+  fetch_stats = {}
+  bodies = fetch_course_shards(refresh, fetch_stats, cache, force, subjects)
+  failed_terms = {f["term"] for f in fetch_stats["failed_shards"]}
+  if faculty_written:
+    set_phase("wait_faculty")
+    faculty_written()
+  
+  set_phase("sync_sessions")
+  results, term_courses, term_schedules, session_diffs = {}, {}, {}, {}
+  resolver = None
+  # Instructors are resolved against the directory, so a directory change renormalizes every term
+  faculty = _faculty_fingerprint()
+  for term in refresh:
+    fetched = [body for _, body in bodies[term]]
+    if (fetched and term not in failed_terms and not force and not any(body.changed for body in fetched)
+        and (partitions.get(term) or {}).get("facultyHash") == faculty):
+      log("COURSES", f"Term {term or 'default'} unchanged since the last sync")
+      results[term] = {"unchanged": True, "sessions": 0, "complete": True}
+      continue
+    term_courses[term], term_schedules[term] = {}, {}
+    resolver = resolver or _faculty_resolver()
+    diff, count, complete = _sync_term_sessions(term, bodies[term], force, term not in failed_terms,
+                                                term_courses[term], resolver,
+                                                term_schedules[term], legacy)
+    session_diffs[term] = diff
+    # A claimed session that failed to write stays with the default term's partition
+    legacy.update(path.rsplit("/", 1)[-1] for path in diff["failed"])
+    results[term] = {"unchanged": False, "sessions": count, "complete": complete}
+  for term in plan["archive"]:
+    log("COURSES", f"Archiving term {term or 'default'}")
+    archived, untracked = {}, baseline if term == "" else {}
+    manifest = _session_manifest(term, untracked.get("course_sessions", ()))
+    if term == "":
+      # Sessions a term has claimed stay where they are
+      manifest.release([doc_id for doc_id in list(manifest.previous) if doc_id not in legacy])
+    session_diffs[term] = diff_sync(manifest, {}, Retirement(_archive_past_terms(set(), archived)))
+    session_diffs[term]["archived"] = archived.get("archived", 0)
+  sessions_count = sum(r["sessions"] for r in results.values())
+  
+  if refresh and not sessions_count and not any(r["unchanged"] for r in results.values()):
+    log("COURSES", "No course data retrieved")
+    return {"ok": False, "message": "No course data retrieved", "count": 0,
+            "failed_shards": fetch_stats.get("failed_shards", [])}
+  
+  if sessions_synced:
+    sessions_synced()
+  
+  set_phase("sync_courses")
+  catalog_diffs, schedule_diffs, course_ids = {}, {}, set()
+  for term, courses in term_courses.items():
+    if not results[term]["complete"]:
+      # A missing shard can hide some of a course's sections; keep the term's
+      # summaries already written rather than replacing them with partial ones.
+      continue
+    records = {}
+    for c in courses.values():
+      summary = _section_summary(c.pop("sections"))
+      records[_course_doc_id(c)] = {**c, "byTerm": {term_key(term): summary}}
+    course_ids.update(records)
+    log("COURSES", f"Diffing {len(records)} courses of term {term or 'default'} against catalog...")
+    catalog_diffs[term] = diff_sync(_catalog_manifest(term), records, Retirement(_drop_term(term)), force=force)
+    schedule_diffs[term] = diff_sync(Manifest(SCHEDULE_COLLECTION, term),
+                                     _occupancy_records(term, term_schedules[term]), force=force)
+  for term in plan["archive"]:
+    untracked = baseline if term == "" else {}
+    catalog_diffs[term] = diff_sync(_catalog_manifest(term, untracked.get("courses_catalog", ())), {},
+                                    Retirement(_drop_term(term)))
+    schedule_diffs[term] = diff_sync(Manifest(SCHEDULE_COLLECTION, term), {})
+  refreshed = _refresh_pending_catalog()
+  
+  # Record which terms now live in the hot collections and which frozen ones are final
+  new_partitions = {t: v for t, v in partitions.items()
+                    if t not in plan["archive"] or any(diffs[t]["failed"] for diffs in
+                                                       (session_diffs, catalog_diffs, schedule_diffs))}
+  ok_terms = set()
+  for term, r in results.items():
+    failed = any(diffs.get(term, {}).get("failed") for diffs in (session_diffs, catalog_diffs, schedule_diffs))
+    entry = dict(new_partitions.get(term) or {}, label=plan["labels"].get(term, term))
+    if r["unchanged"] or (r["complete"] and not failed):
+      ok_terms.add(term)
+      entry["facultyHash"] = faculty
+      if term in plan["frozen_due"] and not entry.get("frozenSyncedAt"):
+        entry["frozenSyncedAt"] = SERVER_TIMESTAMP
+    new_partitions[term] = entry
+  # Adopted once the default term's partition, baseline included, is archived
+  adopted = state["baselineAdopted"] or "" not in new_partitions
+  term_list = available if discovered else state["terms"]
+  if (new_partitions != partitions or subjects != state["subjects"] or term_list != state["terms"]
+      or adopted != state["baselineAdopted"]):
+    _save_term_state(new_partitions, subjects, term_list, adopted)
+  
+  # Only remember a term's responses once everything derived from them is written
+  if session_diffs or catalog_diffs:
+    keys = [ResponseCache.key("GET", COURSES_BASE_URL)]
+    keys += [course_shard_key(term, subject) for term, subject in course_shards(sorted(ok_terms), subjects)] if ok_terms else []
+    save_http_cache("courses", cache, keys)
+  
+  unchanged = not session_diffs and not catalog_diffs
+  log("COURSES", "Course API unchanged since last sync, skipping parse and writes" if unchanged else
+      f"Completed! {sessions_count} sessions and {len(course_ids)} courses in sync across {len(refresh)} terms.")
+  return {
+    "ok": True,
+    "unchanged": unchanged,
+    "sessions_count": sessions_count,
+    "courses_count": len(course_ids),
+    "batches": sum(d["batches"] for d in itertools.chain(session_diffs.values(), catalog_diffs.values(),
+                                                          schedule_diffs.values()))
+               + refreshed["batches"],
+    "diff": {
+      "course_sessions": {k: v for k, v in _merge_counts(session_diffs.values()).items() if k != "batches"},
+      "courses_catalog": {k: v for k, v in _merge_counts(catalog_diffs.values()).items() if k != "batches"},
+      SCHEDULE_COLLECTION: {k: v for k, v in _merge_counts(schedule_diffs.values()).items() if k != "batches"},
+    },
+    "terms": {term_key(term): {**r, "mode": "live" if term in plan["live"] else "frozen"}
+              for term, r in results.items()},
+    "archived_terms": plan["archive"],
+    "instructors": resolver.stats() if resolver else None,
+    "subjects": len(subjects),
+    "shards": fetch_stats.get("shards", 0),
+    "failed_shards": fetch_stats.get("failed_shards", []),
+    "http_hosts": host_states(),
+  }
+
+
+def _link_state_ref():
+  return DocRef(MANIFEST_COLLECTION, LINK_STATE_DOC)
+
+def record_link_changes(session_ids=(), emails=()):
+  """Queue session ids and teacher emails for the next incremental link.
+  
+  Once the queue holds more than LINK_INCREMENTAL_MAX changes, it is
+  replaced by a flag for a full rebuild, so it never outgrows its document.
+  """
+  session_ids, emails = list(session_ids), list(emails)
+  if not session_ids and not emails:
+    return
+  
+  def queue(state):
+    state = state or {}
+    if state.get("full"):
+      return None
+    queued_ids, queued_emails = state.get("sessionIds", []), state.get("emails", [])
+    queued_ids = queued_ids + sorted(set(session_ids) - set(queued_ids))
+    queued_emails = queued_emails + sorted(set(emails) - set(queued_emails))
+    if len(queued_ids) + len(queued_emails) > LINK_INCREMENTAL_MAX:
+      return {**state, "full": True, "sessionIds": [], "emails": [], "updatedAt": SERVER_TIMESTAMP}
+    return {**state, "sessionIds": queued_ids, "emails": queued_emails, "updatedAt": SERVER_TIMESTAMP}
+  
+  if (get_store().transact(_link_state_ref(), queue) or {}).get("full"):
+    log("LINK", f"Over {LINK_INCREMENTAL_MAX} changes queued, the next link is a full rebuild")
+
+def _chunked(items, size: int):
+  items = list(items)
+  for i in range(0, len(items), size):
+    yield items[i:i + size]
+
+def _teaching_session(session_id: str, session_data: dict) -> dict:
+  return {
+    'course_code': session_data.get('course_code', ''),
+    'course_title': session_data.get('course_title', ''),
+    'section_number': session_data.get('section_number', ''),
+    'crn': session_data.get('crn', ''),
+    'term': session_data.get('term', ''),
+    'meeting_times': session_data.get('meeting_times', []),
+    'meetings': session_data.get('meetings', []),
+    'credits': session_data.get('credits', ''),
+    'capacity': session_data.get('capacity', 0),
+    'enrolled': session_data.get('enrolled', 0),
+    'session_id': session_id
+  }
+
+def _affected_emails(session_ids) -> set:
+  """Instructor emails that own, or used to own, any of `session_ids`"""
+  store = get_store()
+  emails = set()
+  # Current owners, from the sessions as they are now
+  refs = [DocRef("course_sessions", i) for i in session_ids]
+  for _, data in store.get_many(refs, fields=["instructor_email"]):
+    email = (data.get("instructor_email") or "").lower()
+    if email:
+      emails.add(email)
+  # Previous owners, from the links they still carry
+  for chunk in _chunked(session_ids, ARRAY_QUERY_LIMIT):
+    where = [("teachingSessionIds", "array_contains_any", chunk)]
+    for _, data in store.scan("teachers_dir", fields=["email"], where=where, page_size=LINK_READ_PAGE):
+      email = (data.get("email") or "").lower()
+      if email:
+        emails.add(email)
+  return emails
+
+def _link_ops(teachers, sessions_by_email: dict, stats: dict):
+  """Updates for the teachers whose derived teaching sessions differ from what is stored"""
+  # Ascending doc id order lets an interrupted run resume from its checkpoint
+  for teacher_id, teacher_data in sorted(teachers, key=lambda t: t[0]):
+    email = teacher_data.get('email', '').lower()
+    if not email or teacher_data.get('deleted'):
+      continue
+    teaching = sorted(sessions_by_email.pop(email, []), key=lambda s: s['session_id'])
+    stats['matches_found'] += len(teaching)
+    # Compared by hash so the stored sessions never have to be read back
+    teaching_hash = _content_hash({'sessions': teaching})
+    if teaching_hash == teacher_data.get('teachingSessionsHash'):
+      stats['unchanged'] += 1
+      continue
+    stats['teachers_updated'] += 1
+    if teaching:
+      log_sampled("LINK", "teacher", f"{teacher_data.get('fullName', email)}: {len(teaching)} sessions",
+                  email=email, sessions=len(teaching))
+    yield WriteOp("update", DocRef("teachers_dir", teacher_id), {
+      'teachingSessions': teaching,
+      'teachingSessionIds': [s['session_id'] for s in teaching],
+      'teachingSessionsHash': teaching_hash,
+      'totalSessions': len(teaching),
+      'updatedAt': SERVER_TIMESTAMP,
+    })
+
+def _commit_link(ops, scope: str):
+  """Write link ops, resuming only a checkpoint left by a run over the same pending set `scope`"""
+  store = get_store()
+  checkpoint = Checkpoint(store, DocRef(MANIFEST_COLLECTION, LINK_CHECKPOINT_DOC), scope=scope)
+  with span("write"):
+    return store.write(ops, chunk_size=LINK_WRITE_CHUNK, checkpoint=checkpoint)
+
+def _index_sessions(sessions, sessions_by_email: dict, stats: dict):
+  for session_id, session_data in sessions:
+    if session_data.get('deleted'):
+      continue
+    stats['sessions_processed'] += 1
+    instructor_email = (session_data.get('instructor_email') or '').lower()
+    if instructor_email:
+      sessions_by_email.setdefault(instructor_email, []).append(_teaching_session(session_id, session_data))
+
+def _link_full(stats: dict, commit):
+  store = get_store()
+  if SYNC_ROLE == "coordinator":
+    teacher_ids = list(store.ids("teachers_dir"))
+    log("LINK", f"Found {len(teacher_ids)} teachers in directory")
+    return _link_on_workers(teacher_ids, stats)
+  sessions_by_email = {}
+  sessions = store.scan("course_sessions", fields=LINK_SESSION_FIELDS, page_size=LINK_READ_PAGE)
+  _index_sessions(sessions, sessions_by_email, stats)
+  
+  teachers = list(store.scan("teachers_dir", fields=LINK_TEACHER_FIELDS, page_size=LINK_READ_PAGE))
+  log("LINK", f"Found {len(teachers)} teachers in directory")
+  return commit(_link_ops(teachers, sessions_by_email, stats))
 
-def link_teachers_with_courses():
-  """Link teachers from faculty directory with their course sessions"""
-  print("[LINK] Starting teacher-course linking process...")
+def _link_teachers(teacher_ids, stats: dict, commit):
+  """Relink the teachers of `teacher_ids`, reading only their own sessions"""
+  store = get_store()
+  refs = [DocRef("teachers_dir", teacher_id) for teacher_id in sorted(teacher_ids)]
+  teachers = [(ref.id, data) for ref, data in store.get_many(refs, fields=LINK_TEACHER_FIELDS)]
+  emails = sorted({(data.get("email") or "").lower() for _, data in teachers} - {""})
+  sessions_by_email = {}
+  for chunk in _chunked(emails, ARRAY_QUERY_LIMIT):
+    sessions = store.scan("course_sessions", fields=LINK_SESSION_FIELDS,
+                          where=[("instructor_email", "in", chunk)], page_size=LINK_READ_PAGE)
+    _index_sessions(sessions, sessions_by_email, stats)
+  return commit(_link_ops(teachers, sessions_by_email, stats))
+
+@handler("link_teachers")
+def _link_teachers_unit(payload: dict) -> dict:
+  """Relink one range of teachers for a coordinator"""
+  stats = {'teachers_updated': 0, 'unchanged': 0, 'sessions_processed': 0, 'matches_found': 0}
+  # The unit is the unit of retry, so the run-wide checkpoint is not used
+  write_stats = _link_teachers(payload["teacherIds"], stats,
+                               commit=lambda ops: get_store().write(ops, chunk_size=LINK_WRITE_CHUNK))
+  return {"stats": stats, "batches": write_stats["batches"], "failed": write_stats["failed"]}
+
+def _link_on_workers(teacher_ids, stats: dict):
+  """Relink `teacher_ids` in ranges of LINK_UNIT_TEACHERS, spread over the workers"""
+  payloads = [{"teacherIds": chunk} for chunk in _chunked(sorted(teacher_ids), LINK_UNIT_TEACHERS)]
+  write_stats = {"failed": [], "batches": 0}
+  for payload, (result, error) in zip(payloads, run_units("link_teachers", payloads)):
+    if error:
+      write_stats["failed"].extend(f"teachers_dir/{teacher_id}" for teacher_id in payload["teacherIds"])
+      continue
+    for k, v in result["stats"].items():
+      stats[k] += v
+    write_stats["failed"].extend(result["failed"])
+    write_stats["batches"] += result["batches"]
+  return write_stats
+
+def _link_incremental(session_ids, emails, stats: dict, commit):
+  emails = set(emails) | _affected_emails(session_ids)
+  log("LINK", f"{len(session_ids)} changed sessions affect {len(emails)} teachers")
+  teacher_ids = {_sanitize_id(e) for e in emails}
+  if SYNC_ROLE == "coordinator":
+    return _link_on_workers(teacher_ids, stats)
+  return _link_teachers(teacher_ids, stats, commit)
+
+def _link(full: bool):
+  state = get_store().get(_link_state_ref()) or {}
+  session_ids = state.get("sessionIds", [])
+  emails = state.get("emails", [])
+  # Teachers linked before teachingSessionIds existed can't be found incrementally
+  full = full or state.get("full", False) or not state.get("fullLinkedAt")
+  
+  stats = {'teachers_updated': 0, 'unchanged': 0, 'sessions_processed': 0, 'matches_found': 0}
+  # A checkpoint only covers the op set it was taken over
+  scope = _content_hash({'full': full, 'sessionIds': sorted(session_ids), 'emails': sorted(emails)})
+  commit = lambda ops: _commit_link(ops, scope)
+  if full:
+    log("LINK", "Running full rebuild")
+    write_stats = _link_full(stats, commit)
+  elif session_ids or emails:
+    write_stats = _link_incremental(session_ids, emails, stats, commit)
+  else:
+    log("LINK", "No pending changes, nothing to link")
+    write_stats = {"failed": []}
+  
+  if write_stats["failed"]:
+    raise RuntimeError(f"{len(write_stats['failed'])} teacher updates failed; pending changes kept"
+                       + (f", next run resumes after {write_stats['resume_after']}"
+                          if write_stats.get('resume_after') else ""))
+  
+  # Only clear what this run consumed; syncs that finished meanwhile stay queued
+  done = {"updatedAt": SERVER_TIMESTAMP}
+  if session_ids:
+    done["sessionIds"] = ArrayRemove(session_ids)
+  if emails:
+    done["emails"] = ArrayRemove(emails)
+  if full:
+    done["full"] = False
+    done["fullLinkedAt"] = SERVER_TIMESTAMP
+  get_store().set(_link_state_ref(), done, merge=True)
+  
+  log("LINK", f"Processed {stats['sessions_processed']} sessions, matched {stats['matches_found']} to teachers; "
+      f"updated {stats['teachers_updated']} teacher records ({stats['unchanged']} unchanged)",
+      mode='full' if full else 'incremental', **stats)
+  return {**stats, 'mode': 'full' if full else 'incremental',
+          'batches': write_stats.get('batches', 0), 'resumed_past': write_stats.get('skipped', 0)}
+
+
+def link_teachers_with_courses(full: bool = False):
+  """Link teachers from faculty directory with their course sessions.
+  
+  By default only the teachers touched by session and directory changes
+  queued since the last link are recomputed; `full` rebuilds every teacher.
+  Either way only teachers whose teaching sessions changed are written.
+  """
+  log("LINK", "Starting teacher-course linking process...")
+  set_phase("link")
   
   try:
-    # Get all course sessions from Firestore
-    sessions_ref = db.collection("course_sessions")
-    sessions = sessions_ref.get()
-    
-    # Get all teachers from Firestore
-    teachers_ref = db.collection("teachers_dir")
-    teachers = teachers_ref.get()
-    
-    # Create email to teacher mapping
-    teacher_by_email = {}
-    for teacher_doc in teachers:
-      if teacher_doc.exists:
-        teacher_data = teacher_doc.to_dict()
-        email = teacher_data.get('email', '').lower()
-        if email:
-          teacher_by_email[email] = {
-            'doc_id': teacher_doc.id,
-            'data': teacher_data,
-            'teaching_sessions': []
-          }
-    
-    print(f"[LINK] Found {len(teacher_by_email)} teachers in directory")
-    
-    # Process course sessions and match with teachers
-    session_count = 0
-    matched_count = 0
-    
-    for session_doc in sessions:
-      if session_doc.exists:
-        session_data = session_doc.to_dict()
-        instructor_email = session_data.get('instructor_email', '').lower()
-      
-      if instructor_email and instructor_email in teacher_by_email:
-        # Add this session to the teacher's teaching list
-        session_info = {
-          'course_code': session_data.get('course_code', ''),
-          'course_title': session_data.get('course_title', ''),
-          'section_number': session_data.get('section_number', ''),
-          'crn': session_data.get('crn', ''),
-          'term': session_data.get('term', ''),
-          'meeting_times': session_data.get('meeting_times', []),
-          'credits': session_data.get('credits', ''),
-          'capacity': session_data.get('capacity', 0),
-          'enrolled': session_data.get('enrolled', 0),
-          'session_id': session_doc.id
-        }
-        
-        teacher_by_email[instructor_email]['teaching_sessions'].append(session_info)
-        matched_count += 1
-      
-      session_count += 1
-    
-    print(f"[LINK] Processed {session_count} sessions, matched {matched_count} to teachers")
-    
-    # Update teacher documents with their teaching sessions
-    batch = db.batch()
-    updated_teachers = 0
-    
-    for email, teacher_info in teacher_by_email.items():
-      if teacher_info['teaching_sessions']:
-        teacher_ref = teachers_ref.document(teacher_info['doc_id'])
-        
-        # Update teacher document with teaching sessions
-        batch.update(teacher_ref, {
-          'teachingSessions': teacher_info['teaching_sessions'],
-          'totalSessions': len(teacher_info['teaching_sessions']),
-          'updatedAt': firestore.SERVER_TIMESTAMP,
-        })
-        
-        updated_teachers += 1
-        
-        print(f"[LINK] {teacher_info['data'].get('fullName', email)}: {len(teacher_info['teaching_sessions'])} sessions")
-    
-    # Commit the batch update
-    batch.commit()
-    
-    print(f"[LINK] Updated {updated_teachers} teacher records with course sessions")
-    return {
-      'teachers_updated': updated_teachers,
-      'sessions_processed': session_count,
-      'matches_found': matched_count
-    }
-    
+    with span("link"):
+      return _link(full)
   except Exception as e:
-    print(f"[LINK] Error linking teachers with courses: {str(e)}")
+    log("LINK", f"Error linking teachers with courses: {str(e)}", severity="ERROR")
     raise
 
+def _seed_courses_step(force: bool, ctx, run: SyncRun):
+  result = run_seed_courses(force, sessions_synced=lambda: ctx.done("course_sessions"), run=run,
+                            faculty_written=lambda: ctx.wait("teachers"))
+  if not result.get('ok'):
+    raise RuntimeError(f"Failed to scrape courses: {result.get('message', '')}")
+  return result
+
+def run_seed_all(force: bool = False):
+  """Complete scraping and linking process.
+  
+  The faculty directory and the course API are fetched concurrently.
+  Course sessions are normalized once the teachers are written, since
+  instructors are matched against them; linking starts once the sessions
+  are written, while the course catalog summaries are still being synced.
+  
+  Progress is kept in a seed_all run: when the last run did not finish,
+  the steps it completed are skipped and the pages it fetched are reused.
+  """
+  log("SEED_ALL", "Starting complete teacher and course synchronization...")
+  with SyncRun.begin(get_store(), "seed_all") as sync_run:
+    return _seed_all(force, sync_run)
+
+def _seed_all(force: bool, sync_run: SyncRun):
+  report(run_id=sync_run.id, resumed=sync_run.resumed)
+  
+  def step(name, fn, milestones=()):
+    def resumable(ctx):
+      result = sync_run.step_result(name)
+      if result is not None:
+        log("SEED_ALL", f"Step {name} already done in run {sync_run.id}", step=name, run_id=sync_run.id)
+        for milestone in milestones:
+          ctx.done(milestone)
+        return result
+      result = fn(ctx)
+      sync_run.step_done(name, result)
+      return result
+    return resumable
+  
+  pipeline = (Pipeline()
+    .step("teachers", step("teachers", lambda ctx: run_seed(force, sync_run)))
+    .step("courses", step("courses", lambda ctx: _seed_courses_step(force, ctx, sync_run),
+                          milestones=["course_sessions"]), milestones=["course_sessions"])
+    .step("link", step("link", lambda ctx: link_teachers_with_courses()), needs=["teachers", "course_sessions"]))
+  run = pipeline.run()
+  timings = run["timings"]
+  log("SEED_ALL", f"Critical path {' -> '.join(timings['critical_path'])}: {timings['wall_s']}s wall, "
+      f"{timings['sum_of_steps_s']}s across steps", **timings)
+  report(critical_path_s=timings["wall_s"], sum_of_steps_s=timings["sum_of_steps_s"])
+  if run["errors"]:
+    raise RuntimeError("; ".join(f"{name}: {e}" for name, e in run["errors"].items()))
+  
+  sync_run.finish()
+  
+  teacher_result, courses_result, link_result = (run["results"][n] for n in ("teachers", "courses", "link"))
+  final_result = {
+    "ok": True,
+    "run_id": sync_run.id,
+    "resumed": sync_run.resumed,
+    "teacher_updates": teacher_result.get('updated', 0),
+    "course_sessions": courses_result.get('sessions_count', 0),
+    "unique_courses": courses_result.get('courses_count', 0),
+    "teachers_linked": link_result.get('teachers_updated', 0),
+    "sessions_matched": link_result.get('matches_found', 0),
+    "timings": timings,
+    "message": "Complete synchronization successful"
+  }
+  
+  log("SEED_ALL", f"Complete! {final_result}", result=final_result)
+  return final_result
+
+def run_link_teachers_courses(full: bool = False):
+  return {"ok": True, **link_teachers_with_courses(full=full)}
+
+
+def _enqueue(kind: str, fn, *args, **kwargs):
+  job, coalesced = job_manager.submit(kind, fn, *args, **kwargs)
+  return JSONResponse({
+    "ok": True,
+    "job_id": job.id,
+    "status": job.status,
+    "coalesced": coalesced,
+    "status_url": f"/jobs/{job.id}",
+  }, status_code=202)
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
+  startup.mark("first_healthz")
   return {"ok": True}
 
+@app.get("/metrics")
+async def metrics_endpoint():
+  return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/startup")
+async def startup_costs():
+  """Import and first-use init times since this container started"""
+  return startup.snapshot()
+
+@app.get("/seed")
+async def seed(force: bool = False):
+  return _enqueue("seed", run_seed, force=force)
+
+@app.get("/seed_courses")
+async def seed_courses(force: bool = False):
+  return _enqueue("seed_courses", run_seed_courses, force=force)
 
 @app.get("/seed_all")
-def seed_all():
-  """Complete scraping and linking process"""
-  try:
-    print("[SEED_ALL] Starting complete teacher and course synchronization...")
-    
-    # Step 1: Update teacher directory
-    print("[SEED_ALL] Step 1: Updating teacher directory...")
-    teacher_result = seed()
-    if not isinstance(teacher_result, dict) or not teacher_result.get('ok'):
-      return Response("Failed to update teacher directory", status_code=500)
-    
-    # Step 2: Scrape course sessions
-    print("[SEED_ALL] Step 2: Scraping course sessions...")
-    courses_result = seed_courses()
-    if not isinstance(courses_result, dict) or not courses_result.get('ok'):
-      return Response("Failed to scrape courses", status_code=500)
-    
-    # Step 3: Link teachers with courses
-    print("[SEED_ALL] Step 3: Linking teachers with course sessions...")
-    link_result = link_teachers_courses()
-    if not isinstance(link_result, dict) or not link_result.get('ok'):
-      return Response("Failed to link teachers with courses", status_code=500)
-    
-    final_result = {
-      "ok": True,
-      "teacher_updates": teacher_result.get('updated', 0),
-      "course_sessions": courses_result.get('sessions_count', 0),
-      "unique_courses": courses_result.get('courses_count', 0),
-      "teachers_linked": link_result.get('teachers_updated', 0),
-      "sessions_matched": link_result.get('matches_found', 0),
-      "message": "Complete synchronization successful"
-    }
-    
-    print(f"[SEED_ALL] Complete! {final_result}")
-    return final_result
-    
-  except Exception as e:
-    print(f"[SEED_ALL] Error: {str(e)}")
-    return Response(str(e), status_code=500)
+async def seed_all(force: bool = False):
+  return _enqueue("seed_all", run_seed_all, force=force)
 
 @app.get("/link_teachers_courses")
-def link_teachers_courses():
+async def link_teachers_courses(full: bool = False):
   """API endpoint to link teachers with their course sessions"""
-  try:
-    result = link_teachers_with_courses()
-    return {"ok": True, **result}
-  except Exception as e:
-    print(f"[LINK] Error: {str(e)}")
-    return Response(str(e), status_code=500)
+  return _enqueue("link_teachers_courses", run_link_teachers_courses, full=full)
+
+@app.get("/jobs")
+async def list_jobs():
+  return {"jobs": [job.to_dict() for job in reversed(job_manager.list())]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+  job = job_manager.get(job_id)
+  if job is None:
+    return Response(f"Unknown job {job_id}", status_code=404)
+  return job.to_dict()
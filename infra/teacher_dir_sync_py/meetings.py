@@ -0,0 +1,97 @@
+"""Structured meeting times and weekly occupancy bitmaps.
+
+FOSE lists a section's meetings as a JSON string of
+{"meet_day": "0".."6" (Monday first), "start_time": "930", "end_time": "1045"}
+entries. `parse_meetings` turns that into compact blocks, one per distinct
+time and place:
+
+  {"days": 0b0000101, "start": 570, "end": 645, "room": "DS 210"}
+
+`days` has bit 0 for Monday, `start` and `end` are minutes after midnight
+and `room` is the building and room ("" when FOSE gives none). A session
+meets at (day, minute) when `days >> day & 1` and `start <= minute < end`.
+
+A weekly occupancy bitmap sets one bit per OCCUPANCY_SLOT_MINUTES slot of
+the week that any meeting touches, bit `day * SLOTS_PER_DAY + slot`; two
+schedules conflict exactly when their bitmaps share a bit. Bitmaps are
+stored base64-encoded, little-endian.
+"""
+import os, json, base64
+
+DAY_LETTERS = "MTWRFSU"
+OCCUPANCY_SLOT_MINUTES = int(os.environ.get("OCCUPANCY_SLOT_MINUTES", "15"))
+SLOTS_PER_DAY = 24 * 60 // OCCUPANCY_SLOT_MINUTES
+WEEK_BYTES = (7 * SLOTS_PER_DAY + 7) // 8
+
+
+def _minutes(hhmm) -> int:
+  hours, minutes = divmod(int(hhmm), 100)
+  if minutes >= 60 or not 0 <= hours * 60 + minutes <= 24 * 60:
+    raise ValueError(f"not a time of day: {hhmm}")
+  return hours * 60 + minutes
+
+
+def room_key(meeting: dict) -> str:
+  building = str(meeting.get("bldg") or meeting.get("building") or "").strip()
+  room = str(meeting.get("room") or "").strip()
+  return " ".join(part for part in (building, room) if part).upper()
+
+
+def parse_meetings(meeting_times) -> list:
+  """Compact blocks for a FOSE meetingTimes value (JSON string or list); unparseable entries are skipped"""
+  if isinstance(meeting_times, str):
+    try:
+      meeting_times = json.loads(meeting_times or "[]")
+    except ValueError:
+      return []
+  blocks = {}
+  for m in meeting_times if isinstance(meeting_times, list) else []:
+    try:
+      day = int(m.get("meet_day", ""))
+      start, end = _minutes(m.get("start_time", "")), _minutes(m.get("end_time", ""))
+    except (ValueError, TypeError, AttributeError):
+      continue
+    if not 0 <= day < 7 or end <= start:
+      continue
+    key = (start, end, room_key(m))
+    blocks[key] = blocks.get(key, 0) | 1 << day
+  return [{"days": days, "start": start, "end": end, "room": room}
+          for (start, end, room), days in sorted(blocks.items())]
+
+
+def meeting_fields(meeting_times) -> dict:
+  """Session fields for a FOSE meetingTimes value: the blocks and their week-level bounds"""
+  blocks = parse_meetings(meeting_times)
+  days = 0
+  for block in blocks:
+    days |= block["days"]
+  return {
+    "meetings": blocks,
+    "meetDays": days,
+    "meetStart": min((b["start"] for b in blocks), default=None),
+    "meetEnd": max((b["end"] for b in blocks), default=None),
+  }
+
+
+def meets_at(blocks, day: int, minute: int) -> bool:
+  return any(b["days"] >> day & 1 and b["start"] <= minute < b["end"] for b in blocks)
+
+
+def occupancy(blocks) -> int:
+  """The weekly occupancy bitmap of `blocks`, as an int"""
+  bits = 0
+  for b in blocks:
+    first, last = b["start"] // OCCUPANCY_SLOT_MINUTES, (b["end"] - 1) // OCCUPANCY_SLOT_MINUTES
+    run = (1 << (last - first + 1)) - 1
+    for day in range(7):
+      if b["days"] >> day & 1:
+        bits |= run << (day * SLOTS_PER_DAY + first)
+  return bits
+
+
+def encode_occupancy(bits: int) -> str:
+  return base64.b64encode(bits.to_bytes(WEEK_BYTES, "little")).decode("ascii")
+
+
+def decode_occupancy(encoded: str) -> int:
+  return int.from_bytes(base64.b64decode(encoded), "little")
@@ -0,0 +1,216 @@
+"""Counters, histograms, stage timing spans and structured logs for the sync.
+
+Everything is process-local and thread-safe. `render()` produces the
+Prometheus text format served at /metrics. Stage spans record exclusive
+time: a `write` span driven by a streaming `parse` generator only counts
+its own work, and the generator's time goes to `parse`.
+"""
+import os, json, time, bisect, threading
+from contextlib import contextmanager
+
+# "json" (one object per line, as Cloud Logging expects) or "text" ("[TAG] message").
+# Defaults to json on Cloud Run, where K_SERVICE is set.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json" if os.environ.get("K_SERVICE") else "text")
+# Per-record log lines (one per teacher, session, ...) are emitted once every this many.
+LOG_SAMPLE_EVERY = max(int(os.environ.get("LOG_SAMPLE_EVERY", "100")), 1)
+# How often RssPeak samples the resident set size.
+RSS_SAMPLE_S = float(os.environ.get("RSS_SAMPLE_S", "0.25"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGE_BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+_lock = threading.Lock()
+_meta = {}        # name -> (type, help, buckets)
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+_samples = {}     # sample key -> lines seen
+_spans = threading.local()
+
+
+def describe(name: str, kind: str, help_text: str, buckets=None):
+  _meta[name] = (kind, help_text, tuple(buckets or ()))
+
+describe("sync_http_requests_total", "counter", "HTTP requests made by the scrapers, by status")
+describe("sync_http_retries_total", "counter", "HTTP requests retried, by reason (overload or error)")
+describe("sync_http_backoffs_total", "counter", "Times a host's concurrency limit was halved on a 429 or 5xx")
+describe("sync_http_circuit_opened_total", "counter", "Times a host's circuit breaker opened")
+describe("sync_http_bytes_total", "counter", "Response body bytes downloaded (or replayed)")
+describe("sync_store_reads_total", "counter", "Documents read from the store, by collection")
+describe("sync_store_writes_total", "counter", "Document writes and deletes committed, by collection")
+describe("sync_write_batches_total", "counter", "Write batches committed")
+describe("sync_write_retries_total", "counter", "Write batch attempts that failed and were retried")
+describe("sync_write_failed_total", "counter", "Document writes given up on")
+describe("sync_batch_commit_seconds", "histogram", "Latency of a single batch commit", LATENCY_BUCKETS)
+describe("sync_stage_seconds", "histogram", "Exclusive time spent per sync stage", STAGE_BUCKETS)
+describe("sync_queue_units_total", "counter", "Work units queued, claimed, done, failed or whose lease expired or was lost")
+describe("sync_log_lines_sampled_out_total", "counter", "Per-record log lines dropped by sampling")
+
+
+def _key(labels: dict) -> tuple:
+  return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def inc(name: str, value: float = 1, **labels):
+  key = (name, _key(labels))
+  with _lock:
+    _counters[key] = _counters.get(key, 0) + value
+
+def observe(name: str, value: float, **labels):
+  buckets = _meta[name][2]
+  key = (name, _key(labels))
+  with _lock:
+    h = _histograms.get(key)
+    if h is None:
+      h = _histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+    h[0][bisect.bisect_left(buckets, value)] += 1
+    h[1] += value
+    h[2] += 1
+
+
+def _stage_done(stage: str, seconds: float):
+  observe("sync_stage_seconds", seconds, stage=stage)
+  from jobs import add_timing
+  add_timing(stage, seconds)
+
+def _stack() -> list:
+  if not hasattr(_spans, "stack"):
+    _spans.stack = []
+  return _spans.stack
+
+@contextmanager
+def _frame():
+  """Time a block, excluding any spans nested inside it; yields [child seconds]"""
+  stack = _stack()
+  frame = [0.0]
+  stack.append(frame)
+  started = time.perf_counter()
+  try:
+    yield frame
+  finally:
+    elapsed = time.perf_counter() - started
+    stack.pop()
+    if stack:
+      stack[-1][0] += elapsed
+    frame.append(elapsed - frame[0])
+
+@contextmanager
+def span(stage: str):
+  """Time a stage (fetch, parse, normalize, write, link) of the running sync"""
+  with _frame() as frame:
+    yield
+  _stage_done(stage, frame[1])
+
+def rss_mb() -> float:
+  """Current resident set size of the process in MiB, 0 where /proc is unavailable"""
+  try:
+    with open("/proc/self/statm") as f:
+      return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+  except (OSError, ValueError, IndexError):
+    return 0.0
+
+
+class RssPeak:
+  """Peak RSS while a block runs, sampled in the background.
+
+  ru_maxrss is the peak over the whole life of the process, so a long-lived
+  service would report its largest run ever for every later one.
+  """
+
+  def __init__(self, interval: float = None):
+    self.interval = interval or RSS_SAMPLE_S
+    self.peak = 0.0
+    self._stop = threading.Event()
+
+  def _sample(self):
+    self.peak = max(self.peak, rss_mb())
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      self._sample()
+
+  def __enter__(self):
+    self._sample()
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+    return self
+
+  def __exit__(self, *exc):
+    self._stop.set()
+    self._thread.join()
+    self._sample()
+
+  @property
+  def peak_mb(self) -> float:
+    return round(self.peak, 1)
+
+
+def timed_iter(stage: str, iterable):
+  """Yield from `iterable`, charging the time spent producing each item to `stage`"""
+  total = 0.0
+  it = iter(iterable)
+  try:
+    while True:
+      done = False
+      with _frame() as frame:
+        try:
+          item = next(it)
+        except StopIteration:
+          done = True
+      total += frame[1]
+      if done:
+        return
+      yield item
+  finally:
+    _stage_done(stage, total)
+
+
+def log(tag: str, message: str, severity: str = "INFO", **fields):
+  """One log line: JSON with `fields` attached, or "[TAG] message" in text mode"""
+  if LOG_FORMAT == "json":
+    line = json.dumps({"severity": severity, "tag": tag, "message": message, **fields}, default=str)
+  else:
+    line = f"[{tag}] {message}"
+  print(line)
+
+def log_sampled(tag: str, sample_key: str, message: str, **fields):
+  """Like `log`, but only the first of every LOG_SAMPLE_EVERY lines for `sample_key`"""
+  with _lock:
+    seen = _samples.get(sample_key, 0)
+    _samples[sample_key] = seen + 1
+  if seen % LOG_SAMPLE_EVERY:
+    inc("sync_log_lines_sampled_out_total", tag=tag)
+    return
+  log(tag, message, sampled=LOG_SAMPLE_EVERY, **fields)
+
+
+def _labels(labels: tuple, extra: tuple = ()) -> str:
+  pairs = labels + extra
+  if not pairs:
+    return ""
+  escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+  return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def render() -> str:
+  """All metrics in the Prometheus text exposition format"""
+  with _lock:
+    counters = sorted(_counters.items())
+    histograms = sorted((k, (list(h[0]), h[1], h[2])) for k, h in _histograms.items())
+  lines = []
+  for name, (kind, help_text, buckets) in sorted(_meta.items()):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    if kind == "counter":
+      for (n, labels), value in counters:
+        if n == name:
+          lines.append(f"{name}{_labels(labels)} {value:g}")
+    else:
+      for (n, labels), (counts, total, count) in histograms:
+        if n != name:
+          continue
+        cumulative = 0
+        for bound, c in zip(list(buckets) + ["+Inf"], counts):
+          cumulative += c
+          le = bound if bound == "+Inf" else f"{bound:g}"
+          lines.append(f"{name}_bucket{_labels(labels, (('le', le),))} {cumulative}")
+        lines.append(f"{name}_sum{_labels(labels)} {total:g}")
+        lines.append(f"{name}_count{_labels(labels)} {count}")
+  return "\n".join(lines) + "\n"
@@ -0,0 +1,125 @@
+"""A small dependency-graph executor for multi-step syncs like seed_all.
+
+Each step runs on its own worker thread as soon as everything it `needs`
+is done. A need can be another step or a milestone that a running step
+marks part way through (`ctx.done("course_sessions")`), so a dependent can
+start before the step that feeds it has finished. A step can also wait
+part way through (`ctx.wait("teachers")`), for a need only one of its
+phases has. A step whose needs failed is skipped, not run.
+"""
+import time, threading
+from concurrent.futures import ThreadPoolExecutor
+from jobs import bind_job
+
+
+class StepSkipped(Exception):
+  pass
+
+
+class StepContext:
+  def __init__(self, pipeline, name: str):
+    self._pipeline = pipeline
+    self.name = name
+
+  def done(self, milestone: str, value=None):
+    """Mark a milestone this step declared, unblocking the steps that need it"""
+    self._pipeline._finish(milestone, value=value)
+
+  def wait(self, need: str):
+    """Block until step or milestone `need` is done; raises StepSkipped if it failed"""
+    self._pipeline._waited.setdefault(self.name, []).append(need)
+    self._pipeline._events[need].wait()
+    if need in self._pipeline._errors:
+      raise StepSkipped(f"{self.name} skipped: {need} failed")
+
+
+class Pipeline:
+  def __init__(self):
+    self._steps = {}
+    self._milestones = {}  # milestone -> step that marks it
+    self._events = {}
+    self._results = {}
+    self._errors = {}
+    self._times = {}
+    self._waited = {}  # step -> needs it waited for while running
+    self._lock = threading.Lock()
+
+  def step(self, name: str, fn, needs=(), milestones=()):
+    """Add `fn(ctx)` as a step; `milestones` are the names it may mark with ctx.done()"""
+    self._steps[name] = (fn, tuple(needs))
+    self._events[name] = threading.Event()
+    for milestone in milestones:
+      self._milestones[milestone] = name
+      self._events[milestone] = threading.Event()
+    return self
+
+  def _finish(self, name: str, value=None, error: Exception = None):
+    with self._lock:
+      if self._events[name].is_set():
+        return
+      self._times.setdefault(name, {})["finished"] = time.perf_counter()
+      if error is not None:
+        self._errors[name] = error
+      else:
+        self._results[name] = value
+    self._events[name].set()
+
+  def _run_step(self, name: str):
+    fn, needs = self._steps[name]
+    for need in needs:
+      self._events[need].wait()
+    failed = [need for need in needs if need in self._errors]
+    self._times[name] = {"started": time.perf_counter()}
+    try:
+      if failed:
+        raise StepSkipped(f"{name} skipped: {', '.join(failed)} failed")
+      self._finish(name, value=fn(StepContext(self, name)))
+    except Exception as e:
+      self._finish(name, error=e)
+    finally:
+      # A milestone the step never reached fails with it
+      for milestone, owner in self._milestones.items():
+        if owner == name and not self._events[milestone].is_set():
+          self._finish(milestone, error=self._errors.get(name) or
+                       StepSkipped(f"{name} finished without reaching {milestone}"))
+
+  def _critical_path(self):
+    """The chain that finished last, following each step back to the need that released it"""
+    path = []
+    name = max(self._steps, key=lambda n: self._times[n]["finished"])
+    while name is not None:
+      path.append(name)
+      needs = self._steps[name][1] + tuple(self._waited.get(name, ()))
+      if not needs:
+        break
+      name = max(needs, key=lambda n: self._times[n]["finished"])
+      if name in self._milestones:
+        path.append(name)
+        name = self._milestones[name]
+    return list(reversed(path))
+
+  def run(self) -> dict:
+    """Run every step; returns results, errors and timings"""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(self._steps), thread_name_prefix="step") as pool:
+      for name in self._steps:
+        pool.submit(bind_job(self._run_step), name)
+    wall = time.perf_counter() - started
+    steps = {
+      name: {
+        "started_at_s": round(t["started"] - started, 3),
+        "duration_s": round(t["finished"] - t["started"], 3),
+        "ok": name not in self._errors,
+      }
+      for name, t in self._times.items() if name in self._steps
+    }
+    return {
+      "results": {name: self._results[name] for name in self._steps if name in self._results},
+      "errors": {name: self._errors[name] for name in self._steps if name in self._errors},
+      "timings": {
+        "wall_s": round(wall, 3),
+        "sum_of_steps_s": round(sum(s["duration_s"] for s in steps.values()), 3),
+        "critical_path": self._critical_path(),
+        "steps": steps,
+      },
+    }
@@ -0,0 +1,194 @@
+"""Durable progress of sync runs, so a run cut short resumes where it stopped.
+
+Each kind of run (seed_courses, seed_all) has one document in sync_runs
+holding its run id, status and progress: the results of the pipeline
+steps that finished and the cache entries of the payloads fetched so far.
+The payloads themselves are stored zlib-compressed in chunk documents
+beside it, so a run resumed on a fresh instance reads them back instead of
+downloading them again.
+
+Workers fetching for a run elsewhere record their payloads the same way
+(`attach`), and the coordinator takes them in with `adopt`.
+
+A run is held by one owner at a time, under a lease it heartbeats like a
+work queue unit: `begin` only resumes a run whose lease has run out (or
+was released), and refuses while another owner still holds it.
+
+Committed writes need no record here: diff_sync checkpoints its manifest
+as batches commit, queueing the links and catalog refreshes they call for
+first, so a resumed run finds them unchanged with their follow-up work
+still pending, and the linker resumes from its own write checkpoint.
+"""
+import os, time, zlib, uuid, socket, hashlib, threading
+from storage import DocRef
+from metrics import log
+
+RUN_COLLECTION = "sync_runs"
+# A run left "running" for longer than this is abandoned, not resumed.
+SYNC_RUN_RESUME_HOURS = float(os.environ.get("SYNC_RUN_RESUME_HOURS", "6"))
+# The holder of a run renews its lease every third of this.
+SYNC_RUN_LEASE_S = float(os.environ.get("SYNC_RUN_LEASE_S", "60"))
+# Firestore caps a document at 1 MiB.
+PAYLOAD_CHUNK_BYTES = 900_000
+
+
+def _file_hash(path: str) -> str:
+  digest = hashlib.sha1()
+  with open(path, "rb") as f:
+    for block in iter(lambda: f.read(64 * 1024), b""):
+      digest.update(block)
+  return digest.hexdigest()[:20]
+
+
+class SyncRun:
+  def __init__(self, store, kind: str, state: dict, resumed: bool, owner: str = None, lease_s: float = None):
+    self.store = store
+    self.kind = kind
+    self.ref = DocRef(RUN_COLLECTION, kind)
+    self.id = state["runId"]
+    self.resumed = resumed
+    self.owner = owner
+    self.lease_s = lease_s or SYNC_RUN_LEASE_S
+    self.steps = dict(state.get("steps") or {})
+    self.payloads = dict(state.get("payloads") or {})
+    self._lock = threading.Lock()
+    self._released = threading.Event()
+
+  @classmethod
+  def begin(cls, store, kind: str, owner: str = None, lease_s: float = None) -> "SyncRun":
+    """Resume the unfinished run of `kind` if its lease has run out, or start a new one"""
+    owner = owner or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    lease_s = lease_s or SYNC_RUN_LEASE_S
+    outcome = {}
+
+    def claim(state):
+      now = time.time()
+      outcome.clear()
+      running = bool(state) and state.get("status") == "running"
+      if running and state.get("owner") != owner and state.get("leaseUntil", 0) > now:
+        outcome["held"] = state
+        return None
+      if running and now - state.get("startedAt", 0) < SYNC_RUN_RESUME_HOURS * 3600:
+        outcome["resumed"] = True
+        return {**state, "owner": owner, "leaseUntil": now + lease_s}
+      outcome["stale"] = state
+      return {"runId": uuid.uuid4().hex[:12], "kind": kind, "status": "running", "startedAt": now,
+              "owner": owner, "leaseUntil": now + lease_s, "steps": {}, "payloads": {}}
+
+    state = store.transact(DocRef(RUN_COLLECTION, kind), claim)
+    if "held" in outcome:
+      held = outcome["held"]
+      raise RuntimeError(f"{kind} run {held['runId']} is still running on {held.get('owner')}")
+    run = cls(store, kind, state, resumed="resumed" in outcome, owner=owner, lease_s=lease_s)
+    if run.resumed:
+      log("RUN", f"Resuming {kind} run {run.id}: {len(run.steps)} steps done, "
+          f"{len(run.payloads)} payloads fetched", run_id=run.id, kind=kind, owner=owner)
+    else:
+      if outcome.get("stale"):
+        cls(store, kind, outcome["stale"], resumed=False)._drop_payloads()
+      log("RUN", f"Starting {kind} run {run.id}", run_id=run.id, kind=kind, owner=owner)
+    threading.Thread(target=run._heartbeat, daemon=True).start()
+    return run
+
+  def _held(self, fn):
+    """Apply `fn` to the run document while this owner still holds it; None once it doesn't"""
+    def update(state):
+      if not state or state.get("runId") != self.id or state.get("owner") != self.owner:
+        return None
+      return fn(state)
+    return self.store.transact(self.ref, update)
+
+  def _heartbeat(self):
+    while not self._released.wait(self.lease_s / 3):
+      if self._held(lambda state: {**state, "leaseUntil": time.time() + self.lease_s}) is None:
+        log("RUN", f"{self.kind} run {self.id} lost its lease", severity="WARNING", run_id=self.id, kind=self.kind)
+        return
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    self.release()
+
+  def release(self):
+    """Stop renewing the lease and give it up, so an unfinished run can be resumed at once"""
+    if self._released.is_set():
+      return
+    self._released.set()
+    self._held(lambda state: {**state, "leaseUntil": 0} if state.get("status") == "running" else None)
+
+  @classmethod
+  def attach(cls, store, kind: str, run_id: str) -> "SyncRun":
+    """The run `run_id` as seen from another process, e.g. a worker recording payloads for it"""
+    return cls(store, kind, {"runId": run_id}, resumed=True)
+
+  def step_result(self, name: str):
+    """What step `name` returned, if it finished in this run"""
+    return self.steps.get(name)
+
+  def step_done(self, name: str, result):
+    with self._lock:
+      self.steps[name] = result
+    self.store.set(self.ref, {"steps": {name: result}}, merge=True)
+
+  def _chunk_refs(self, key: str, count: int):
+    return [DocRef(RUN_COLLECTION, f"{self.kind}__{key}__{i}") for i in range(count)]
+
+  def record(self, key: str, path: str, entry: dict) -> dict:
+    """Keep the body fetched for cache `key`, with its cache entry; returns what `adopt` takes"""
+    with open(path, "rb") as f:
+      blob = zlib.compress(f.read(), 6)
+    chunks = [blob[i:i + PAYLOAD_CHUNK_BYTES] for i in range(0, len(blob), PAYLOAD_CHUNK_BYTES)] or [b""]
+    b = self.store.batch()
+    for ref, chunk in zip(self._chunk_refs(key, len(chunks)), chunks):
+      b.set(ref, {"runId": self.id, "data": chunk})
+    b.commit()
+    saved = {**entry, "chunks": len(chunks)}
+    with self._lock:
+      self.payloads[key] = saved
+    self.store.set(self.ref, {"payloads": {key: saved}}, merge=True)
+    return saved
+
+  def adopt(self, key: str, saved: dict):
+    """Take in a payload another process recorded for this run"""
+    with self._lock:
+      self.payloads[key] = saved
+
+  def restore(self, key: str, path: str):
+    """The cache entry of a body this run already fetched, with the body put back at `path`"""
+    with self._lock:
+      saved = self.payloads.get(key)
+    if not saved:
+      return None
+    if not (os.path.exists(path) and _file_hash(path) == saved["hash"]):
+      refs = self._chunk_refs(key, saved["chunks"])
+      found = {ref.id: data.get("data", b"") for ref, data in self.store.get_many(refs)}
+      if len(found) != len(refs):
+        return None
+      chunks = [found[ref.id] for ref in refs]
+      tmp = f"{path}.{threading.get_ident()}.part"
+      with open(tmp, "wb") as f:
+        f.write(zlib.decompress(b"".join(chunks)))
+      os.replace(tmp, path)
+    return {k: v for k, v in saved.items() if k != "chunks"}
+
+  def _drop_payloads(self):
+    refs = [ref for key, saved in self.payloads.items() for ref in self._chunk_refs(key, saved.get("chunks", 0))]
+    for i in range(0, len(refs), 400):
+      b = self.store.batch()
+      for ref in refs[i:i + 400]:
+        b.delete(ref)
+      b.commit()
+    self.payloads = {}
+
+  def finish(self):
+    """Close the run, so it is never resumed; a run that fails stays open for the next one"""
+    self._released.set()
+    # Marked done before its payloads go, so a run that lost its lease never drops another's
+    if self._held(lambda state: {**state, "status": "done", "finishedAt": time.time(), "leaseUntil": 0}) is None:
+      log("RUN", f"{self.kind} run {self.id} was taken over, leaving it open", severity="WARNING",
+          run_id=self.id, kind=self.kind)
+      return
+    self._drop_payloads()
+    self._held(lambda state: {**state, "steps": {}, "payloads": {}})
+    log("RUN", f"{self.kind} run {self.id} done", run_id=self.id, kind=self.kind)
@@ -0,0 +1,46 @@
+"""Prefix keywords for the app's course and instructor search.
+
+Each searchable document carries a `searchKeywords` array, so a client query
+is a single `array-contains` lookup on the normalized search text. The app
+normalizes its query the same way as `normalize` below.
+"""
+import re
+
+# Phrases and tokens are indexed up to this many characters; longer queries
+# fall back to matching their individual tokens.
+MAX_PREFIX = 20
+# Keeps a document's keyword array, and so its index entries, bounded.
+MAX_KEYWORDS = 300
+
+
+def normalize(text: str) -> str:
+  """Lowercase, with runs of anything but letters and digits collapsed to one space"""
+  return re.sub(r'[^a-z0-9]+', ' ', (text or '').lower()).strip()
+
+
+def _prefixes(text: str):
+  return (text[:i] for i in range(1, min(len(text), MAX_PREFIX) + 1))
+
+
+def keywords(*fields) -> list:
+  """Prefixes of each field's whole normalized text and of each of its tokens"""
+  out = {}
+  for field in fields:
+    phrase = normalize(field)
+    if not phrase:
+      continue
+    for prefix in _prefixes(phrase):
+      out.setdefault(prefix.rstrip(), None)
+    for token in phrase.split():
+      for prefix in _prefixes(token):
+        out.setdefault(prefix, None)
+  # Short prefixes first, so the cap trims the most specific keywords
+  return sorted(out, key=lambda k: (len(k), k))[:MAX_KEYWORDS]
+
+
+def course_keywords(code: str, title: str, dept: str, instructors=()) -> list:
+  return keywords(code, code.replace(' ', ''), title, dept, *instructors)
+
+
+def teacher_keywords(full_name: str, department: str, email: str) -> list:
+  return keywords(full_name, department, email.split('@')[0])
@@ -0,0 +1,59 @@
+"""Cold-start instrumentation: import and first-use init costs, reported by /startup"""
+import os, time, threading
+from contextlib import contextmanager
+
+# Imported first by main, so this is as close to interpreter start as Python code gets.
+IMPORTED_AT = time.time()
+_T0 = time.perf_counter()
+
+_events = []
+_marks = {}
+_lock = threading.Lock()
+
+
+def _process_age() -> float:
+  """Seconds between process start and this module's import, from /proc when available"""
+  try:
+    with open("/proc/self/stat") as f:
+      start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+    with open("/proc/uptime") as f:
+      uptime = float(f.read().split()[0])
+    return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0.0)
+  except (OSError, ValueError, IndexError):
+    return None
+
+PROCESS_AGE_AT_IMPORT = _process_age()
+
+
+@contextmanager
+def timed(kind: str, name: str):
+  """Record how long the block took, e.g. timed("import", "fastapi") or timed("init", "store")"""
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    with _lock:
+      _events.append({"kind": kind, "name": name, "at_s": round(started - _T0, 4),
+                      "seconds": round(time.perf_counter() - started, 4)})
+
+
+def mark(name: str):
+  """Note the first time `name` happens (later calls are ignored)"""
+  with _lock:
+    _marks.setdefault(name, round(time.perf_counter() - _T0, 4))
+
+
+def snapshot() -> dict:
+  with _lock:
+    events = list(_events)
+    marks = dict(_marks)
+  totals = {}
+  for event in events:
+    totals[event["kind"]] = round(totals.get(event["kind"], 0.0) + event["seconds"], 4)
+  return {
+    "process_age_at_import_s": None if PROCESS_AGE_AT_IMPORT is None else round(PROCESS_AGE_AT_IMPORT, 4),
+    "uptime_s": round(time.perf_counter() - _T0, 4),
+    "marks_s": marks,
+    "totals_s": totals,
+    "events": events,
+  }
@@ -0,0 +1,413 @@
+"""Document storage for the sync: Firestore in production, in memory for offline runs.
+
+Both stores expose the same small surface: point reads, projected and
+filtered scans in doc id order, single-document set/delete and
+read-modify-write transactions, and batches that `bulk_write.commit_writes`
+drives for bulk upserts and deletes.
+Documents are addressed by `DocRef(collection, id)`; the sentinels below
+stand in for Firestore's server timestamp and array transforms.
+"""
+import os, copy, datetime, threading
+from abc import ABC, abstractmethod
+from collections import namedtuple, Counter
+from startup import timed
+import metrics
+
+# "firestore" (default) or "memory"
+SYNC_STORE = os.environ.get("SYNC_STORE", "firestore")
+# Firestore caps get_all / batch sizes; keep point reads to this many refs per call.
+GET_MANY_CHUNK = 300
+
+
+class DocRef(namedtuple("DocRef", ["collection", "id"])):
+  __slots__ = ()
+
+  @property
+  def path(self) -> str:
+    return f"{self.collection}/{self.id}"
+
+
+class _ServerTimestamp:
+  def __repr__(self):
+    return "SERVER_TIMESTAMP"
+
+SERVER_TIMESTAMP = _ServerTimestamp()
+
+
+class _DeleteField:
+  def __repr__(self):
+    return "DELETE_FIELD"
+
+# Removes a field (including a key of a map field) in a merge set.
+DELETE_FIELD = _DeleteField()
+
+
+class ArrayUnion:
+  def __init__(self, values):
+    self.values = list(values)
+
+
+class ArrayRemove:
+  def __init__(self, values):
+    self.values = list(values)
+
+
+class Store(ABC):
+  """Interface shared by the Firestore and in-memory stores"""
+
+  @abstractmethod
+  def get(self, ref: DocRef, fields=None):
+    """The document's data (only `fields`, if given), or None if it doesn't exist"""
+
+  @abstractmethod
+  def get_many(self, refs, fields=None):
+    """Yield (ref, data) for each of `refs` that exists"""
+
+  @abstractmethod
+  def scan(self, collection: str, fields=None, where=(), page_size: int = 500):
+    """Yield (doc_id, data) in doc id order, a page at a time.
+
+    `where` is a list of (field, op, value) filters with op one of "==",
+    "in" or "array_contains_any".
+    """
+
+  @abstractmethod
+  def ids(self, collection: str):
+    """Yield every doc id in `collection` without reading the documents"""
+
+  @abstractmethod
+  def set(self, ref: DocRef, data: dict, merge: bool = False):
+    ...
+
+  @abstractmethod
+  def delete(self, ref: DocRef):
+    ...
+
+  @abstractmethod
+  def batch(self):
+    """A batch with set/update/delete taking DocRefs, applied atomically by commit()"""
+
+  @abstractmethod
+  def transact(self, ref: DocRef, fn):
+    """Atomically replace the document with fn(its data, or None if missing).
+
+    `fn` returns the new data, or None to leave the document as it is; it
+    may be called more than once if another writer gets there first.
+    Returns what the last call of `fn` returned.
+    """
+
+  def write(self, ops, **kwargs) -> dict:
+    """Commit WriteOps in pooled batches; see bulk_write.commit_writes"""
+    from bulk_write import commit_writes
+    return commit_writes(self, ops, **kwargs)
+
+
+class FirestoreStore(Store):
+  _OPS = {"==": "==", "in": "in", "array_contains_any": "array_contains_any"}
+
+  def __init__(self, client=None):
+    with timed("import", "google.cloud.firestore"):
+      from google.cloud import firestore
+      from google.cloud.firestore_v1.base_query import FieldFilter
+    self._firestore = firestore
+    self._FieldFilter = FieldFilter
+    with timed("init", "firestore.Client"):
+      self.client = client or firestore.Client()  # uses Cloud Run service account
+
+  def _doc(self, ref: DocRef):
+    return self.client.collection(ref.collection).document(ref.id)
+
+  def _value(self, value):
+    if value is SERVER_TIMESTAMP:
+      return self._firestore.SERVER_TIMESTAMP
+    if value is DELETE_FIELD:
+      return self._firestore.DELETE_FIELD
+    if isinstance(value, ArrayUnion):
+      return self._firestore.ArrayUnion(value.values)
+    if isinstance(value, ArrayRemove):
+      return self._firestore.ArrayRemove(value.values)
+    if isinstance(value, dict):
+      return {k: self._value(v) for k, v in value.items()}
+    return value
+
+  def get(self, ref, fields=None):
+    snap = self._doc(ref).get(field_paths=fields)
+    metrics.inc("sync_store_reads_total", collection=ref.collection)
+    return (snap.to_dict() or {}) if snap.exists else None
+
+  def get_many(self, refs, fields=None):
+    refs = list(refs)
+    for i in range(0, len(refs), GET_MANY_CHUNK):
+      chunk = refs[i:i + GET_MANY_CHUNK]
+      by_path = {self._doc(r).path: r for r in chunk}
+      for snap in self.client.get_all([self._doc(r) for r in chunk], field_paths=fields):
+        metrics.inc("sync_store_reads_total", collection=by_path[snap.reference.path].collection)
+        if snap.exists:
+          yield by_path[snap.reference.path], snap.to_dict() or {}
+
+  def scan(self, collection, fields=None, where=(), page_size=500):
+    query = self.client.collection(collection)
+    for field, op, value in where:
+      query = query.where(filter=self._FieldFilter(field, self._OPS[op], value))
+    if fields is not None:
+      query = query.select(list(fields))
+    query = query.order_by("__name__").limit(page_size)
+    last = None
+    while True:
+      count = 0
+      for snap in (query.start_after(last) if last is not None else query).stream():
+        count += 1
+        last = snap
+        yield snap.id, snap.to_dict() or {}
+      metrics.inc("sync_store_reads_total", count, collection=collection)
+      if count < page_size:
+        return
+
+  def ids(self, collection):
+    for ref in self.client.collection(collection).list_documents():
+      yield ref.id
+
+  def set(self, ref, data, merge=False):
+    self._doc(ref).set(self._value(data), merge=merge)
+    metrics.inc("sync_store_writes_total", collection=ref.collection)
+
+  def delete(self, ref):
+    self._doc(ref).delete()
+    metrics.inc("sync_store_writes_total", collection=ref.collection)
+
+  def batch(self):
+    return _FirestoreBatch(self)
+
+  def transact(self, ref, fn):
+    doc = self._doc(ref)
+
+    @self._firestore.transactional
+    def apply(transaction):
+      snap = doc.get(transaction=transaction)
+      metrics.inc("sync_store_reads_total", collection=ref.collection)
+      data = fn((snap.to_dict() or {}) if snap.exists else None)
+      if data is not None:
+        transaction.set(doc, self._value(data))
+      return data
+
+    data = apply(self.client.transaction())
+    if data is not None:
+      metrics.inc("sync_store_writes_total", collection=ref.collection)
+    return data
+
+
+def _count_writes(refs):
+  for collection, count in Counter(ref.collection for ref in refs).items():
+    metrics.inc("sync_store_writes_total", count, collection=collection)
+
+
+class _FirestoreBatch:
+  def __init__(self, store: FirestoreStore):
+    self._store = store
+    self._batch = store.client.batch()
+    self._refs = []
+
+  def set(self, ref, data, merge=False):
+    self._batch.set(self._store._doc(ref), self._store._value(data), merge=merge)
+    self._refs.append(ref)
+
+  def update(self, ref, data):
+    self._batch.update(self._store._doc(ref), self._store._value(data))
+    self._refs.append(ref)
+
+  def delete(self, ref):
+    self._batch.delete(self._store._doc(ref))
+    self._refs.append(ref)
+
+  def commit(self):
+    self._batch.commit()
+    _count_writes(self._refs)
+
+
+class MemoryStore(Store):
+  """Dict-backed store with Firestore's write semantics and value limits, for tests, replay and load tests"""
+
+  def __init__(self):
+    self.collections = {}
+    self._lock = threading.RLock()
+    self.reads = 0
+    self.writes = 0
+
+  def _resolve(self, value, old=None):
+    if value is SERVER_TIMESTAMP:
+      return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, ArrayUnion):
+      base = list(old) if isinstance(old, list) else []
+      return base + [v for v in value.values if v not in base]
+    if isinstance(value, ArrayRemove):
+      return [v for v in (old if isinstance(old, list) else []) if v not in value.values]
+    if isinstance(value, dict):
+      return {k: self._resolve(v) for k, v in value.items() if v is not DELETE_FIELD}
+    return copy.deepcopy(value)
+
+  def _merge(self, doc: dict, data: dict):
+    for k, v in data.items():
+      if v is DELETE_FIELD:
+        doc.pop(k, None)
+      elif isinstance(v, dict) and isinstance(doc.get(k), dict):
+        self._merge(doc[k], v)
+      else:
+        doc[k] = self._resolve(v, doc.get(k))
+
+  @classmethod
+  def _validate(cls, ref: DocRef, value, path: str = "", in_array: bool = False):
+    """Reject what Firestore would: empty field names, and arrays directly inside arrays"""
+    if isinstance(value, (ArrayUnion, ArrayRemove)):
+      value = value.values
+    if isinstance(value, dict):
+      for k, v in value.items():
+        if not k:
+          raise ValueError(f"Empty field name in {ref.path}" + (f" under {path}" if path else ""))
+        cls._validate(ref, v, f"{path}.{k}" if path else k)
+    elif isinstance(value, (list, tuple)):
+      if in_array:
+        raise ValueError(f"Nested array in {ref.path} at {path}: Firestore arrays can't hold arrays")
+      for v in value:
+        cls._validate(ref, v, path, True)
+
+  @staticmethod
+  def _project(data: dict, fields):
+    if fields is None:
+      return copy.deepcopy(data)
+    return {f: copy.deepcopy(data[f]) for f in fields if f in data}
+
+  @staticmethod
+  def _matches(data: dict, where) -> bool:
+    for field, op, value in where:
+      have = data.get(field)
+      if op == "==" and have != value:
+        return False
+      if op == "in" and have not in value:
+        return False
+      if op == "array_contains_any" and not (isinstance(have, list) and any(v in have for v in value)):
+        return False
+    return True
+
+  def get(self, ref, fields=None):
+    with self._lock:
+      self.reads += 1
+      metrics.inc("sync_store_reads_total", collection=ref.collection)
+      data = self.collections.get(ref.collection, {}).get(ref.id)
+      return None if data is None else self._project(data, fields)
+
+  def get_many(self, refs, fields=None):
+    for ref in refs:
+      data = self.get(ref, fields)
+      if data is not None:
+        yield ref, data
+
+  def scan(self, collection, fields=None, where=(), page_size=500):
+    with self._lock:
+      doc_ids = sorted(self.collections.get(collection, {}))
+    for i in range(0, len(doc_ids), page_size):
+      with self._lock:
+        docs = self.collections.get(collection, {})
+        page = [(doc_id, docs[doc_id]) for doc_id in doc_ids[i:i + page_size] if doc_id in docs]
+        page = [(doc_id, self._project(data, fields)) for doc_id, data in page if self._matches(data, where)]
+        self.reads += len(page)
+      metrics.inc("sync_store_reads_total", len(page), collection=collection)
+      yield from page
+
+  def ids(self, collection):
+    with self._lock:
+      return iter(sorted(self.collections.get(collection, {})))
+
+  def _apply(self, kind, ref, data=None, merge=False):
+    docs = self.collections.setdefault(ref.collection, {})
+    self.writes += 1
+    if kind == "delete":
+      docs.pop(ref.id, None)
+    elif kind == "update":
+      if ref.id not in docs:
+        raise KeyError(f"No document to update: {ref.path}")
+      for k, v in data.items():
+        if v is DELETE_FIELD:
+          docs[ref.id].pop(k, None)
+        else:
+          docs[ref.id][k] = self._resolve(v, docs[ref.id].get(k))
+    elif merge and ref.id in docs:
+      self._merge(docs[ref.id], data)
+    else:
+      docs[ref.id] = self._resolve(data)
+
+  def set(self, ref, data, merge=False):
+    self._validate(ref, data)
+    with self._lock:
+      self._apply("set", ref, data, merge)
+    metrics.inc("sync_store_writes_total", collection=ref.collection)
+
+  def delete(self, ref):
+    with self._lock:
+      self._apply("delete", ref)
+    metrics.inc("sync_store_writes_total", collection=ref.collection)
+
+  def batch(self):
+    return _MemoryBatch(self)
+
+  def transact(self, ref, fn):
+    with self._lock:
+      current = self.get(ref)
+      data = fn(current)
+      if data is not None:
+        self._validate(ref, data)
+        self._apply("set", ref, data)
+    if data is not None:
+      metrics.inc("sync_store_writes_total", collection=ref.collection)
+    return data
+
+
+class _MemoryBatch:
+  def __init__(self, store: MemoryStore):
+    self._store = store
+    self._ops = []
+
+  def set(self, ref, data, merge=False):
+    self._ops.append(("set", ref, data, merge))
+
+  def update(self, ref, data):
+    self._ops.append(("update", ref, data, False))
+
+  def delete(self, ref):
+    self._ops.append(("delete", ref, None, False))
+
+  def commit(self):
+    with self._store._lock:
+      # All or nothing, like a Firestore batch: check every op's data, and
+      # every update's target, before applying anything
+      docs = self._store.collections
+      created = set()
+      for kind, ref, data, _ in self._ops:
+        if kind != "delete":
+          self._store._validate(ref, data)
+        if kind == "set":
+          created.add(ref)
+        elif kind == "delete":
+          created.discard(ref)
+        elif ref not in created and ref.id not in docs.get(ref.collection, {}):
+          raise KeyError(f"No document to update: {ref.path}")
+      for kind, ref, data, merge in self._ops:
+        self._store._apply(kind, ref, data, merge)
+    _count_writes(ref for _, ref, _, _ in self._ops)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_store() -> Store:
+  """Process-wide store, created on first use from SYNC_STORE"""
+  global _store
+  with _store_lock:
+    if _store is None:
+      _store = MemoryStore() if SYNC_STORE == "memory" else FirestoreStore()
+    return _store
+
+def set_store(store: Store):
+  """Swap the process-wide store, e.g. for a MemoryStore in benchmarks"""
+  global _store
+  with _store_lock:
+    _store = store
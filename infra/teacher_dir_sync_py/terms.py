@@ -0,0 +1,72 @@
+"""Course term discovery and the live / frozen / archived split.
+
+Terms are FOSE `srcdb` codes such as "202510", newest first. The newest
+COURSE_LIVE_TERMS are live (the active and upcoming terms, refreshed on
+every sync); the rest of the newest COURSE_HOT_TERMS are frozen and synced
+once more after they stop being live; anything older is archived out of
+the hot collections. The same page's subject picker lists the subject
+codes each term's search is sharded by.
+"""
+import os, re
+
+COURSE_LIVE_TERMS = int(os.environ.get("COURSE_LIVE_TERMS", "2"))
+COURSE_HOT_TERMS = int(os.environ.get("COURSE_HOT_TERMS", "6"))
+
+# Firestore rejects empty field names, so maps keyed by term store the default
+# term ("", the search page's own selection) under this key instead
+DEFAULT_TERM_KEY = "default"
+
+_SELECT = r'<select[^>]*\bid="{}"[^>]*>(.*?)</select>'
+_OPTION = re.compile(r'<option[^>]*\bvalue="([^"]*)"[^>]*>(.*?)</option>', re.S | re.I)
+_TAG = re.compile(r'<[^>]+>')
+
+
+def _options(html: str, select_id: str) -> dict:
+  select = re.search(_SELECT.format(select_id), html, re.S | re.I)
+  options = {}
+  for code, label in _OPTION.findall(select.group(1) if select else ""):
+    code = code.strip()
+    if code:
+      options[code] = " ".join(_TAG.sub("", label).split())
+  return options
+
+
+def parse_terms(html: str):
+  """(code, label) pairs from the term picker of the course search page, newest first"""
+  return sorted(_options(html, "crit-srcdb").items(), key=lambda t: t[0], reverse=True)
+
+
+def parse_subjects(html: str):
+  """Subject codes from the subject picker of the course search page"""
+  return sorted(_options(html, "crit-subject"))
+
+
+def term_key(term: str) -> str:
+  """The map key a term's entries are stored under"""
+  return term or DEFAULT_TERM_KEY
+
+
+def term_code(key: str) -> str:
+  """The term a stored map key belongs to; the inverse of term_key"""
+  return "" if key == DEFAULT_TERM_KEY else key
+
+
+def plan_terms(available, partitions: dict, force: bool = False) -> dict:
+  """Which terms to refresh, which frozen ones are already final, and which to archive.
+
+  `available` is newest-first (code, label) pairs; `partitions` is the
+  stored term state, {code: {"frozenSyncedAt": ...}} for every term with
+  documents in the hot collections.
+  """
+  codes = [code for code, _ in available]
+  hot = codes[:COURSE_HOT_TERMS]
+  live = hot[:COURSE_LIVE_TERMS]
+  frozen = hot[COURSE_LIVE_TERMS:]
+  done = [t for t in frozen if not force and (partitions.get(t) or {}).get("frozenSyncedAt")]
+  return {
+    "live": live,
+    "frozen_due": [t for t in frozen if t not in done],
+    "frozen_done": done,
+    "archive": sorted(t for t in partitions if t not in hot),
+    "labels": dict(available),
+  }
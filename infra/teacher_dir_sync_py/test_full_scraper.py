@@ -25,7 +25,7 @@ def test_complete_scraper():
     # Test course scraping (with a limit to avoid too much output)
     print("\n=== Testing Course Scraping ===")
     try:
-        courses = scrape_courses_from_api()
+        courses = list(scrape_courses_from_api())
         print(f"✓ Successfully scraped {len(courses)} course sessions")
         
         if courses:
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Replay the sync against generated fixtures and an in-memory store, asserting as it goes
+
+Usage: test_sync_replay.py
+
+Fixtures for two terms and two subjects, and for a search page offering
+none (the default term), are generated into a temporary directory (see
+gen_fixtures.py), so nothing touches the network or a real project. Each test starts from an empty MemoryStore and a cold response
+cache, as a fresh instance would. The functions are plain asserts, so
+pytest can collect them too.
+"""
+
+import atexit
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Add the parent directory to the path so we can import the main module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+WORK = tempfile.mkdtemp(prefix="sync_replay_")
+atexit.register(shutil.rmtree, WORK, True)
+FIXTURES = os.path.join(WORK, "fixtures")
+DEFAULT_TERM_FIXTURES = os.path.join(WORK, "default_term_fixtures")
+for out, args in [(FIXTURES, ["--terms", "202510,202490", "--subjects", "ACCT,FIN"]), (DEFAULT_TERM_FIXTURES, [])]:
+    subprocess.run([sys.executable, os.path.join(HERE, "gen_fixtures.py"), *args, "--faculty", "20",
+                    "--sections", "40", "--out", out], check=True, stdout=subprocess.DEVNULL)
+os.environ.update({"SYNC_STORE": "memory", "SYNC_HTTP_MODE": "replay", "SYNC_FIXTURES_DIR": FIXTURES,
+                   "HTTP_CACHE_DIR": os.path.join(WORK, "http_cache")})
+os.environ.setdefault("SLU_FACULTY_LIST_URL", "https://www.slu.edu/business/about/faculty/directory.php")
+
+import http_client
+import main
+from bulk_write import Checkpoint, WriteOp, commit_writes
+from http_client import ResponseCache
+from jobs import JobManager
+from main import Manifest, Retirement, diff_sync, load_manifest
+from runs import SyncRun
+from storage import ArrayUnion, DocRef, MemoryStore, get_store, set_store
+from terms import DEFAULT_TERM_KEY, plan_terms
+
+
+def fresh_instance():
+    """An empty store and no local response cache"""
+    set_store(MemoryStore())
+    shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+    return get_store()
+
+
+def term_state():
+    return get_store().get(DocRef(main.MANIFEST_COLLECTION, main.TERM_STATE_DOC))
+
+
+def test_memory_store_rejects_what_firestore_would():
+    store = fresh_instance()
+    for data in [{"": 1}, {"byTerm": {"": {}}}, {"terms": [["202510", "Spring"]]},
+                 {"terms": ArrayUnion([("202510", "Spring")])}]:
+        try:
+            store.set(DocRef("docs", "bad"), data)
+            raise AssertionError(f"{data} was accepted")
+        except ValueError:
+            pass
+    batch = store.batch()
+    batch.set(DocRef("docs", "good"), {"terms": [{"code": "202510"}]})
+    batch.set(DocRef("docs", "bad"), {"a": {"": 1}})
+    try:
+        batch.commit()
+        raise AssertionError("a batch with an invalid write was committed")
+    except ValueError:
+        pass
+    assert store.get(DocRef("docs", "good")) is None
+
+
+def test_diff_sync_retires_untracked_documents():
+    store = fresh_instance()
+    store.set(DocRef("docs", "legacy"), {"x": 0})
+    kept = diff_sync(Manifest("docs", untracked=["legacy"]), {"a": {"x": 1}}, Retirement(allowed=lambda: False))
+    assert kept["added"] == 1 and kept["removed"] == 0
+    assert set(load_manifest("docs")) == {"a", "legacy"}
+    gone = diff_sync(Manifest("docs"), {"a": {"x": 1}})
+    assert gone["unchanged"] == 1 and gone["removed"] == 1
+    assert store.get(DocRef("docs", "legacy")) is None and set(load_manifest("docs")) == {"a"}
+
+
+def test_diff_sync_journals_writes_before_each_checkpoint():
+    fresh_instance()
+    journaled, saved = [], []
+    real_save, main.save_manifest = main.save_manifest, lambda name, hashes, previous: (
+        saved.append((set(hashes), set(journaled))), real_save(name, hashes, previous))
+    checkpoint_every, main.DIFF_CHECKPOINT_WRITES = main.DIFF_CHECKPOINT_WRITES, 2
+    try:
+        records = {f"d{i}": {"i": i} for i in range(7)}
+        diff_sync(Manifest("docs", journal=journaled.extend), records, chunk_size=2)
+    finally:
+        main.save_manifest, main.DIFF_CHECKPOINT_WRITES = real_save, checkpoint_every
+    assert len(saved) > 1 and set(journaled) == set(records)
+    for tracked, queued in saved:
+        assert tracked <= queued, "the manifest got ahead of the journal"
+
+
+def test_commit_writes_resumes_only_its_own_checkpoint():
+    store = fresh_instance()
+    ref = DocRef("sync_manifest", "checkpoint__test")
+    ops = [WriteOp("set", DocRef("docs", f"d{i}"), {"i": i}) for i in range(4)]
+    Checkpoint(store, ref, scope="earlier").save("docs/d1")
+    assert commit_writes(store, ops, chunk_size=1, checkpoint=Checkpoint(store, ref, scope="later"))["skipped"] == 0
+    Checkpoint(store, ref, scope="same").save("docs/d1")
+    stats = commit_writes(store, ops, chunk_size=1, checkpoint=Checkpoint(store, ref, scope="same"))
+    assert stats["skipped"] == 2 and stats["written"] == 2 and store.get(ref) is None
+
+
+def test_plan_terms_archives_only_terms_that_left_the_window():
+    available = [("202610", "Fall 2026"), ("202590", "Summer 2026"), ("202510", "Spring 2026")]
+    partitions = {"202510": {}, "202490": {"frozenSyncedAt": 1}, "": {}}
+    plan = plan_terms(available, partitions)
+    assert plan["archive"] == ["", "202490"]
+    assert set(plan["live"] + plan["frozen_due"] + plan["frozen_done"]) <= {code for code, _ in available}
+
+
+def test_seed_courses_archives_nothing_when_terms_are_not_found():
+    store = fresh_instance()
+    first = main.run_seed_courses()
+    assert first["ok"] and sorted(first["terms"]) == ["202490", "202510"]
+    sessions = sorted(store.ids("course_sessions"))
+    page = http_client.fixture_path(ResponseCache.key("GET", main.COURSES_BASE_URL))
+    shutil.copy(page, page + ".orig")
+    try:
+        with open(page, "w") as f:
+            f.write("<html></html>")
+        shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+        blind = main.run_seed_courses()
+    finally:
+        os.replace(page + ".orig", page)
+    assert blind["ok"] and blind["archived_terms"] == []
+    assert sorted(store.ids("course_sessions")) == sessions
+    assert set(term_state()["partitions"]) == {"202490", "202510"}
+
+
+def test_seed_courses_adopts_documents_from_before_manifests():
+    store = fresh_instance()
+    store.set(DocRef("course_sessions", "ACCT_1000_01_1"), {"source": "courses_api", "term": ""})
+    store.set(DocRef("courses_catalog", "ACCT_1000__Gone"), {"source": "courses_api", "code": "ACCT 1000"})
+    result = main.run_seed_courses()
+    assert result["ok"] and result["archived_terms"] == [""]
+    assert store.get(DocRef("course_sessions", "ACCT_1000_01_1")) is None
+    assert store.get(DocRef(main.SESSION_ARCHIVE_COLLECTION, "ACCT_1000_01_1")) is not None
+    assert store.get(DocRef("courses_catalog", "ACCT_1000__Gone")) is None
+    assert term_state()["baselineAdopted"]
+
+
+def test_seed_courses_syncs_the_default_term_when_the_page_offers_none():
+    store = fresh_instance()
+    http_client.FIXTURES_DIR = DEFAULT_TERM_FIXTURES
+    try:
+        first = main.run_seed_courses()
+        shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+        second = main.run_seed_courses()
+    finally:
+        http_client.FIXTURES_DIR = FIXTURES
+    assert first["ok"] and list(first["terms"]) == [DEFAULT_TERM_KEY] and first["sessions_count"]
+    assert second["ok"] and second["terms"][DEFAULT_TERM_KEY]["unchanged"]
+    assert not any("__" in doc_id for doc_id in store.ids("course_sessions"))
+    assert all(set(data["byTerm"]) == {DEFAULT_TERM_KEY} for _, data in store.scan("courses_catalog"))
+    assert set(term_state()["partitions"]) == {DEFAULT_TERM_KEY}
+    assert main._term_state()["partitions"].keys() == {""}
+
+
+def test_seed_courses_upgrades_from_the_unpartitioned_manifest():
+    fresh_instance()
+    main.run_seed_courses()
+    # The same sections as a deployment from before terms were partitioned wrote them
+    unprefixed = sorted(doc_id.split("__", 1)[1] for doc_id in get_store().ids("course_sessions"))[:5]
+    store = fresh_instance()
+    diff_sync(Manifest("course_sessions"), {doc_id: {"source": "courses_api"} for doc_id in unprefixed + ["GONE_1_1"]})
+    result = main.run_seed_courses()
+    assert result["ok"] and result["archived_terms"] == [""]
+    ids = set(store.ids("course_sessions"))
+    assert set(unprefixed) <= ids, "sessions clients may reference were given new ids"
+    assert not any(doc_id.split("__", 1)[-1] in unprefixed for doc_id in ids if "__" in doc_id)
+    assert "GONE_1_1" not in ids and store.get(DocRef(main.SESSION_ARCHIVE_COLLECTION, "GONE_1_1")) is not None
+    assert load_manifest("course_sessions") == {}
+    assert set(term_state()["partitions"]) == {"202490", "202510"} and term_state()["baselineAdopted"]
+    shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+    again = main.run_seed_courses(force=True)
+    assert again["diff"]["course_sessions"]["added"] == 0 and set(unprefixed) <= set(store.ids("course_sessions"))
+
+
+def test_seed_courses_renormalizes_after_a_directory_change():
+    fresh_instance()
+    main.run_seed()
+    main.run_seed_courses()
+    shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+    assert all(t["unchanged"] for t in main.run_seed_courses()["terms"].values())
+    teachers = load_manifest("teachers_dir")
+    diff_sync(Manifest("teachers_dir"), {doc_id: {"email": "x@slu.edu"} for doc_id in list(teachers)[:1]},
+              Retirement(allowed=lambda: False))
+    shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+    assert not any(t["unchanged"] for t in main.run_seed_courses()["terms"].values())
+
+
+def test_interrupted_seed_courses_still_queues_links_and_catalog():
+    store = fresh_instance()
+
+    def killed(course_ids):
+        raise RuntimeError("instance killed before the catalog refresh")
+
+    real, main._refresh_catalog = main._refresh_catalog, killed
+    try:
+        main.run_seed_courses()
+        raise AssertionError("the refresh should have failed")
+    except RuntimeError:
+        pass
+    finally:
+        main._refresh_catalog = real
+    queued = store.get(main._link_state_ref())["sessionIds"]
+    assert sorted(queued) == sorted(store.ids("course_sessions"))
+    shutil.rmtree(http_client.HTTP_CACHE_DIR, ignore_errors=True)
+    resumed = main.run_seed_courses()
+    assert resumed["ok"] and resumed["resumed"]
+    assert not store.get(main._catalog_state_ref())["courseIds"]
+    assert all(data.get("searchKeywords") for _, data in store.scan("courses_catalog"))
+
+
+def test_seed_all_matches_instructors_only_once_teachers_are_written():
+    store = fresh_instance()
+    seen = []
+    real_seed, real_resolver = main.run_seed, main._faculty_resolver
+
+    def slow_seed(*args, **kwargs):
+        time.sleep(0.5)
+        return real_seed(*args, **kwargs)
+
+    def resolver():
+        seen.append(len(list(store.ids("teachers_dir"))))
+        return real_resolver()
+
+    main.run_seed, main._faculty_resolver = slow_seed, resolver
+    try:
+        assert main.run_seed_all()["ok"]
+    finally:
+        main.run_seed, main._faculty_resolver = real_seed, real_resolver
+    assert seen and seen[0] == len(list(store.ids("teachers_dir"))) > 0
+
+
+def test_forced_job_is_queued_behind_the_running_one():
+    manager = JobManager(workers=2, exclusive={"sync": ["state"]})
+    release, ran = threading.Event(), []
+
+    def sync(force=False):
+        ran.append(force)
+        release.wait(5)
+
+    running, _ = manager.submit("sync", sync, force=False)
+    forced, coalesced = manager.submit("sync", sync, force=True)
+    assert not coalesced and forced is not running
+    assert manager.submit("sync", sync, force=True) == (forced, True)
+    time.sleep(0.1)
+    assert ran == [False] and forced.status == "queued"
+    release.set()
+    for _ in range(50):
+        if forced.finished_at:
+            break
+        time.sleep(0.1)
+    assert ran == [False, True] and forced.status == "succeeded"
+
+
+def test_sync_run_is_resumed_only_once_its_lease_is_free():
+    store = fresh_instance()
+    held = SyncRun.begin(store, "replay", owner="a")
+    try:
+        SyncRun.begin(store, "replay", owner="b")
+        raise AssertionError("a held run was handed to another owner")
+    except RuntimeError:
+        pass
+    held.release()
+    resumed = SyncRun.begin(store, "replay", owner="b")
+    assert resumed.resumed and resumed.id == held.id
+    held.finish()
+    assert store.get(DocRef("sync_runs", "replay"))["status"] == "running"
+    resumed.finish()
+    assert store.get(DocRef("sync_runs", "replay"))["status"] == "done"
+
+
+if __name__ == "__main__":
+    tests = [(name, fn) for name, fn in list(globals().items()) if name.startswith("test_") and callable(fn)]
+    for name, fn in tests:
+        fn()
+        print(f"ok   {name}")
+    print(f"\n{len(tests)} replay tests passed")
@@ -0,0 +1,342 @@
+"""Lease-based work queue, so a sync can spread its work over several processes.
+
+A coordinator splits part of a sync into work units of one kind (course
+shards, linker teacher ranges), enqueues them as a job and waits for them.
+Workers, the coordinator included, claim a unit by leasing it for
+QUEUE_LEASE_S seconds, heartbeat while they work on it and complete it
+with a JSON result. A lease that runs out, because its worker died or
+stalled, makes the unit claimable again; a unit that keeps failing is
+given up after QUEUE_MAX_ATTEMPTS. Handlers must therefore be safe to run
+twice.
+
+Units live in the sync's own store by default (SYNC_QUEUE=store: Firestore,
+or the Firestore emulator when FIRESTORE_EMULATOR_HOST is set), or in a
+local SQLite file (SYNC_QUEUE=sqlite) for several processes on one machine.
+"""
+import os, json, time, uuid, random, socket, sqlite3, tempfile, threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from storage import get_store, DocRef
+import metrics
+from metrics import log
+
+# "store" (the sync's store) or "sqlite"
+SYNC_QUEUE = os.environ.get("SYNC_QUEUE", "store")
+SYNC_QUEUE_PATH = os.environ.get("SYNC_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "sync_queue.sqlite3"))
+QUEUE_COLLECTION = "sync_work"
+QUEUE_LEASE_S = float(os.environ.get("QUEUE_LEASE_S", "60"))
+QUEUE_MAX_ATTEMPTS = int(os.environ.get("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_POLL_S = float(os.environ.get("QUEUE_POLL_S", "0.5"))
+# A job's units are abandoned if they are not all finished after this long.
+QUEUE_JOB_TIMEOUT_S = float(os.environ.get("QUEUE_JOB_TIMEOUT_S", "1800"))
+# Units the coordinator works on itself while it waits for its job.
+QUEUE_LOCAL_WORKERS = int(os.environ.get("QUEUE_LOCAL_WORKERS", "2"))
+# Claimable units looked at per claim; picking one at random among them
+# keeps workers from all racing for the same unit.
+QUEUE_CLAIM_PAGE = 20
+
+Unit = namedtuple("Unit", ["id", "job", "kind", "payload", "attempts"])
+
+# kind -> fn(payload) -> JSON-serializable result
+HANDLERS = {}
+
+
+def handler(kind: str):
+  """Register the decorated function as the handler of `kind` units"""
+  def register(fn):
+    HANDLERS[kind] = fn
+    return fn
+  return register
+
+
+def _claimable(data: dict, now: float) -> bool:
+  if data.get("deadline", now + 1) < now:
+    return False
+  return data["status"] == "queued" or (data["status"] == "leased" and data["leaseUntil"] < now)
+
+
+class WorkQueue(ABC):
+  """Unit lifecycle over a backend's atomic single-unit update"""
+
+  @abstractmethod
+  def _insert(self, units: dict):
+    ...
+
+  @abstractmethod
+  def _update(self, unit_id: str, fn):
+    """Atomically replace the unit's data with fn(data or None) unless that is None; returns it"""
+
+  @abstractmethod
+  def _scan(self, job: str = None, statuses=None):
+    """Yield (unit_id, data), oldest job first"""
+
+  @abstractmethod
+  def purge(self, job: str):
+    ...
+
+  def enqueue(self, job: str, kind: str, payloads, timeout_s: float = None) -> list:
+    deadline = time.time() + (timeout_s or QUEUE_JOB_TIMEOUT_S)
+    units = {f"{job}__{i:05d}": {"job": job, "kind": kind, "payload": payload, "status": "queued",
+                                  "owner": None, "leaseUntil": 0, "attempts": 0, "deadline": deadline}
+             for i, payload in enumerate(payloads)}
+    self._insert(units)
+    metrics.inc("sync_queue_units_total", len(units), kind=kind, outcome="queued")
+    return list(units)
+
+  def claim(self, worker: str, job: str = None, kinds=None, lease_s: float = None):
+    """Lease a claimable unit (of `job` and `kinds`, if given), or None if there is none"""
+    now = time.time()
+    candidates = []
+    for unit_id, data in self._scan(job, ("queued", "leased")):
+      if _claimable(data, now) and (kinds is None or data["kind"] in kinds):
+        candidates.append(unit_id)
+        if len(candidates) >= QUEUE_CLAIM_PAGE:
+          break
+    random.shuffle(candidates)
+    for unit_id in candidates:
+      expired = []
+
+      def lease(data):
+        if data is None or not _claimable(data, time.time()):
+          return None
+        expired[:] = [data["status"] == "leased"]
+        return {**data, "status": "leased", "owner": worker, "leaseUntil": time.time() + (lease_s or QUEUE_LEASE_S),
+                "attempts": data["attempts"] + 1}
+
+      data = self._update(unit_id, lease)
+      if data is not None:
+        if expired[0]:
+          metrics.inc("sync_queue_units_total", kind=data["kind"], outcome="lease_expired")
+          log("QUEUE", f"Lease on {unit_id} expired, reclaimed by {worker}", unit=unit_id, worker=worker)
+        metrics.inc("sync_queue_units_total", kind=data["kind"], outcome="claimed")
+        return Unit(unit_id, data["job"], data["kind"], data["payload"], data["attempts"])
+    return None
+
+  def _owned(self, unit: Unit, worker: str, change):
+    def apply(data):
+      if data is None or data["status"] != "leased" or data["owner"] != worker:
+        return None
+      return {**data, **change(data)}
+    return self._update(unit.id, apply) is not None
+
+  def heartbeat(self, unit: Unit, worker: str, lease_s: float = None) -> bool:
+    """Extend the lease; False if `worker` no longer holds it"""
+    return self._owned(unit, worker, lambda data: {"leaseUntil": time.time() + (lease_s or QUEUE_LEASE_S)})
+
+  def complete(self, unit: Unit, worker: str, result) -> bool:
+    """Record the unit's result; False (and the result is dropped) if the lease was lost"""
+    done = self._owned(unit, worker, lambda data: {"status": "done", "result": result, "doneBy": worker})
+    metrics.inc("sync_queue_units_total", kind=unit.kind, outcome="done" if done else "lease_lost")
+    return done
+
+  def fail(self, unit: Unit, worker: str, error: str) -> bool:
+    """Put the unit back in the queue, or give up on it after QUEUE_MAX_ATTEMPTS"""
+    def change(data):
+      status = "failed" if data["attempts"] >= QUEUE_MAX_ATTEMPTS else "queued"
+      return {"status": status, "error": error, "owner": None, "leaseUntil": 0}
+    failed = self._owned(unit, worker, change)
+    metrics.inc("sync_queue_units_total", kind=unit.kind, outcome="failed" if failed else "lease_lost")
+    return failed
+
+  def units(self, job: str) -> dict:
+    return dict(self._scan(job))
+
+
+class StoreQueue(WorkQueue):
+  """Units as documents of QUEUE_COLLECTION, leased in store transactions"""
+
+  def __init__(self, store=None):
+    self.store = store or get_store()
+
+  def _insert(self, units):
+    # Orphaned units of a coordinator that died expire through a Firestore TTL policy
+    expire_at = datetime.now(timezone.utc) + timedelta(days=1)
+    ids = list(units)
+    for i in range(0, len(ids), 400):
+      b = self.store.batch()
+      for unit_id in ids[i:i + 400]:
+        b.set(DocRef(QUEUE_COLLECTION, unit_id), {**units[unit_id], "expireAt": expire_at})
+      b.commit()
+
+  def _update(self, unit_id, fn):
+    return self.store.transact(DocRef(QUEUE_COLLECTION, unit_id), fn)
+
+  def _scan(self, job=None, statuses=None):
+    where = [("job", "==", job)] if job else []
+    if statuses:
+      where.append(("status", "in", list(statuses)))
+    return self.store.scan(QUEUE_COLLECTION, where=where)
+
+  def purge(self, job):
+    refs = [DocRef(QUEUE_COLLECTION, unit_id) for unit_id, _ in self.store.scan(
+      QUEUE_COLLECTION, fields=["job"], where=[("job", "==", job)])]
+    for i in range(0, len(refs), 400):
+      b = self.store.batch()
+      for ref in refs[i:i + 400]:
+        b.delete(ref)
+      b.commit()
+
+
+class SQLiteQueue(WorkQueue):
+  """Units as rows of a local SQLite file, leased in immediate transactions"""
+
+  def __init__(self, path: str = None):
+    self.path = path or SYNC_QUEUE_PATH
+    self._local = threading.local()
+    conn = self._conn()
+    conn.execute("CREATE TABLE IF NOT EXISTS units (id TEXT PRIMARY KEY, job TEXT, status TEXT, data TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS units_status ON units (status, id)")
+
+  def _conn(self):
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+      conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+  def _insert(self, units):
+    conn = self._conn()
+    with conn:
+      conn.execute("BEGIN IMMEDIATE")
+      conn.executemany("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?)",
+                       [(unit_id, data["job"], data["status"], json.dumps(data)) for unit_id, data in units.items()])
+
+  def _update(self, unit_id, fn):
+    conn = self._conn()
+    with conn:
+      conn.execute("BEGIN IMMEDIATE")
+      row = conn.execute("SELECT data FROM units WHERE id = ?", (unit_id,)).fetchone()
+      data = fn(json.loads(row[0]) if row else None)
+      if data is not None:
+        conn.execute("UPDATE units SET status = ?, data = ? WHERE id = ?", (data["status"], json.dumps(data), unit_id))
+    return data
+
+  def _scan(self, job=None, statuses=None):
+    query, args = "SELECT id, data FROM units WHERE 1", []
+    if job:
+      query += " AND job = ?"
+      args.append(job)
+    if statuses:
+      query += f" AND status IN ({','.join('?' * len(statuses))})"
+      args.extend(statuses)
+    rows = self._conn().execute(query + " ORDER BY id", args).fetchall()
+    return ((unit_id, json.loads(data)) for unit_id, data in rows)
+
+  def purge(self, job):
+    conn = self._conn()
+    with conn:
+      conn.execute("DELETE FROM units WHERE job = ?", (job,))
+
+
+class Worker:
+  """Claims units, runs their handlers and heartbeats their leases"""
+
+  def __init__(self, queue: WorkQueue = None, name: str = None, job: str = None, kinds=None,
+               lease_s: float = None):
+    self.queue = queue or get_queue()
+    self.name = name or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    self.job = job
+    self.kinds = kinds
+    self.lease_s = lease_s or QUEUE_LEASE_S
+    self.done = 0
+
+  def _heartbeat(self, unit: Unit, finished: threading.Event):
+    while not finished.wait(self.lease_s / 3):
+      if not self.queue.heartbeat(unit, self.name, self.lease_s):
+        log("QUEUE", f"{self.name} lost its lease on {unit.id}", severity="WARNING", unit=unit.id, worker=self.name)
+        return
+
+  def work_one(self) -> bool:
+    """Run one claimable unit; False if there was none"""
+    unit = self.queue.claim(self.name, job=self.job, kinds=self.kinds, lease_s=self.lease_s)
+    if unit is None:
+      return False
+    finished = threading.Event()
+    threading.Thread(target=self._heartbeat, args=(unit, finished), daemon=True).start()
+    try:
+      fn = HANDLERS.get(unit.kind)
+      if fn is None:
+        raise LookupError(f"No handler for {unit.kind} units")
+      result = fn(unit.payload)
+    except Exception as e:
+      finished.set()
+      log("QUEUE", f"{unit.kind} unit {unit.id} failed (attempt {unit.attempts}): {e}", severity="ERROR",
+          unit=unit.id, kind=unit.kind, attempt=unit.attempts, worker=self.name)
+      self.queue.fail(unit, self.name, str(e))
+      return True
+    finished.set()
+    if not self.queue.complete(unit, self.name, result):
+      log("QUEUE", f"Dropped the result of {unit.id}: its lease went to another worker", severity="WARNING",
+          unit=unit.id, worker=self.name)
+    self.done += 1
+    return True
+
+  def run(self, stop: threading.Event = None, idle_s: float = None):
+    """Work units until `stop` is set, polling every `idle_s` while the queue is empty"""
+    stop = stop or threading.Event()
+    log("QUEUE", f"Worker {self.name} started", worker=self.name)
+    while not stop.is_set():
+      try:
+        if self.work_one():
+          continue
+      except Exception as e:
+        log("QUEUE", f"Worker {self.name} could not claim: {e}", severity="ERROR", worker=self.name)
+      stop.wait(idle_s or QUEUE_POLL_S)
+    log("QUEUE", f"Worker {self.name} stopped after {self.done} units", worker=self.name, units=self.done)
+
+
+def run_units(kind: str, payloads, local_workers: int = None, timeout_s: float = None) -> list:
+  """Enqueue `payloads` as one job of `kind` units and wait for all of them.
+
+  The calling process works on the job too, with `local_workers` threads,
+  so the job finishes even when no worker is running. Returns a
+  (result, error) pair per payload, in order; error is None for units that
+  completed.
+  """
+  payloads = list(payloads)
+  if not payloads:
+    return []
+  queue = get_queue()
+  timeout_s = timeout_s or QUEUE_JOB_TIMEOUT_S
+  job = f"{time.strftime('%Y%m%d%H%M%S')}-{kind}-{uuid.uuid4().hex[:6]}"
+  unit_ids = queue.enqueue(job, kind, payloads, timeout_s)
+  log("QUEUE", f"Queued {len(unit_ids)} {kind} units as {job}", job=job, kind=kind, units=len(unit_ids))
+
+  stop = threading.Event()
+  helpers = [threading.Thread(target=Worker(queue, job=job).run, args=(stop,), daemon=True)
+             for _ in range(QUEUE_LOCAL_WORKERS if local_workers is None else local_workers)]
+  for t in helpers:
+    t.start()
+  started = time.time()
+  try:
+    while True:
+      units = queue.units(job)
+      if all(u["status"] in ("done", "failed") for u in units.values()):
+        break
+      if time.time() - started > timeout_s:
+        raise TimeoutError(f"{sum(u['status'] not in ('done', 'failed') for u in units.values())} "
+                           f"{kind} units of {job} unfinished after {timeout_s:.0f}s")
+      time.sleep(QUEUE_POLL_S)
+  finally:
+    stop.set()
+    for t in helpers:
+      t.join()
+    queue.purge(job)
+  workers = {u["doneBy"] for u in units.values() if u.get("doneBy")}
+  log("QUEUE", f"{job}: {sum(u['status'] == 'done' for u in units.values())} of {len(units)} units done "
+      f"by {len(workers)} workers in {time.time() - started:.1f}s", job=job, kind=kind, workers=len(workers))
+  return [(units[i].get("result"), None) if units[i]["status"] == "done" else (None, units[i].get("error") or "failed")
+          for i in unit_ids]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue() -> WorkQueue:
+  """Process-wide queue, created on first use from SYNC_QUEUE"""
+  global _queue
+  with _queue_lock:
+    if _queue is None:
+      _queue = SQLiteQueue() if SYNC_QUEUE == "sqlite" else StoreQueue()
+    return _queue
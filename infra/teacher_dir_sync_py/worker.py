@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Run sync work units claimed from the work queue until interrupted
+
+Usage: worker.py [--threads N]
+
+Start any number of these beside a service running with SYNC_ROLE=coordinator,
+with the same SYNC_STORE, SYNC_QUEUE (and SYNC_QUEUE_PATH for sqlite) and
+fetch settings. Each thread claims one unit at a time; units whose worker
+dies are reclaimed by another once their lease runs out.
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+
+# Add the parent directory to the path so we can import the main module
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import main  # noqa: F401  registers the work unit handlers
+from work_queue import Worker, get_queue
+
+
+def main_loop():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("SYNC_WORKER_THREADS", "4")))
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    queue = get_queue()
+    threads = [threading.Thread(target=Worker(queue).run, args=(stop,)) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    while not stop.wait(1):
+        pass
+    for t in threads:
+        t.join()
+
+
+if __name__ == "__main__":
+    main_loop()